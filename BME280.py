@@ -1,13 +1,13 @@
-import time
+import utime as time
 from ustruct import unpack, unpack_from
 from array import array
 from machine import I2C, Pin
+from micropython import const
 
-# Pins used for I2C on PSoC board
-scl_pin = Pin('P6_0')
-sda_pin = Pin('P6_1')  
-
-i2c = I2C(0, scl=scl_pin, sda=sda_pin, freq=400000)  # Instantiate I2C with PSoC 6 pins
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
 
 # BME280 default address.
 BME280_I2CADDR = 0x76
@@ -19,18 +19,86 @@ BME280_OSAMPLE_4 = 3
 BME280_OSAMPLE_8 = 4
 BME280_OSAMPLE_16 = 5
 
-BME280_REGISTER_CONTROL_HUM = 0xF2
-BME280_REGISTER_STATUS = 0xF3
-BME280_REGISTER_CONTROL = 0xF4
-
-MODE_SLEEP = const(0)
-MODE_FORCED = const(1)
-MODE_NORMAL = const(3)
+# register map, see regmaps/bme280.json
+# BEGIN GENERATED regmaps/bme280.json
+# BME280 registers
+# dig_T1 to dig_H1
+BME280_CALIB00 = const(0x88)
+BME280_ID = const(0xd0)
+BME280_RESET = const(0xe0)
+# dig_H2 to dig_H6
+BME280_CALIB26 = const(0xe1)
+# takes effect with the next write of CTRL_MEAS
+BME280_CTRL_HUM = const(0xf2)
+BME280_STATUS = const(0xf3)
+BME280_CTRL_MEAS = const(0xf4)
+BME280_CONFIG = const(0xf5)
+BME280_PRESS_MSB = const(0xf7)
+
+# CTRL_HUM fields
+BME280_OSRS_H = const(0x07)
+BME280_OSRS_H_SHIFT = const(0)
+BME280_CTRL_HUM_MASK = const(0x07)
+
+# STATUS fields
+BME280_MEASURING = const(0x08)
+BME280_IM_UPDATE = const(0x01)
+BME280_STATUS_MASK = const(0x09)
+
+# CTRL_MEAS fields
+BME280_OSRS_T = const(0xe0)
+BME280_OSRS_T_SHIFT = const(5)
+BME280_OSRS_P = const(0x1c)
+BME280_OSRS_P_SHIFT = const(2)
+BME280_MODE = const(0x03)
+BME280_MODE_SHIFT = const(0)
+BME280_MODE_SLEEP = const(0x00)
+BME280_MODE_FORCED = const(0x01)
+BME280_MODE_NORMAL = const(0x03)
+BME280_CTRL_MEAS_MASK = const(0xff)
+
+# CONFIG fields
+BME280_T_SB = const(0xe0)
+BME280_T_SB_SHIFT = const(5)
+BME280_FILTER = const(0x1c)
+BME280_FILTER_SHIFT = const(2)
+BME280_CONFIG_MASK = const(0xfc)
+
+# burst reads, start register and length
+BME280_CALIB_A_REG = const(0x88)
+BME280_CALIB_A_LEN = const(26)
+BME280_CALIB_B_REG = const(0xe1)
+BME280_CALIB_B_LEN = const(7)
+# pressure, temperature and humidity
+BME280_DATA_REG = const(0xf7)
+BME280_DATA_LEN = const(8)
+# END GENERATED regmaps/bme280.json
+
+BME280_REGISTER_CONTROL_HUM = BME280_CTRL_HUM
+BME280_REGISTER_STATUS = BME280_STATUS
+BME280_REGISTER_CONTROL = BME280_CTRL_MEAS
+
+MODE_SLEEP = BME280_MODE_SLEEP
+MODE_FORCED = BME280_MODE_FORCED
+MODE_NORMAL = BME280_MODE_NORMAL
 
 BME280_TIMEOUT = const(100)  # about 1 second timeout
 
+# Bytes of the raw data registers 0xF7 to 0xFE
+BME280_RAW_BLOCK = BME280_DATA_LEN
+
+# Normal mode standby time between conversions per CONFIG t_sb value, us
+BME280_T_SB_US = (500, 62500, 125000, 250000, 500000, 1000000, 10000, 20000)
+
 class BME280:
 
+    # sensor protocol, see mipy/sensor.py
+    fields = ('temperature', 'pressure', 'humidity')
+    units = ('C', 'Pa', '%RH')
+    raw_block_size = BME280_RAW_BLOCK
+    # converts on its own only in normal mode, see normal_mode()
+    continuous = False
+
     def __init__(self, i2c, mode=BME280_OSAMPLE_8, address=BME280_I2CADDR, **kwargs):
         if type(mode) is tuple and len(mode) == 3:
             self._mode_hum, self._mode_temp, self._mode_press = mode
@@ -54,8 +122,10 @@ class BME280:
         self.__sealevel = 101325
 
         # load calibration data
-        dig_88_a1 = self.i2c.readfrom_mem(self.address, 0x88, 26)
-        dig_e1_e7 = self.i2c.readfrom_mem(self.address, 0xE1, 7)
+        dig_88_a1 = self.i2c.readfrom_mem(self.address, BME280_CALIB_A_REG,
+                                          BME280_CALIB_A_LEN)
+        dig_e1_e7 = self.i2c.readfrom_mem(self.address, BME280_CALIB_B_REG,
+                                          BME280_CALIB_B_LEN)
 
         self.dig_T1, self.dig_T2, self.dig_T3, self.dig_P1, \
             self.dig_P2, self.dig_P3, self.dig_P4, self.dig_P5, \
@@ -73,11 +143,117 @@ class BME280:
         self._l8_barray = bytearray(8)
         self._l3_resultarray = array("i", [0, 0, 0])
 
-        self._l1_barray[0] = self._mode_temp << 5 | self._mode_press << 2 | MODE_SLEEP
-        self.i2c.writeto_mem(self.address, BME280_REGISTER_CONTROL,
-                             self._l1_barray)
+        # ctrl_hum only takes effect with the next ctrl_meas write and keeps
+        # its value, so it is written once here instead of before every
+        # conversion
+        self._l1_barray[0] = self._mode_hum << BME280_OSRS_H_SHIFT
+        self.i2c.writeto_mem(self.address, BME280_CTRL_HUM, self._l1_barray)
+        self._ctrl_meas = (self._mode_temp << BME280_OSRS_T_SHIFT |
+                           self._mode_press << BME280_OSRS_P_SHIFT)
+        self._l1_barray[0] = self._ctrl_meas | BME280_MODE_SLEEP
+        self.i2c.writeto_mem(self.address, BME280_CTRL_MEAS, self._l1_barray)
         self.t_fine = 0
 
+        # maximum forced mode conversion time as per datasheet, in us
+        self.measurement_time_us = (1250 + 2300 * (1 << (self._mode_temp - 1)) +
+                                    2300 * (1 << (self._mode_press - 1)) + 575 +
+                                    2300 * (1 << (self._mode_hum - 1)) + 575)
+        self._pending = False
+        self._normal = False
+        self._t_sb = 0
+        self.normal_period_us = 0
+        # normal mode: a conversion was seen running since the last read
+        self._converting = False
+        self._busy_us = 0
+        self._read_us = 0
+
+    def start_measurement(self):
+        """ Starts a forced mode conversion and returns without waiting.
+            The next read collects its result instead of starting another.
+        """
+        self._l1_barray[0] = self._ctrl_meas | BME280_MODE_FORCED
+        self.i2c.writeto_mem(self.address, BME280_CTRL_MEAS, self._l1_barray)
+        self._pending = True
+
+    def sleep(self):
+        """ Enters sleep mode and drops a pending conversion. A forced
+            conversion returns to sleep mode on its own, so this only
+            matters when a conversion is abandoned or normal mode was set.
+        """
+        self._l1_barray[0] = self._ctrl_meas | BME280_MODE_SLEEP
+        self.i2c.writeto_mem(self.address, BME280_CTRL_MEAS, self._l1_barray)
+        self._pending = False
+        self._normal = False
+        self.continuous = False
+
+    def normal_mode(self, t_sb=0):
+        """ Converts continuously, a new result every normal_period_us, so
+            that reads only transfer the result registers instead of
+            starting a conversion and waiting for it. sleep() ends it.
+
+            Args:
+                t_sb: standby time between conversions, CONFIG t_sb:
+                    0 0.5 ms, 1 62.5 ms, 2 125 ms, 3 250 ms, 4 500 ms,
+                    5 1 s, 6 10 ms, 7 20 ms
+        """
+        if self._normal:
+            # CONFIG writes may be ignored in normal mode
+            self.sleep()
+        self._l1_barray[0] = t_sb << BME280_T_SB_SHIFT
+        self.i2c.writeto_mem(self.address, BME280_CONFIG, self._l1_barray)
+        self._l1_barray[0] = self._ctrl_meas | BME280_MODE_NORMAL
+        self.i2c.writeto_mem(self.address, BME280_CTRL_MEAS, self._l1_barray)
+        self._t_sb = t_sb
+        self._normal = True
+        self.continuous = True
+        self._pending = False
+        self._converting = False
+        self._read_us = time.ticks_us()
+        self.normal_period_us = self.measurement_time_us + BME280_T_SB_US[t_sb]
+
+    def wake(self):
+        """ Nothing to do, start_measurement converts from sleep mode.
+        """
+        pass
+
+    def restore(self):
+        """ Writes the oversampling settings again, e.g. after the sensor
+            was reset by a bus fault. A pending forced conversion is
+            started again. The calibration data read in __init__ stays
+            valid.
+        """
+        self._l1_barray[0] = self._mode_hum << BME280_OSRS_H_SHIFT
+        self.i2c.writeto_mem(self.address, BME280_CTRL_HUM, self._l1_barray)
+        if self._normal:
+            self._normal = False
+            self.normal_mode(self._t_sb)
+        elif self._pending:
+            # the reset dropped the conversion, start it again
+            self.start_measurement()
+        else:
+            self.sleep()
+
+    def measurement_ready(self):
+        """ Returns True when a result not read yet is available: in forced
+            mode when no conversion is running, in normal mode when a
+            conversion finished since the last read. The status bit only
+            shows a running conversion; one seen running has finished
+            measurement_time_us later at the latest, even if the next one
+            runs by then. A full normal_period_us since the last read
+            counts as ready too, in case the polls missed the conversions.
+        """
+        busy = self.i2c.readfrom_mem(self.address, BME280_STATUS, 1)[0] & BME280_MEASURING
+        if not self._normal:
+            return not busy
+        now = time.ticks_us()
+        if busy:
+            if not self._converting:
+                self._converting = True
+                self._busy_us = now
+            return time.ticks_diff(now, self._busy_us) >= self.measurement_time_us
+        return self._converting or \
+            time.ticks_diff(now, self._read_us) >= self.normal_period_us
+
     def read_raw_data(self, result):
         """ Reads the raw (uncompensated) data from the sensor.
 
@@ -87,25 +263,93 @@ class BME280:
             Returns:
                 None
         """
-
-        self._l1_barray[0] = self._mode_hum
-        self.i2c.writeto_mem(self.address, BME280_REGISTER_CONTROL_HUM,
-                             self._l1_barray)
-        self._l1_barray[0] = self._mode_temp << 5 | self._mode_press << 2 | MODE_FORCED
-        self.i2c.writeto_mem(self.address, BME280_REGISTER_CONTROL,
-                             self._l1_barray)
+        self._wait_conversion()
+        self._read_raw_result(result)
+
+    def _wait_conversion(self):
+        if self._normal:
+            # the next result of normal mode
+            t0 = time.ticks_us()
+            while not self.measurement_ready():
+                if time.ticks_diff(time.ticks_us(), t0) > 2 * self.normal_period_us:
+                    raise RuntimeError("Sensor BME280 not ready")
+                time.sleep_ms(1)
+            return
+        if not self._pending:
+            self.start_measurement()
 
         # Wait for conversion to complete
         for _ in range(BME280_TIMEOUT):
-            if self.i2c.readfrom_mem(self.address, BME280_REGISTER_STATUS, 1)[0] & 0x08:
-                time.sleep_ms(10)  # still busy
-            else:
+            if self.measurement_ready():
                 break  # Sensor ready
+            time.sleep_ms(10)  # still busy
         else:
             raise RuntimeError("Sensor BME280 not ready")
 
+    def _mark_read(self):
+        self._pending = False
+        self._converting = False
+        self._read_us = time.ticks_us()
+
+    def read_raw_block(self, buf):
+        """ Reads the raw data registers 0xF7 to 0xFE as they are into buf,
+            a bytearray or memoryview of raw_block_size bytes, for
+            compensation later with compensate_block. In normal mode this
+            is the one burst read of the latest result, check
+            measurement_ready() for a new one first (mipy.raw.RawRing
+            does); otherwise a forced conversion is run and waited for.
+        """
+        if not self._normal:
+            self._wait_conversion()
+        self._mark_read()
+        self.i2c.readfrom_mem_into(self.address, BME280_DATA_REG, buf)
+
+    def compensate_block(self, raw, result, offset=0):
+        """ Compensates consecutive raw blocks as read by read_raw_block.
+
+            Args:
+                raw: bytes holding a multiple of raw_block_size bytes
+                result: receives temperature, pressure and humidity of
+                    every block from result[offset] on
+            Returns:
+                index after the last value written
+        """
+        r = self._l3_resultarray
+        for i in range(0, len(raw) - BME280_RAW_BLOCK + 1, BME280_RAW_BLOCK):
+            r[0] = ((raw[i + 3] << 16) | (raw[i + 4] << 8) | raw[i + 5]) >> 4
+            r[1] = ((raw[i] << 16) | (raw[i + 1] << 8) | raw[i + 2]) >> 4
+            r[2] = (raw[i + 6] << 8) | raw[i + 7]
+            self.compensate(r, result, offset)
+            offset += 3
+        return offset
+
+    async def read_raw_data_async(self, result):
+        """ Same as read_raw_data, but yields to the uasyncio loop while the
+            sensor converts.
+        """
+        if self._normal:
+            t0 = time.ticks_us()
+            while not self.measurement_ready():
+                if time.ticks_diff(time.ticks_us(), t0) > 2 * self.normal_period_us:
+                    raise RuntimeError("Sensor BME280 not ready")
+                await asyncio.sleep_ms(1)
+            self._read_raw_result(result)
+            return
+        if not self._pending:
+            self.start_measurement()
+        await asyncio.sleep_ms(self.measurement_time_us // 1000)
+        for _ in range(BME280_TIMEOUT):
+            if self.measurement_ready():
+                break
+            await asyncio.sleep_ms(1)
+        else:
+            raise RuntimeError("Sensor BME280 not ready")
+        self._read_raw_result(result)
+
+    def _read_raw_result(self, result):
+        self._mark_read()
         # burst readout from 0xF7 to 0xFE, recommended by datasheet
-        self.i2c.readfrom_mem_into(self.address, 0xF7, self._l8_barray)
+        self.i2c.readfrom_mem_into(self.address, BME280_DATA_REG, self._l8_barray)
         readout = self._l8_barray
         # pressure(0xF7): ((msb << 16) | (lsb << 8) | xlsb) >> 4
         raw_press = ((readout[0] << 16) | (readout[1] << 8) | readout[2]) >> 4
@@ -131,7 +375,63 @@ class BME280:
                 from the result parameter if not None
         """
         self.read_raw_data(self._l3_resultarray)
-        raw_temp, raw_press, raw_hum = self._l3_resultarray
+        return self.compensate(self._l3_resultarray, result)
+
+    async def read_async(self, result=None):
+        """ Same as read_compensated_data, but yields to the uasyncio loop
+            while the sensor converts.
+        """
+        await self.read_raw_data_async(self._l3_resultarray)
+        return self.compensate(self._l3_resultarray, result)
+
+    def read_into(self, buf, offset=0):
+        """ Reads temperature, pressure and humidity into buf[offset:]
+            without allocating a result.
+
+            Returns:
+                index after the last value written
+        """
+        self.read_raw_data(self._l3_resultarray)
+        self.compensate(self._l3_resultarray, buf, offset)
+        return offset + 3
+
+    def raw_into(self, buf, offset=0):
+        """ Reads the raw temperature, pressure and humidity into
+            buf[offset:].
+
+            Returns:
+                index after the last value written
+        """
+        raw = self._l3_resultarray
+        self.read_raw_data(raw)
+        buf[offset] = raw[0]
+        buf[offset + 1] = raw[1]
+        buf[offset + 2] = raw[2]
+        return offset + 3
+
+    def calibration(self):
+        """ Calibration needed to compensate raw data elsewhere, e.g. with
+            host/compensate.py.
+
+            Returns:
+                dict of the trimming parameters dig_T1 to dig_H6
+        """
+        return {name: getattr(self, name) for name in (
+            'dig_T1', 'dig_T2', 'dig_T3', 'dig_P1', 'dig_P2', 'dig_P3',
+            'dig_P4', 'dig_P5', 'dig_P6', 'dig_P7', 'dig_P8', 'dig_P9',
+            'dig_H1', 'dig_H2', 'dig_H3', 'dig_H4', 'dig_H5', 'dig_H6')}
+
+    def compensate(self, raw, result=None, offset=0):
+        """ Compensates raw data as returned by read_raw_data.
+
+            Args:
+                raw: raw temperature, pressure, humidity
+                result: as for read_compensated_data
+                offset: index in result of the temperature
+            Returns:
+                as for read_compensated_data
+        """
+        raw_temp, raw_press, raw_hum = raw
         # temperature
         var1 = (raw_temp/16384.0 - self.dig_T1/1024.0) * self.dig_T2
         var2 = raw_temp/131072.0 - self.dig_T1/8192.0
@@ -166,10 +466,10 @@ class BME280:
         if (humidity > 100):
             humidity = 100.0
 
-        if result:
-            result[0] = temp
-            result[1] = pressure
-            result[2] = humidity
+        if result is not None:
+            result[offset] = temp
+            result[offset + 1] = pressure
+            result[offset + 2] = humidity
             return result
 
         return array("f", (temp, pressure, humidity))
@@ -216,6 +516,13 @@ class BME280:
         return ("{:.2f}C".format(t), "{:.2f}hPa".format(p/100),
                 "{:.2f}%".format(h))
 
-sensor = BME280(i2c=i2c)
+if __name__ == '__main__':
+    # Pins used for I2C on PSoC board
+    scl_pin = Pin('P6_0')
+    sda_pin = Pin('P6_1')
+
+    i2c = I2C(0, scl=scl_pin, sda=sda_pin, freq=400000)  # Instantiate I2C with PSoC 6 pins
+
+    sensor = BME280(i2c=i2c)
 
-print(sensor.values)
\ No newline at end of file
+    print(sensor.values)
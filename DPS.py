@@ -1,25 +1,113 @@
 import machine
 from machine import I2C
+from micropython import const
 import utime as time
 
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+# register map, see regmaps/dps368.json
+# BEGIN GENERATED regmaps/dps368.json
+# DPS368 registers
+# pressure result, 24 bit two's complement, big endian
+DPS_PSR_B2 = const(0x00)
+# temperature result, 24 bit two's complement, big endian
+DPS_TMP_B2 = const(0x03)
+DPS_PRS_CFG = const(0x06)
+DPS_TMP_CFG = const(0x07)
+DPS_MEAS_CFG = const(0x08)
+DPS_CFG_REG = const(0x09)
+DPS_PROD_ID = const(0x0d)
+# calibration coefficients c0 to c30
+DPS_COEF = const(0x10)
+
+# PRS_CFG fields
+# 2**n measurements per second
+DPS_PM_RATE = const(0x70)
+DPS_PM_RATE_SHIFT = const(4)
+# 2**n times oversampling
+DPS_PM_PRC = const(0x0f)
+DPS_PM_PRC_SHIFT = const(0)
+DPS_PRS_CFG_MASK = const(0x7f)
+
+# TMP_CFG fields
+# 1: external (MEMS) temperature sensor
+DPS_TMP_EXT = const(0x80)
+DPS_TMP_RATE = const(0x70)
+DPS_TMP_RATE_SHIFT = const(4)
+DPS_TMP_PRC = const(0x0f)
+DPS_TMP_PRC_SHIFT = const(0)
+DPS_TMP_CFG_MASK = const(0xff)
+
+# MEAS_CFG fields
+DPS_COEF_RDY = const(0x80)
+DPS_SENSOR_RDY = const(0x40)
+# cleared when TMP_B2 is read
+DPS_TMP_RDY = const(0x20)
+# cleared when PSR_B2 is read
+DPS_PRS_RDY = const(0x10)
+DPS_MEAS_CTRL = const(0x07)
+DPS_MEAS_CTRL_SHIFT = const(0)
+DPS_MEAS_CTRL_IDLE = const(0x00)
+DPS_MEAS_CTRL_PRS = const(0x01)
+DPS_MEAS_CTRL_TMP = const(0x02)
+DPS_MEAS_CTRL_BG_PRS = const(0x05)
+DPS_MEAS_CTRL_BG_TMP = const(0x06)
+DPS_MEAS_CTRL_BG_ALL = const(0x07)
+DPS_MEAS_CFG_MASK = const(0xf7)
+
+# CFG_REG fields
+# required for more than 8 times temperature oversampling
+DPS_T_SHIFT = const(0x08)
+# required for more than 8 times pressure oversampling
+DPS_P_SHIFT = const(0x04)
+DPS_CFG_REG_MASK = const(0x0c)
+
+# burst reads, start register and length
+# pressure and temperature results
+DPS_RESULTS_REG = const(0x00)
+DPS_RESULTS_LEN = const(6)
+DPS_COEFS_REG = const(0x10)
+DPS_COEFS_LEN = const(18)
+
+# burst writes, start register and the bytes to write
+# 4 Hz and 64 times oversampling for pressure and temperature, background mode
+DPS_CONFIG_REG = const(0x06)
+DPS_CONFIG = b'\x26\xa6\x07\x0c'
+
+# write sequences, (register, value) byte pairs
+# undocumented quirk fix for temperature readings that are far too high
+DPS_TEMP_FIX = b'\x0e\xa5\x0f\x96\x62\x02\x0e\x00\x0f\x00'
+# END GENERATED regmaps/dps368.json
+
 def getTwosComplement(raw_val, length):
     """Get two's complement of `raw_val`.
-        Args:
-            raw_val (int): Raw value
-            length (int): Max bit length
-        Returns:
-            int: Two's complement
-        """
-        if raw_val & (1 << (length - 1)):
-            raw_val = raw_val - (1 << length)
-        return raw_val
+    Args:
+        raw_val (int): Raw value
+        length (int): Max bit length
+    Returns:
+        int: Two's complement
+    """
+    if raw_val & (1 << (length - 1)):
+        raw_val = raw_val - (1 << length)
+    return raw_val
 
 class DPS:
 
     """Class of DPS, Pressure and Temperature sensor.
     """
 
-    def __init__(self, scl_pin, sda_pin, addr=0x77):
+    # sensor protocol, see mipy/sensor.py
+    fields = ('pressure', 'temperature')
+    units = ('Pa', 'C')
+    # PRS_B2 to TMP_B0, registers 0x00 to 0x05
+    raw_block_size = DPS_RESULTS_LEN
+    # measures on its own in background mode, start_measurement is a no-op
+    continuous = True
+
+    def __init__(self, scl_pin='P6_0', sda_pin='P6_1', addr=0x77, i2c=None):
 
         # Compensation Scale Factors
 
@@ -44,15 +132,23 @@ class DPS:
         # 128 times                  | 2088960
 
         """Initial setting.
-        Execute `self.correctTemperature()` and `self.setOversamplingRate()`.
+        Execute `self.correctTemperature()`, `self.setOversamplingRate()`
+        and `self.readCalibration()`.
+        Args:
+            scl_pin, sda_pin: Pins of I2C 0, used when no i2c is given
+            addr (int): I2C address
+            i2c: I2C object or mipy.bus device shared with other drivers
         """
 
         self.addr = addr
         self.kP = 1040384
         self.kT = 1040384
-        self.bus = machine.I2C(0, scl='P6_0', sda='P6_1')
+        if i2c is None:
+            i2c = machine.I2C(0, scl=scl_pin, sda=sda_pin)
+        self.bus = i2c
         self.correctTemperature()
         self.setOversamplingRate()
+        self.readCalibration()
 
     def correctTemperature(self):
         """
@@ -72,13 +168,12 @@ class DPS:
 
         Note: The specific values written to the sensor's registers (0xA5, 0x96, etc.) 
         have been based on the sensor's datasheet and empirical adjustments to 
-        counteract the reported issue.
+        counteract the reported issue. They are listed as TEMP_FIX in
+        regmaps/dps368.json.
         """
-        self.bus.writeto(self.addr, bytes([0x0E, 0xA5]))
-        self.bus.writeto(self.addr, bytes([0x0F, 0x96]))
-        self.bus.writeto(self.addr, bytes([0x62, 0x02]))
-        self.bus.writeto(self.addr, bytes([0x0E, 0x00]))
-        self.bus.writeto(self.addr, bytes([0x0F, 0x00]))
+        seq = memoryview(DPS_TEMP_FIX)
+        for i in range(0, len(seq), 2):
+            self.bus.writeto(self.addr, seq[i:i + 2])
  
     def setOversamplingRate(self):
         """Set oversampling rate.
@@ -86,19 +181,129 @@ class DPS:
         Pressure oversampling rate   : 64 times
         Temperature measurement rate :  4 Hz
         Temperature oversampling rate: 64 times
+        PRS_CFG to CFG_REG are written in one burst, the bytes are CONFIG in
+        regmaps/dps368.json.
+        """
+        self.bus.writeto_mem(self.addr, DPS_CONFIG_REG, DPS_CONFIG)
+        # a new pressure and temperature pair every 1/4 s
+        self.measurement_time_us = 250000
+        # after wake() the first pair takes a full measurement period
+        self.wake_time_us = self.measurement_time_us
+
+    def sleep(self):
+        """Put the sensor in standby, the lowest power state keeping the
+        configuration. It stops measuring until wake().
+        """
+        self.bus.writeto(self.addr, bytes([DPS_MEAS_CFG, DPS_MEAS_CTRL_IDLE]))
+
+    def restore(self):
+        """Write the temperature fix and the configuration again, e.g.
+        after the sensor was reset by a bus fault. The calibration
+        coefficients read in __init__ stay valid.
         """
-        self.bus.writeto(self.addr, bytes([0x06, 0x26]))
-        self.bus.writeto(self.addr, bytes([0x07, 0xA6]))
-        self.bus.writeto(self.addr, bytes([0x08, 0x07]))
-        self.bus.writeto(self.addr, bytes([0x09, 0x0C]))
+        self.correctTemperature()
+        self.setOversamplingRate()
+
+    def wake(self):
+        """Restart background measurement of pressure and temperature,
+        results are ready wake_time_us later.
+        """
+        self.bus.writeto(self.addr, bytes([DPS_MEAS_CFG, DPS_MEAS_CTRL_BG_ALL]))
+
+    def start_measurement(self):
+        """Nothing to start, the sensor measures continuously in background
+        mode. Present so that DPS can be used like the triggered sensors.
+        """
+        pass
+
+    def measurement_ready(self):
+        """Check whether new pressure and temperature results are available.
+        Returns:
+            bool: True if both results were updated since they were last read
+        """
+        meas_cfg = self.bus.readfrom_mem(self.addr, DPS_MEAS_CFG, 1)[0]
+        # cleared when the results are read
+        ready = DPS_PRS_RDY | DPS_TMP_RDY
+        return meas_cfg & ready == ready
+
+    async def read_async(self):
+        """Wait for the next background measurement without blocking the
+        uasyncio loop, then read it.
+        Returns:
+            float: Compensated pressure [Pa]
+            float: Compensated temperature [C]
+        """
+        while not self.measurement_ready():
+            await asyncio.sleep_ms(10)
+        p = self.calcScaledPressure()
+        t = self.calcScaledTemperature()
+        return self.calcCompPressure(p, t), self.calcCompTemperature(t)
+
+    def read_into(self, buf, offset=0):
+        """Measure pressure and temperature into caller-owned storage.
+        Args:
+            buf: array or alike, receives pressure [Pa] at offset and
+                temperature [C] at offset + 1
+            offset (int): Index of the first value
+        Returns:
+            int: Index after the last value written
+        """
+        p = self.calcScaledPressure()
+        t = self.calcScaledTemperature()
+        buf[offset] = self.calcCompPressure(p, t)
+        buf[offset + 1] = self.calcCompTemperature(t)
+        return offset + 2
+
+    def raw_into(self, buf, offset=0):
+        """Read raw pressure and temperature into caller-owned storage.
+        Args:
+            buf: array or alike, receives raw pressure at offset and raw
+                temperature at offset + 1
+            offset (int): Index of the first value
+        Returns:
+            int: Index after the last value written
+        """
+        buf[offset] = self.getRawPressure()
+        buf[offset + 1] = self.getRawTemperature()
+        return offset + 2
+
+    def read_raw_block(self, buf):
+        """Read the pressure and temperature result registers (0x00 to
+        0x05) in one burst, as they are, for compensation later with
+        compensate_block. The registers keep the last background result;
+        check measurement_ready() for a new one first (mipy.raw.RawRing
+        does), reading clears PRS_RDY and TMP_RDY.
+        Args:
+            buf: bytearray or memoryview of raw_block_size bytes
+        """
+        self.bus.readfrom_mem_into(self.addr, DPS_RESULTS_REG, buf)
+
+    def compensate_block(self, raw, result, offset=0):
+        """Compensate consecutive raw blocks as read by read_raw_block.
+        Args:
+            raw: bytes holding a multiple of raw_block_size bytes
+            result: receives pressure [Pa] and temperature [C] of every
+                block from result[offset] on
+            offset (int): Index of the first value
+        Returns:
+            int: Index after the last value written
+        """
+        for i in range(0, len(raw) - 5, 6):
+            p = (raw[i] << 16) | (raw[i + 1] << 8) | raw[i + 2]
+            t = (raw[i + 3] << 16) | (raw[i + 4] << 8) | raw[i + 5]
+            scaled_p = getTwosComplement(p, 24) / self.kP
+            scaled_t = getTwosComplement(t, 24) / self.kT
+            result[offset] = self.calcCompPressure(scaled_p, scaled_t)
+            result[offset + 1] = self.calcCompTemperature(scaled_t)
+            offset += 2
+        return offset
 
     def getRawPressure(self):
         """Get raw pressure from sensor.
         Returns:
             int: Raw pressure
         """
-        self.bus.writeto(self.addr, bytes([0x00]))
-        p_bytes = self.bus.readfrom(self.addr, 3)
+        p_bytes = self.bus.readfrom_mem(self.addr, DPS_PSR_B2, 3)
         p = int.from_bytes(p_bytes, 'big') & 0xFFFFFF
         return getTwosComplement(p, 24)
 
@@ -107,13 +312,50 @@ class DPS:
         Returns:
             int: Raw temperature
         """
-        self.bus.writeto(self.addr, bytes([0x03]))
-        t_bytes = self.bus.readfrom(self.addr, 3)
+        t_bytes = self.bus.readfrom_mem(self.addr, DPS_TMP_B2, 3)
         t = int.from_bytes(t_bytes, 'big') & 0xFFFFFF
         return getTwosComplement(t, 24)
 
+    def readCalibration(self):
+        """Read the calibration coefficients (registers 0x10 to 0x21) in one
+        burst and keep them, they are fixed for the life of the sensor.
+        Waits up to 40 ms for COEF_RDY after power on.
+        """
+        for _ in range(40):
+            if self.bus.readfrom_mem(self.addr, DPS_MEAS_CFG, 1)[0] & DPS_COEF_RDY:
+                break
+            time.sleep_ms(1)
+        else:
+            raise RuntimeError("DPS coefficients not ready")
+        b = self.bus.readfrom_mem(self.addr, DPS_COEFS_REG, DPS_COEFS_LEN)
+
+        c0 = getTwosComplement((b[0] << 4) | (b[1] >> 4), 12)
+        c1 = getTwosComplement(((b[1] & 0x0F) << 8) | b[2], 12)
+        c00 = getTwosComplement((b[3] << 12) | (b[4] << 4) | (b[5] >> 4), 20)
+        c10 = getTwosComplement(((b[5] & 0x0F) << 16) | (b[6] << 8) | b[7], 20)
+        c01 = self._combineCoefficients(b[8:10], 16)
+        c11 = self._combineCoefficients(b[10:12], 16)
+        c20 = self._combineCoefficients(b[12:14], 16)
+        c21 = self._combineCoefficients(b[14:16], 16)
+        c30 = self._combineCoefficients(b[16:18], 16)
+
+        self._temp_coeffs = (c0, c1)
+        self._press_coeffs = (c00, c10, c20, c30, c01, c11, c21)
+
+    def calibration(self):
+        """Calibration needed to compensate raw readings elsewhere, e.g.
+        with host/compensate.py.
+        Returns:
+            dict: Coefficients c0 to c30 and scale factors kP and kT
+        """
+        c0, c1 = self._temp_coeffs
+        c00, c10, c20, c30, c01, c11, c21 = self._press_coeffs
+        return {'c0': c0, 'c1': c1, 'c00': c00, 'c10': c10, 'c20': c20,
+                'c30': c30, 'c01': c01, 'c11': c11, 'c21': c21,
+                'kP': self.kP, 'kT': self.kT}
+
     def getPressureCalibrationCoefficients(self):
-        """Get pressure calibration coefficients from sensor.
+        """Get pressure calibration coefficients read by readCalibration.
         Returns:
             int: Pressure calibration coefficient (c00)
             int: Pressure calibration coefficient (c10)
@@ -123,21 +365,7 @@ class DPS:
             int: Pressure calibration coefficient (c11)
             int: Pressure calibration coefficient (c21)
         """
-        coefficients = []
-        for reg in range(0x13, 0x22):
-            self.bus.writeto(self.addr, bytes([reg]))
-            coeff_byte = self.bus.readfrom(self.addr, 1)
-            coefficients.append(coeff_byte[0])
-    
-        c00 = self._combineCoefficients(coefficients[0:3], 20)
-        c10 = self._combineCoefficients(coefficients[3:6], 20)
-        c20 = self._combineCoefficients(coefficients[6:8], 16)
-        c30 = self._combineCoefficients(coefficients[14:16], 16)
-        c01 = self._combineCoefficients(coefficients[8:10], 16)
-        c11 = self._combineCoefficients(coefficients[10:12], 16)
-        c21 = self._combineCoefficients(coefficients[12:14], 16)
-
-        return c00, c10, c20, c30, c01, c11, c21
+        return self._press_coeffs
 
     def _combineCoefficients(self, bytes_list, length):
         """
@@ -154,23 +382,12 @@ class DPS:
         return getTwosComplement(combined, length)
 
     def getTemperatureCalibrationCoefficients(self):
-        """Get temperature calibration coefficients from sensor.
+        """Get temperature calibration coefficients read by readCalibration.
         Returns:
             int: Temperature calibration coefficient (c0)
             int: Temperature calibration coefficient (c1)
         """
-        self.bus.writeto(self.addr, bytes([0x10]))
-        src10 = int.from_bytes(self.bus.readfrom(self.addr, 1), 'big')
-        self.bus.writeto(self.addr, bytes([0x11]))
-        src11 = int.from_bytes(self.bus.readfrom(self.addr, 1), 'big')
-        self.bus.writeto(self.addr, bytes([0x12]))
-        src12 = int.from_bytes(self.bus.readfrom(self.addr, 1), 'big')
-
-        c0 = (src10 << 4) | (src11 >> 4)
-        c0 = getTwosComplement(c0, 12)
-        c1 = ((src11 & 0x0F) << 8) | src12
-        c1 = getTwosComplement(c1, 12)
-        return c0, c1
+        return self._temp_coeffs
 
     def calcScaledPressure(self):
         """Calculate scaled pressure.
@@ -1,5 +1,6 @@
 import machine
 from machine import Pin, SPI
+from micropython import const
 
 """
     
@@ -17,16 +18,50 @@ from machine import Pin, SPI
     
 """
 
+# commands and control register bits, see regmaps/ifx9201.json
+# BEGIN GENERATED regmaps/ifx9201.json
+# IFX9201SG commands
+# the answer to a command is shifted out with the next one
+IFX_RD_DIA = const(0x00)
+IFX_RD_REV = const(0x20)
+IFX_RD_CTRL = const(0x60)
+IFX_RES_DIA = const(0x80)
+# or-ed with the new CTRL bits
+IFX_WR_CTRL_RD_DIA = const(0xc0)
+# or-ed with the new CTRL bits
+IFX_WR_CTRL = const(0xe0)
+
+# CTRL fields
+# disconnects the open load current source
+IFX_OLDIS = const(0x10)
+# outputs controlled by SPI instead of the pins
+IFX_SIN = const(0x08)
+# output stage enable
+IFX_SEN = const(0x04)
+# direction
+IFX_SDIR = const(0x02)
+# PWM input
+IFX_SPWM = const(0x01)
+IFX_CTRL_MASK = const(0x1f)
+# END GENERATED regmaps/ifx9201.json
+
 class HBridgeKit2Go:
     """
     Initializes SPI protocol, chip select, and the read and write buffers.
-    """
-    def __init__(self):
-        self.spi = SPI(0, baudrate=115200, bits=8, firstbit=SPI.MSB, polarity=0, phase=1, sck='P9_2', mosi='P9_0', miso='P9_1')
+    An already configured SPI object (e.g. a mipy.trace.TracedSPI) can be
+    passed in as spi. The Control Register is written with ctrl, by default
+    its reset state (pin control, output stage off), and then kept in
+    self.ctrl, so that changing a bit takes a single write.
+    """
+    def __init__(self, spi=None, ctrl=0):
+        if spi is None:
+            spi = SPI(0, baudrate=115200, bits=8, firstbit=SPI.MSB, polarity=0, phase=1, sck='P9_2', mosi='P9_0', miso='P9_1')
+        self.spi = spi
         self.cs = Pin('P9_3', mode=Pin.OUT)
         self.writebuf = bytearray(1)
         self.readbuf = bytearray(1)
-        print('')
+        self.ctrl = ctrl & IFX_CTRL_MASK
+        self.writeCMD(IFX_WR_CTRL | self.ctrl)
     
     """
     This function is used to read and or write a command to the IFX9201SG
@@ -49,115 +84,104 @@ class HBridgeKit2Go:
         #return read data unbuffered, can also be accessed by self.readbuf
         return self.readbuf[0]
     
+    """
+    This function writes a command to the IFX9201SG without waiting for
+    its answer, which is shifted out with the next command.
+    """
+    def writeCMD(self, data):
+        self.writebuf[0] = data
+        self.cs.off()
+        self.spi.write_readinto(self.writebuf, self.readbuf)
+        self.cs.on()
+    
+    """
+    This function sets and clears bits of the Control Register in one
+    write, starting from the copy kept in self.ctrl.
+    """
+    def _updateCTRL(self, set_bits, clear_bits=0):
+        self.ctrl = (self.ctrl | set_bits) & ~clear_bits & IFX_CTRL_MASK
+        self.writeCMD(IFX_WR_CTRL | self.ctrl)
+    
+    """
+    This function reads the Control Register back into self.ctrl, e.g.
+    after the kit was reset, and returns it.
+    """
+    def syncCTRL(self):
+        self.ctrl = self.readWriteCMD(IFX_RD_CTRL) & IFX_CTRL_MASK
+        return self.ctrl
+    
+    """
+    This function writes the copy in self.ctrl back to the Control
+    Register, e.g. after the kit was reset by a fault.
+    """
+    def restore(self):
+        self.writeCMD(IFX_WR_CTRL | self.ctrl)
+    
     """
     This function enables control of the outputs via SPI by setting
     only the SIN bit in the Control Register.
     """
     def enableSPI(self):
-        #read the current CTRL Register
-        ctrl = self.readCTRL()
-        #create the new cmd
-        ctrl |= 0x88
-        self.readWriteCMD(ctrl)
+        self._updateCTRL(IFX_SIN)
         
     """
     This function disables control of the outputs via SPI by clearing
     only the SIN bit in the Control Register.
     """
     def disableSPI(self):
-        #read the current CTRL Register
-        ctrl = self.readCTRL()
-        #create the new cmd
-        ctrl |= 0x80
-        ctrl &= 0xF7
-        self.readWriteCMD(ctrl)
+        self._updateCTRL(0, IFX_SIN)
     
     """
     This function clears only the SEN bit in the Control Register,
     which disables motor operation.
     """
     def disableOutput(self):
-        #read the current CTRL Register
-        ctrl = self.readCTRL()
-        #create the new cmd
-        #or the first bit to create a write cmd
-        ctrl |= 0x80
-        #and with a 0 to disable the output
-        ctrl &= 0xFB
-        self.readWriteCMD(ctrl)
+        self._updateCTRL(0, IFX_SEN)
     
     """
     This function sets only the SEN bit in the Control Register, which
     enables motor operation.
     """
     def enableOutput(self):
-        #read the current CTRL Register
-        ctrl = self.readCTRL()
-        #create the new cmd
-        #or the first bit to create a write cmd and or SEN to enable
-        ctrl |= 0x84
-        self.readWriteCMD(ctrl)
+        self._updateCTRL(IFX_SEN)
     
     """
     This function sets only the OLDIS bit in the Control Register, which
     disconnects the open load current source.
     """
     def disconnectOLCS(self):
-        #read the current CTRL Register
-        ctrl = self.readCTRL()
-        #create the new cmd
-        ctrl |= 0x90
-        self.readWriteCMD(ctrl)
+        self._updateCTRL(IFX_OLDIS)
     
     """
     This function clears only the OLDIS bit in the Control Register, which
     connects the open load current source.
     """
     def connectOLCS(self):
-        #read the current CTRL Register
-        ctrl = self.readCTRL()
-        #create the new cmd
-        ctrl |= 0x80
-        ctrl &= 0xEF
-        self.readWriteCMD(ctrl)
+        self._updateCTRL(0, IFX_OLDIS)
     
     """
     This function toggles only the SDIR bit in the Control Register, which
     toggles the direction of the motor drive.
     """
     def toggleDIR(self):
-        #read the current CTRL Register
-        ctrl = self.readCTRL()
-        cmd = (ctrl & 0x02) >> 1
-        if(cmd):
-            ctrl |= 0x80
-            self.readWriteCMD(ctrl & 0xFD)
+        if self.ctrl & IFX_SDIR:
+            self._updateCTRL(0, IFX_SDIR)
         else:
-            ctrl |= 0x80
-            self.readWriteCMD(ctrl | 0x02)
+            self._updateCTRL(IFX_SDIR)
     
     """
     This function enables PWM output by setting only the SPWM bit in the 
     Control Register.
     """
     def enablePWM(self):
-        #read the current CTRL Register
-        ctrl = self.readCTRL()
-        #create the new cmd
-        ctrl |= 0x81
-        self.readWriteCMD(ctrl)
+        self._updateCTRL(IFX_SPWM)
         
     """
     This function disables PWM output by clearing only the SPWM bit in the 
     Control Register.
     """
     def disablePWM(self):
-        #read the current CTRL Register
-        ctrl = self.readCTRL()
-        #create the new cmd
-        ctrl |= 0x80
-        ctrl &= 0xFE
-        self.readWriteCMD(ctrl)
+        self._updateCTRL(0, IFX_SPWM)
         
     """
     This function reads the Control Register, prints its hexidecimal value
@@ -165,7 +189,8 @@ class HBridgeKit2Go:
     """
     def readCTRL(self):
         #read the value using read CTRL cmd from datasheet
-        ctrl = self.readWriteCMD(0x60)
+        ctrl = self.readWriteCMD(IFX_RD_CTRL)
+        self.ctrl = ctrl & IFX_CTRL_MASK
         #print the hex value
         print(f'Control Register: {hex(ctrl)}')
         #return the non hex value
@@ -177,7 +202,7 @@ class HBridgeKit2Go:
     """
     def readDIA(self):
         #read the value using read DIA from datasheet
-        dia = self.readWriteCMD(0x00)
+        dia = self.readWriteCMD(IFX_RD_DIA)
         #print the hex value
         print(f'Diagnosis Register: {hex(dia)}')
         #return the non hex value
@@ -189,7 +214,7 @@ class HBridgeKit2Go:
     """
     def resetDIA(self):
         #reset the DIA register using cmd from datasheet
-        self.readWriteCMD(0x80)
+        self.readWriteCMD(IFX_RES_DIA)
         #read the DIA register
         self.readDIA()
     
@@ -199,7 +224,7 @@ class HBridgeKit2Go:
     """
     def readREV(self):
         #read the REV reg using cmd from datasheet
-        rev = self.readWriteCMD(0x20)
+        rev = self.readWriteCMD(IFX_RD_REV)
         #print the hex value
         print(f'Revision Register: {hex(rev)}')
         #return the non hex value
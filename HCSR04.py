@@ -1,88 +1,318 @@
-import time, machine
+import utime as time
+import machine
 from machine import Pin
+from array import array
+from micropython import const
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+# Minimum time between two pings, as per datasheet
+HCSR04_CYCLE_US = const(60000)
+
+# Speed of sound in air is about 331.3 m/s + 0.606 m/s per degree Celsius
+SOUND_MM_S_0C = const(331300)
+SOUND_MM_S_PER_C = const(606)
+
+# Indexes into the state shared with the echo interrupt handler
+_T_TRIG = const(0)    # ticks_us of the last trigger pulse
+_T_RISE = const(1)    # ticks_us of the rising echo edge
+_PULSE = const(2)     # echo length in us of the last completed measurement
+_T_DONE = const(3)    # ticks_us of the falling edge of that measurement
+_STATE = const(4)
+
+_IDLE = const(0)
+_TRIGGERED = const(1)
+_ECHO = const(2)
 
 class HCSR04:
     """
     Driver to use the untrasonic sensor HC-SR04.
     The sensor range is between 2cm and 4m.
+    
+    The echo pulse is timed by interrupts on both edges of the echo pin,
+    so the CPU is free while the sound travels and the resolution does
+    not depend on how fast a polling loop runs. start_measurement() and
+    measurement_ready() allow doing other work during the flight time.
     """
+    # sensor protocol, see mipy/sensor.py
+    fields = ('distance',)
+    units = ('mm',)
+
     # echo_timeout_us is based in chip range limit (400cm)
-    def __init__(self, trigger_pin, echo_pin, echo_timeout_us=500*2*30):
+    def __init__(self, trigger_pin, echo_pin, echo_timeout_us=500*2*30,
+                 temperature=20, max_burst=15):
         """
         trigger_pin: Output pin to send pulses
         echo_pin: Readonly pin to measure the distance. The pin should be protected with 1k resistor
         echo_timeout_us: Timeout in microseconds to listen to echo pin.
         By default is based in sensor limit range (4m)
+        temperature: Ambient air temperature in Celsius for the speed of sound
+        max_burst: Largest number of pings measure() can take
         """
         self.echo_timeout_us = echo_timeout_us
+        # Results older than this are measured again by distance_mm/cm
+        self.max_age_us = 250000
+        self.set_temperature(temperature)
         # Init trigger pin (out)
         self.trigger = Pin(trigger_pin, mode=Pin.OUT)
         self.trigger.value(0)
         # Init echo pin (in)
         self.echo = Pin(echo_pin, mode=Pin.IN)
+        # Preallocated so that neither the interrupt handler nor measure()
+        # allocate memory
+        self._irq_state = array('i', [0, 0, -1, 0, _IDLE])
+        self._burst = array('i', [0] * max_burst)
+        self.echo.irq(handler=self._echo_irq, trigger=Pin.IRQ_RISING | Pin.IRQ_FALLING)
 
-    def _send_pulse_and_wait(self):
+    def _echo_irq(self, pin):
         """
-        Send the pulse to trigger and listen on echo pin.
-        We use the method `machine.time_pulse_us()` to get the microseconds until the echo is received.
+        Timestamps both echo edges, runs in interrupt context
+        """
+        t = time.ticks_us()
+        s = self._irq_state
+        if pin.value():
+            if s[_STATE] == _TRIGGERED:
+                s[_T_RISE] = t
+                s[_STATE] = _ECHO
+        elif s[_STATE] == _ECHO:
+            s[_PULSE] = time.ticks_diff(t, s[_T_RISE])
+            s[_T_DONE] = t
+            s[_STATE] = _IDLE
+
+    def set_temperature(self, celsius):
+        """
+        Sets the ambient air temperature used to compute the speed of sound,
+        e.g. from BME280.read_compensated_data()[0] or
+        DPS.measureTemperatureOnce().
+        """
+        self._mm_per_us_q16 = self._sound_q16(celsius)
+
+    def _sound_q16(self, celsius):
+        # half the speed of sound (the pulse walks the distance twice) in
+        # mm/us as 16.16 fixed point, keeping distance math in small ints
+        return int((SOUND_MM_S_0C + SOUND_MM_S_PER_C * celsius) * 65536 // 2000000)
+
+    def start_measurement(self):
         """
+        Sends the trigger pulse and returns without waiting for the echo.
+        Pings should be at least HCSR04_CYCLE_US apart.
+        """
+        s = self._irq_state
         self.trigger.value(0) # Stabilize the sensor
         time.sleep_us(5)
+        s[_STATE] = _TRIGGERED
         self.trigger.value(1)
         # Send a 10us pulse.
         time.sleep_us(10)
         self.trigger.value(0)
-        
-        pulse_time = self.time_pulse_us(self.echo, 1, self.echo_timeout_us)
-        while(pulse_time == -1 and pulse_time == -2):
-            pulse_time = self.time_pulse_us(self.echo, 1, self.echo_timeout_us)
+        s[_T_TRIG] = time.ticks_us()
+
+    def _in_flight(self):
+        """
+        True while a started measurement can still complete
+        """
+        s = self._irq_state
+        if s[_STATE] == _IDLE:
+            return False
+        if time.ticks_diff(time.ticks_us(), s[_T_TRIG]) > 2 * self.echo_timeout_us:
+            # no rising edge or no falling edge in time
+            s[_STATE] = _IDLE
+            return False
+        return True
+
+    def measurement_ready(self):
+        """
+        True once the measurement started last has completed or timed out
+        """
+        return not self._in_flight()
+
+    @property
+    def measurement_time_us(self):
+        """
+        Worst case time from start_measurement() until the result is known
+        """
+        return 2 * self.echo_timeout_us
+
+    def _result(self):
+        """
+        Echo length in us of the measurement started last, -1 if it timed
+        out or the echo was longer than echo_timeout_us
+        """
+        s = self._irq_state
+        if time.ticks_diff(s[_T_DONE], s[_T_TRIG]) < 0 or s[_PULSE] > self.echo_timeout_us:
+            return -1
+        return s[_PULSE]
 
+    def _wait_echo(self):
+        """
+        Waits for the measurement in flight, returns the echo length in us
+        or -1 on timeout
+        """
+        while self._in_flight():
+            time.sleep_us(50)
+        return self._result()
+
+    def _send_pulse_and_wait(self):
+        """
+        Send the pulse to trigger and wait for the echo interrupts. A timed
+        out measurement is retried once, HCSR04_CYCLE_US after the first
+        ping so that its late echo cannot be taken for the new one, then
+        OSError is raised.
+        """
+        s = self._irq_state
+        for retry in range(2):
+            if retry:
+                wait = HCSR04_CYCLE_US - time.ticks_diff(time.ticks_us(), s[_T_TRIG])
+                if wait > 0:
+                    time.sleep_us(wait)
+            self.start_measurement()
+            pulse_time = self._wait_echo()
+            if pulse_time >= 0:
+                return pulse_time
+        raise OSError('Out of range')
+
+    def _latest_pulse(self):
+        """
+        Returns the echo length of the last measurement if it is recent
+        enough, otherwise measures. The next measurement is started so that
+        polling at a steady rate finds a fresh result without waiting.
+        """
+        s = self._irq_state
+        if not self._in_flight():
+            now = time.ticks_us()
+            pulse_time = self._result()
+            if pulse_time >= 0 and time.ticks_diff(now, s[_T_DONE]) <= self.max_age_us:
+                if time.ticks_diff(now, s[_T_TRIG]) >= HCSR04_CYCLE_US:
+                    self.start_measurement()
+                return pulse_time
+            return self._send_pulse_and_wait()
+        pulse_time = self._wait_echo()
+        if pulse_time < 0:
+            return self._send_pulse_and_wait()
         return pulse_time
 
     def distance_mm(self):
         """
         Get the distance in milimeters without floating point operations.
+        Returns the latest completed measurement if there is a recent one
+        and starts the next, see max_age_us. Raises OSError('Out of range')
+        if no echo is received.
         """
-        pulse_time = self._send_pulse_and_wait()
-
-        # To calculate the distance we get the pulse_time and divide it by 2
-        # (the pulse walk the distance twice) and by 29.1 becasue
-        # the sound speed on air (343.2 m/s), that It's equivalent to
-        # 0.34320 mm/us that is 1mm each 2.91us
-        # pulse_time // 2 // 2.91 -> pulse_time // 5.82 -> pulse_time * 100 // 582
-        mm = pulse_time * 100 // 582
-        return mm
+        pulse_time = self._latest_pulse()
+        return pulse_time * self._mm_per_us_q16 >> 16
 
     def distance_cm(self):
         """
         Get the distance in centimeters with floating point operations.
         It returns a float
         """
-        pulse_time = self._send_pulse_and_wait()
+        pulse_time = self._latest_pulse()
+        return pulse_time * self._mm_per_us_q16 / 655360
+
+    def read_into(self, buf, offset=0):
+        """
+        Stores distance_mm() at buf[offset] and returns offset + 1
+        """
+        buf[offset] = self.distance_mm()
+        return offset + 1
+
+    def raw_into(self, buf, offset=0):
+        """
+        Stores the echo length in microseconds at buf[offset] and returns
+        offset + 1
+        """
+        buf[offset] = self._latest_pulse()
+        return offset + 1
+
+    async def read_async(self):
+        """
+        Measures the distance in milimeters, yielding to the uasyncio loop
+        until the echo has returned. Raises OSError('Out of range') if no
+        echo is received.
+        """
+        s = self._irq_state
+        if not self._in_flight():
+            wait = HCSR04_CYCLE_US - time.ticks_diff(time.ticks_us(), s[_T_TRIG])
+            if wait > 0:
+                await asyncio.sleep_ms(wait // 1000 + 1)
+            self.start_measurement()
+        while self._in_flight():
+            await asyncio.sleep_ms(1)
+        pulse_time = self._result()
+        if pulse_time < 0:
+            raise OSError('Out of range')
+        return pulse_time * self._mm_per_us_q16 >> 16
+
+    def measure(self, n=5, temperature=None):
+        """
+        Fires a burst of n pings HCSR04_CYCLE_US apart and returns the median
+        distance in milimeters. Timed out pings are dropped, then echoes
+        further than 1/8 from the median of the rest are rejected as
+        outliers. temperature (Celsius) overrides set_temperature() for this
+        measurement. Raises OSError if fewer than half of the pings returned.
+        """
+        if n < 1:
+            raise ValueError("n must be at least 1")
+        if n > len(self._burst):
+            raise ValueError("n is larger than max_burst")
+        buf = self._burst
+        s = self._irq_state
+        count = 0
+        for i in range(n):
+            if i:
+                wait = HCSR04_CYCLE_US - time.ticks_diff(time.ticks_us(), s[_T_TRIG])
+                if wait > 0:
+                    time.sleep_us(wait)
+            self.start_measurement()
+            pulse_time = self._wait_echo()
+            if pulse_time >= 0:
+                # insertion sort, buf[:count] stays ordered
+                j = count
+                while j and buf[j - 1] > pulse_time:
+                    buf[j] = buf[j - 1]
+                    j -= 1
+                buf[j] = pulse_time
+                count += 1
+        if 2 * count < n:
+            raise OSError('Out of range')
+
+        median = buf[count // 2]
+        tol = median >> 3
+        lo = 0
+        while buf[lo] < median - tol:
+            lo += 1
+        hi = count - 1
+        while buf[hi] > median + tol:
+            hi -= 1
+        # median of the inliers buf[lo:hi + 1]
+        median = (buf[(lo + hi) // 2] + buf[(lo + hi + 1) // 2]) // 2
 
-        # To calculate the distance we get the pulse_time and divide it by 2
-        # (the pulse walk the distance twice) and by 29.1 becasue
-        # the sound speed on air (343.2 m/s), that It's equivalent to
-        # 0.034320 cm/us that is 1cm each 29.1us
-        cms = (pulse_time / 2) / 29.1
-        return cms
+        if temperature is None:
+            q16 = self._mm_per_us_q16
+        else:
+            q16 = self._sound_q16(temperature)
+        return median * q16 >> 16
         
     def time_pulse_us(self, echo_pin, pulse_level, timeout_us):
         """
         Times the pulse on the given echo_pin and returns the duration of the pulse
         in microseconds. pulse_level is 0 or 1 for low or high to be detected. 
         returns -1 if there is a timeout_us in the main measurement and -2 if there is
-        a timeout in the pulse check measurement
+        a timeout in the pulse check measurement. The driver itself times
+        echoes with the pin IRQ, this is kept for polling callers.
         """
         start = time.ticks_us()
         while(echo_pin.value() != pulse_level):
-            if((time.ticks_us() - start) >= timeout_us):
+            if(time.ticks_diff(time.ticks_us(), start) >= timeout_us):
                 return -2
         
         start = time.ticks_us()
         while(echo_pin.value() == pulse_level):
-            if((time.ticks_us() - start) >= timeout_us):
+            if(time.ticks_diff(time.ticks_us(), start) >= timeout_us):
                 return -1
                 
-        return time.ticks_us() - start
+        return time.ticks_diff(time.ticks_us(), start)
 
@@ -1,6 +1,12 @@
 import machine
-import time
+import utime as time
 from machine import I2C, Pin
+from micropython import const
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
 
 """ 
 
@@ -11,64 +17,232 @@ from machine import I2C, Pin
     Liquid Crystal Display using an I2C protocol with slave address
     0x27. This code also assumes usage of I2C pins P6_0 and P6_1
     for the SCL and SDA lines respectively. These fields can be
-    changed by changing the self.addr for a different address
-    and by using self.bus.init() to use different I2C pins.
+    changed by passing a different addr, or an I2C object (e.g. a
+    mipy.bus device) on other pins as i2c. The PCF8574 backpack
+    supports at most 100kHz.
     
 """
 
+# PCF8574 backpack pin mapping
+LCD_RS = const(0x01)
+LCD_EN = const(0x04)
+LCD_BACKLIGHT = const(0x08)
+
+# Max number of instruction/data bytes sent in one I2C transaction, enough
+# for eight CGRAM glyphs followed by a 40 character line
+LCD_MAX_BATCH = const(128)
+
+# Cursor or display shift instructions
+LCD_SHIFT_LEFT = const(0x18)
+LCD_SHIFT_RIGHT = const(0x1C)
+
+# HD44780 timing in microseconds as per datasheet. Every instruction other
+# than clear display and return home completes in 37us, which is shorter
+# than the I2C transfer of the next one, so only those two are waited on.
+LCD_T_POWER_ON = const(40000)   # Vcc rising to 2.7V until first instruction
+LCD_T_INIT_1 = const(4100)      # after the first 0x30 function set
+LCD_T_INIT_2 = const(100)       # after the second 0x30 function set
+LCD_T_CLEAR_HOME = const(1520)  # clear display (0x01), return home (0x02)
+LCD_T_INSTR = const(37)         # all other instructions and data writes
+
+# Custom glyph bitmaps (8 rows of 5 pixels). LCD_BAR_GLYPHS[n - 1] lights
+# the n leftmost of 5 columns, LCD_SPARK_GLYPHS[n - 1] the n lowest of 8
+# rows. Full cells use the ROM character 0xFF and empty cells a space.
+LCD_BAR_GLYPHS = tuple(bytes([(0x1F << (5 - n)) & 0x1F] * 8) for n in range(1, 5))
+LCD_SPARK_GLYPHS = tuple(bytes([0] * (8 - n) + [0x1F] * n) for n in range(1, 8))
+
+# Every byte sent to the HD44780 in 4-bit mode becomes four PCF8574 writes:
+# high nibble with EN set, high nibble with EN cleared, then the same for
+# the low nibble. _NIBBLES[4 * c:4 * c + 4] holds that expansion for c with
+# the backlight on and RS cleared; writes XOR in LCD_RS for data and
+# LCD_BACKLIGHT while the backlight is off.
+_NIBBLES = bytes(
+    ((c << n) & 0xF0) | LCD_BACKLIGHT | e
+    for c in range(256) for n in (0, 4) for e in (LCD_EN, 0)
+)
+
 class LCD16x2:
     
-    def __init__(self):
-        self.addr = 0x27
-        self.bus = I2C(0, scl='P6_0', sda='P6_1', freq=100000)
+    def __init__(self, i2c=None, addr=0x27):
+        self.addr = addr
+        if i2c is None:
+            i2c = I2C(0, scl='P6_0', sda='P6_1', freq=100000)
+        self.bus = i2c
+        # transmit buffer reused by every write, 4 bus bytes per LCD byte
+        self._buf = bytearray(4 * LCD_MAX_BATCH)
+        self._mv = memoryview(self._buf)
+        # LCD_BACKLIGHT while the backlight is off, cleared from every write
+        self._dark = 0
+        
+    def _pack(self, pos, data, rs):
+        """
+        Expands one instruction (rs = 0) or data (rs = LCD_RS) byte into
+        the transmit buffer at pos, returns the position after it
+        """
+        i = (data & 0xFF) << 2
+        rs ^= self._dark
+        buf = self._buf
+        buf[pos] = _NIBBLES[i] ^ rs
+        buf[pos + 1] = _NIBBLES[i + 1] ^ rs
+        buf[pos + 2] = _NIBBLES[i + 2] ^ rs
+        buf[pos + 3] = _NIBBLES[i + 3] ^ rs
+        return pos + 4
+        
+    def _send(self, end):
+        """
+        Sends the first end bytes of the transmit buffer in one transaction
+        """
+        self.bus.writeto(self.addr, self._mv[:end])
+        
+    def _writeNIBBLE(self, data):
+        """
+        Clocks only the high nibble of data into the LCD, used while the
+        controller may still be in 8-bit mode during initialization
+        """
+        buf = self._buf
+        light = LCD_BACKLIGHT ^ self._dark
+        buf[0] = (data & 0xF0) | light | LCD_EN
+        buf[1] = (data & 0xF0) | light
+        self._send(2)
+        
+    def LCD_backlight(self, on):
+        """
+        Switches the backlight on or off, it stays that way for all
+        following writes
+        """
+        self._dark = 0 if on else LCD_BACKLIGHT
+        self._buf[0] = LCD_BACKLIGHT ^ self._dark
+        self._send(1)
+        
+    def sleep(self):
+        """
+        Switches the backlight off, the display keeps its contents
+        """
+        self.LCD_backlight(False)
+        
+    def wake(self):
+        self.LCD_backlight(True)
         
     def LCD_writeINSTR(self, data):
-        self.bus.writeto(self.addr, bytes([(data & 0xF0) | 0x0C, (data & 0xF0) | 0x08, 
-        ((data & 0x0F) << 4) | 0x0C, ((data & 0x0F) << 4) | 0x08]))
+        self._send(self._pack(0, data, 0))
+        if data < 0x04:
+            time.sleep_us(LCD_T_CLEAR_HOME)
         
     def LCD_writeDATA(self, data):
-        self.bus.writeto(self.addr, bytes([(data & 0xF0) | 0x0D, (data & 0xF0) | 0x09, 
-        ((data & 0x0F) << 4) | 0x0D, ((data & 0x0F) << 4) | 0x09]))
+        self._send(self._pack(0, data, LCD_RS))
+        
+    def LCD_writeINSTRS(self, instrs):
+        """
+        Sends a sequence of instructions in a single I2C transaction, or
+        one per LCD_MAX_BATCH instructions if there are more. Clear
+        display and return home must be sent with LCD_writeINSTR since
+        they need more time than the bus gives between bytes.
+        """
+        pos = 0
+        for instr in instrs:
+            if pos == 4 * LCD_MAX_BATCH:
+                self._send(pos)
+                pos = 0
+            pos = self._pack(pos, instr, 0)
+        if pos:
+            self._send(pos)
         
     def LCD_INIT(self):
         """
-        Initialization sequence for the LCD as per datasheet
+        Initialization sequence for the LCD as per datasheet (4-bit
+        interface, 2 lines, 5x8 font, display on, cursor off, cursor
+        moving right without display shift). Takes about 46ms.
         """
-    
-        time.sleep_ms(40)
-        self.LCD_writeINSTR(0x30)
+        time.sleep_us(LCD_T_POWER_ON)
         
-        time.sleep_ms(40)
-        self.LCD_writeINSTR(0x30)
+        # force 8-bit mode from any state, then switch to 4-bit mode
+        self._writeNIBBLE(0x30)
+        time.sleep_us(LCD_T_INIT_1)
+        self._writeNIBBLE(0x30)
+        time.sleep_us(LCD_T_INIT_2)
+        self._writeNIBBLE(0x30)
+        time.sleep_us(LCD_T_INSTR)
+        self._writeNIBBLE(0x20)
+        time.sleep_us(LCD_T_INSTR)
         
-        time.sleep_ms(40)
-        self.LCD_writeINSTR(0x30)
+        # function set, display off, then clear display
+        self.LCD_writeINSTRS(b'\x28\x08')
+        self.LCD_writeINSTR(0x01)
         
-        time.sleep_ms(40)
-        self.LCD_writeINSTR(0x20)
+        # entry mode set (increment, no shift), display on
+        self.LCD_writeINSTRS(b'\x06\x0C')
         
-        time.sleep_ms(40)
-        self.LCD_writeINSTR(0x28)
+    def LCD_resync(self):
+        """
+        Brings the controller back in step after a bus fault without
+        clearing the display: forces 8-bit mode from any nibble phase,
+        switches back to 4-bit mode and sets the modes of LCD_INIT again
+        (display on, cursor off). The first nibble may complete a byte
+        cut in half, so one stray character can appear. Takes about 2ms.
+        """
+        # the first nibble may finish a clear display or return home
+        self._writeNIBBLE(0x30)
+        time.sleep_us(LCD_T_CLEAR_HOME)
+        self._writeNIBBLE(0x30)
+        time.sleep_us(LCD_T_INSTR)
+        self._writeNIBBLE(0x30)
+        time.sleep_us(LCD_T_INSTR)
+        self._writeNIBBLE(0x20)
+        time.sleep_us(LCD_T_INSTR)
+        self.LCD_writeINSTRS(b'\x28\x06\x0C')
         
-        time.sleep_ms(40)
-        self.LCD_writeINSTR(0x00)
+    def restore(self):
+        self.LCD_resync()
         
-        time.sleep_ms(40)
+    async def LCD_INIT_async(self):
+        """
+        Same sequence as LCD_INIT, but yields to the uasyncio loop during
+        the power-up and first function set waits
+        """
+        await asyncio.sleep_ms(LCD_T_POWER_ON // 1000)
+        self._writeNIBBLE(0x30)
+        await asyncio.sleep_ms(LCD_T_INIT_1 // 1000 + 1)
+        self._writeNIBBLE(0x30)
+        time.sleep_us(LCD_T_INIT_2)
+        self._writeNIBBLE(0x30)
+        time.sleep_us(LCD_T_INSTR)
+        self._writeNIBBLE(0x20)
+        time.sleep_us(LCD_T_INSTR)
+        self.LCD_writeINSTRS(b'\x28\x08')
+        self.LCD_writeINSTR(0x01)
+        self.LCD_writeINSTRS(b'\x06\x0C')
         
     def LCD_writeString(self, string):
+        """
+        Writes the string at the cursor in a single I2C transaction
+        """
+        if len(string) > 40:
+            print("Input string is greater than max length of 40.")
+        elif string:
+            pos = 0
+            for ch in string:
+                pos = self._pack(pos, ord(ch), LCD_RS)
+            self._send(pos)
+            
+    def LCD_writeStringAt(self, row, col, string):
+        """
+        Moves the cursor to row, col and writes the string, both in the
+        same I2C transaction
+        """
         if len(string) > 40:
             print("Input string is greater than max length of 40.")
         else:
-            for i in range(len(string)):
-                self.LCD_writeDATA(ord(string[i]))
+            pos = self._pack(0, (0xC0 if row else 0x80) | col, 0)
+            for ch in string:
+                pos = self._pack(pos, ord(ch), LCD_RS)
+            self._send(pos)
             
     def LCD_clearDisplay(self):
         """
         Clears the display, turns on the display, and resets cursor
         """
         self.LCD_writeINSTR(0x01)
-        self.LCD_writeINSTR(0x0F)
-        self.LCD_writeINSTR(0x80)
+        self.LCD_writeINSTRS(b'\x0F\x80')
             
     def LCD_replaceCursor(self):
         """
@@ -91,13 +265,13 @@ class LCD16x2:
         """
         Shifts the entire display to the right once
         """
-        self.LCD_writeINSTR(0x1C)
+        self.LCD_writeINSTR(LCD_SHIFT_RIGHT)
     
     def LCD_shiftLeft(self):
         """
         Shifts the entire display to the left once
         """
-        self.LCD_writeINSTR(0x18)
+        self.LCD_writeINSTR(LCD_SHIFT_LEFT)
         
     def LCD_cursorOff(self):
         """
@@ -133,19 +307,293 @@ class LCD16x2:
         """
         Rotates the Display to the right indefinitely with a half
         second delay between rotations
-        NOTE: This function does not return
+        NOTE: This function does not return, use LCDAnimator.scroll
+        to rotate the display without blocking
         """
         while True:
-            self.LCD_writeINSTR(0x1C)
+            self.LCD_writeINSTR(LCD_SHIFT_RIGHT)
             time.sleep_ms(500)
     
     def LCD_rotateDisplayLeft(self):
         """
         Rotates the Display to the left indefinitely with a half
         second delay between rotations
-        NOTE: This function does not return
+        NOTE: This function does not return, use LCDAnimator.scroll
+        to rotate the display without blocking
         """
         while True:
-            self.LCD_writeINSTR(0x18)
+            self.LCD_writeINSTR(LCD_SHIFT_LEFT)
             time.sleep_ms(500)
-        
\ No newline at end of file
+
+
+class LCDAnimator:
+    """
+    Runs display effects as uasyncio tasks so that scrolling, blinking
+    and tickers share the CPU with the rest of the application. Every
+    animation step is a single I2C transaction. An effect runs until its
+    step count is reached or it is cancelled; starting an effect again
+    replaces the running one.
+    
+        anim = LCDAnimator(lcd)
+        anim.scroll(LCD_SHIFT_LEFT, period_ms=300)
+        anim.ticker("Pressure 1013.2 hPa", row=1)
+        ...
+        anim.cancel()
+    """
+    
+    def __init__(self, lcd):
+        self.lcd = lcd
+        self._tasks = {}
+        
+    def _start(self, name, coro):
+        self.cancel(name)
+        task = asyncio.create_task(coro)
+        self._tasks[name] = task
+        return task
+        
+    def running(self, name):
+        """
+        Returns True while the named effect is active
+        """
+        task = self._tasks.get(name)
+        return task is not None and not task.done()
+        
+    def cancel(self, name=None):
+        """
+        Stops the named effect, or every effect if no name is given
+        """
+        if name is None:
+            for task in self._tasks.values():
+                task.cancel()
+            self._tasks = {}
+        else:
+            task = self._tasks.pop(name, None)
+            if task is not None:
+                task.cancel()
+                
+    def scroll(self, instr=LCD_SHIFT_LEFT, period_ms=500, steps=0):
+        """
+        Shifts the display with the hardware shift instruction every
+        period_ms. steps = 0 scrolls until cancelled. Effect name "scroll".
+        """
+        return self._start("scroll", self._scroll(instr, period_ms, steps))
+        
+    async def _scroll(self, instr, period_ms, steps):
+        n = 0
+        while not steps or n < steps:
+            self.lcd.LCD_writeINSTR(instr)
+            n += 1
+            await asyncio.sleep_ms(period_ms)
+            
+    def blink(self, period_ms=500, count=0, on=0x0C):
+        """
+        Toggles the display off and on, on is the display control
+        instruction restored when blinking ends. count = 0 blinks until
+        cancelled. Effect name "blink".
+        """
+        return self._start("blink", self._blink(period_ms, count, on))
+        
+    async def _blink(self, period_ms, count, on):
+        lcd = self.lcd
+        n = 0
+        try:
+            while not count or n < count:
+                lcd.LCD_writeINSTR(0x08)
+                await asyncio.sleep_ms(period_ms)
+                lcd.LCD_writeINSTR(on)
+                n += 1
+                await asyncio.sleep_ms(period_ms)
+        finally:
+            lcd.LCD_writeINSTR(on)
+            
+    def ticker(self, text, row=0, col=0, width=16, period_ms=300, steps=0):
+        """
+        Scrolls text through a width character window starting at row,
+        col while the rest of the display stays put. Each step rewrites the
+        window in one transaction. Effect name "ticker0" or "ticker1".
+        """
+        if width + 1 > LCD_MAX_BATCH:
+            raise ValueError("ticker window is wider than the transmit buffer")
+        name = "ticker1" if row else "ticker0"
+        return self._start(name, self._ticker(text, row, col, width,
+                                              period_ms, steps))
+        
+    async def _ticker(self, text, row, col, width, period_ms, steps):
+        lcd = self.lcd
+        addr = (0xC0 if row else 0x80) | col
+        # text that fits is shown as is, longer text wraps with a gap
+        if len(text) <= width:
+            text = text + " " * (width - len(text))
+            length = width
+        else:
+            text = text + "   "
+            length = len(text)
+        first = 0
+        n = 0
+        while not steps or n < steps:
+            pos = lcd._pack(0, addr, 0)
+            i = first
+            for _ in range(width):
+                pos = lcd._pack(pos, ord(text[i]), LCD_RS)
+                i += 1
+                if i == length:
+                    i = 0
+            lcd._send(pos)
+            if length > width:
+                first += 1
+                if first == length:
+                    first = 0
+            n += 1
+            await asyncio.sleep_ms(period_ms)
+
+
+class LCDGlyphs:
+    """
+    Manages the 8 user defined characters in CGRAM. The manager keeps
+    track of which bitmap lives in which slot, so rendering only uploads
+    glyphs that are not resident yet, in the same I2C transaction as the
+    characters that use them. When all slots are taken the least recently
+    used glyph is replaced.
+    
+    NOTE: Uploading leaves the address counter in CGRAM, so follow load()
+    with LCD_putCursor or LCD_writeStringAt before writing text.
+    """
+    
+    def __init__(self, lcd):
+        self.lcd = lcd
+        self.codes = bytearray(8)      # slot of each glyph after load()
+        self._slots = [None] * 8       # bitmap resident in each slot
+        self._age = [0] * 8            # last use of each slot
+        self._tick = 0
+        self._want = [None] * 8        # glyphs needed by the current frame
+        self._levels = bytearray(40)   # sparkline levels of the current frame
+        
+    def _upload(self, glyphs, count, pos):
+        """
+        Assigns CGRAM slots to the first count glyphs and packs writes for
+        the ones that are not resident at pos of the LCD transmit buffer.
+        Returns the position after them, the slots are left in self.codes.
+        """
+        if count > 8:
+            raise ValueError("at most 8 custom glyphs can be used at once")
+        lcd = self.lcd
+        slots = self._slots
+        age = self._age
+        codes = self.codes
+        self._tick += 1
+        tick = self._tick
+        # mark everything already resident as used first, so that it
+        # cannot be evicted by a glyph uploaded below
+        for i in range(count):
+            codes[i] = 0xFF
+            for s in range(8):
+                if slots[s] == glyphs[i]:
+                    codes[i] = s
+                    age[s] = tick
+                    break
+        last = -2
+        for i in range(count):
+            if codes[i] != 0xFF:
+                continue
+            glyph = glyphs[i]
+            for s in range(8):
+                # uploaded earlier in this call
+                if age[s] == tick and slots[s] == glyph:
+                    break
+            else:
+                s = 0
+                for j in range(1, 8):
+                    if age[j] < age[s]:
+                        s = j
+                slots[s] = glyph
+                # consecutive slots continue at the auto incremented address
+                if s != last + 1:
+                    pos = lcd._pack(pos, 0x40 | (s << 3), 0)
+                for row in glyph:
+                    pos = lcd._pack(pos, row, LCD_RS)
+                last = s
+            age[s] = tick
+            codes[i] = s
+        return pos
+        
+    def load(self, glyphs):
+        """
+        Makes the given 8 byte bitmaps resident, uploading the missing ones
+        in a single I2C transaction. Returns self.codes, whose first
+        len(glyphs) entries are the character codes to display them.
+        """
+        pos = self._upload(glyphs, len(glyphs), 0)
+        if pos:
+            self.lcd._send(pos)
+        return self.codes
+        
+    def bar(self, row, col, width, value, full_scale):
+        """
+        Draws a horizontal bar graph of value / full_scale over width cells
+        with 5 steps per cell
+        """
+        lcd = self.lcd
+        steps = width * 5
+        n = int(value * steps // full_scale) if value > 0 else 0
+        if n > steps:
+            n = steps
+        full = n // 5
+        part = n - full * 5
+        pos = 0
+        if part:
+            self._want[0] = LCD_BAR_GLYPHS[part - 1]
+            pos = self._upload(self._want, 1, pos)
+        pos = lcd._pack(pos, (0xC0 if row else 0x80) | col, 0)
+        for i in range(width):
+            if i < full:
+                pos = lcd._pack(pos, 0xFF, LCD_RS)
+            elif i == full and part:
+                pos = lcd._pack(pos, self.codes[0], LCD_RS)
+            else:
+                pos = lcd._pack(pos, 0x20, LCD_RS)
+        lcd._send(pos)
+        
+    def sparkline(self, row, col, values, lo, hi):
+        """
+        Draws one cell per value with 8 height steps between lo and hi
+        """
+        lcd = self.lcd
+        count = len(values)
+        if count > 40:
+            raise ValueError("at most 40 values fit on a display line")
+        levels = self._levels
+        span = hi - lo or 1
+        used = 0
+        for i in range(count):
+            v = values[i] - lo
+            n = int(v * 8 // span) if v > 0 else 0
+            if n > 8:
+                n = 8
+            levels[i] = n
+            if 0 < n < 8:
+                used |= 1 << n
+        # glyphs for the levels in use, in ascending level order
+        want = self._want
+        k = 0
+        for n in range(1, 8):
+            if used & (1 << n):
+                want[k] = LCD_SPARK_GLYPHS[n - 1]
+                k += 1
+        pos = self._upload(want, k, 0)
+        codes = self.codes
+        pos = lcd._pack(pos, (0xC0 if row else 0x80) | col, 0)
+        for i in range(count):
+            n = levels[i]
+            if n == 0:
+                c = 0x20
+            elif n == 8:
+                c = 0xFF
+            else:
+                # index of level n among the levels in use
+                k = 0
+                for j in range(1, n):
+                    if used & (1 << j):
+                        k += 1
+                c = codes[k]
+            pos = lcd._pack(pos, c, LCD_RS)
+        lcd._send(pos)
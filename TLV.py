@@ -1,28 +1,161 @@
 import machine
 import math
-import time
+import utime as time
 from machine import I2C
+from micropython import const
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+# Magnetic flux density of one LSB of the 12 bit X, Y and Z values
+TLV_MT_PER_LSB = 0.098
+
+# Write registers 0 and MOD1, selecting low power mode (a conversion every
+# 10 ms) or power-down mode
+TLV_MODE_LOW_POWER = b'\x11\x01'
+TLV_MODE_POWER_DOWN = b'\x11\x00'
+
+# Temperature: raw value at 25 C and kelvin per LSB
+TLV_TEMP_OFFSET = const(340)
+TLV_TEMP_REF_C = const(25)
+TLV_K_PER_LSB = 1.1
+
+# Fractional bits of the calibration coefficients, see set_calibration()
+TLV_CAL_SHIFT = const(12)
+TLV_CAL_ONE = const(1 << TLV_CAL_SHIFT)
+
+def _signed12(value):
+    return value - 4096 if value > 2047 else value
 
 class TLV493D:
     
     """Class of 3D Magnetic Sensor TLV493D.
     """
     
-    def __init__(self):
-        self.addr = 0x5e
+    # sensor protocol, see mipy/sensor.py
+    fields = ('x', 'y', 'z')
+    units = ('mT', 'mT', 'mT')
+    # after wake() the first conversion takes one low power mode period
+    wake_time_us = 10000
+    
+    def __init__(self, i2c=None, addr=0x5e):
+        """ i2c: I2C object or mipy.bus device, by default I2C 0 on
+            pins P6_0 (SCL) and P6_1 (SDA)
+        """
+        self.addr = addr
         self.bx = 0
         self.by = 0
         self.bz = 0 
         self.temp = 0
         self.data = bytearray(10)
-        self.bus = machine.I2C(0, scl='P6_0', sda='P6_1')
+        self.cal = None
+        if i2c is None:
+            i2c = machine.I2C(0, scl='P6_0', sda='P6_1')
+        self.bus = i2c
     
     def update_data(self):
         """ Read data from register
         """
-        self.bus.writeto(self.addr, bytes([0x11, 0x01]))
+        self.bus.writeto(self.addr, TLV_MODE_LOW_POWER)
         self.bus.readfrom_into(self.addr, self.data)
       
+    def sleep(self):
+        """ Enter power-down mode, no conversions until wake() or the
+            next update_data()
+        """
+        self.bus.writeto(self.addr, TLV_MODE_POWER_DOWN)
+      
+    def wake(self):
+        """ Return to low power mode, fresh values are available
+            wake_time_us later
+        """
+        self.bus.writeto(self.addr, TLV_MODE_LOW_POWER)
+      
+    def raw_into(self, buf, offset=0):
+        """ Read the signed 12 bit X, Y and Z values into buf[offset:]
+            
+            Returns:
+            
+            int: index after the last value written
+        """
+        self.update_data()
+        d = self.data
+        buf[offset] = _signed12((d[0] << 4) | (d[4] >> 4))
+        buf[offset + 1] = _signed12((d[1] << 4) | (d[4] & 0x0f))
+        buf[offset + 2] = _signed12((d[2] << 4) | (d[5] & 0x0f))
+        return offset + 3
+      
+    def raw_temp(self):
+        """ Raw 12 bit temperature of the last update_data()
+        """
+        return ((self.data[3] & 0xf0) << 4) | self.data[6]
+      
+    def get_temp(self):
+        """ Get the temperature of the last update_data()
+            
+            Returns:
+            
+            float: temperature in C
+        """
+        self.temp = (self.raw_temp() - TLV_TEMP_OFFSET) * TLV_K_PER_LSB + TLV_TEMP_REF_C
+        return self.temp
+      
+    def set_calibration(self, coeffs):
+        """ Correct X, Y and Z in read_into() with integer coefficients, as
+            computed by mipy.magcal, or None for none
+            
+            coeffs: (t0, ox, oy, oz, m00, m01, m02, m10, m11, m12, m20,
+            m21, m22, tox, toy, toz, tg) with the raw temperature t0 of the
+            calibration, the hard-iron offsets in LSB, the soft-iron matrix
+            in Q12, the offset drifts in Q12 LSB and the relative gain
+            drift in Q16 per temperature LSB
+        """
+        if coeffs is not None and len(coeffs) != 17:
+            raise ValueError("17 coefficients expected")
+        self.cal = None if coeffs is None else tuple(int(c) for c in coeffs)
+      
+    def read_into(self, buf, offset=0):
+        """ Read X, Y and Z in mT into buf[offset:], buf must hold floats,
+            corrected with the calibration if one is set
+            
+            Returns:
+            
+            int: index after the last value written
+        """
+        end = self.raw_into(buf, offset)
+        if self.cal is not None:
+            self._correct(buf, offset)
+        for i in range(offset, end):
+            buf[i] *= TLV_MT_PER_LSB
+        return end
+      
+    def _correct(self, buf, offset):
+        t0, ox, oy, oz, m00, m01, m02, m10, m11, m12, m20, m21, m22, \
+            tox, toy, toz, tg = self.cal
+        t = self.raw_temp() - t0
+        x = int(buf[offset]) - ox - ((tox * t) >> TLV_CAL_SHIFT)
+        y = int(buf[offset + 1]) - oy - ((toy * t) >> TLV_CAL_SHIFT)
+        z = int(buf[offset + 2]) - oz - ((toz * t) >> TLV_CAL_SHIFT)
+        # products stay below 2 ** 30, small ints on MicroPython
+        g = TLV_CAL_ONE - ((tg * t) >> 4)
+        buf[offset] = (((m00 * x + m01 * y + m02 * z) >> TLV_CAL_SHIFT) * g) >> TLV_CAL_SHIFT
+        buf[offset + 1] = (((m10 * x + m11 * y + m12 * z) >> TLV_CAL_SHIFT) * g) >> TLV_CAL_SHIFT
+        buf[offset + 2] = (((m20 * x + m21 * y + m22 * z) >> TLV_CAL_SHIFT) * g) >> TLV_CAL_SHIFT
+      
+    async def read_async(self):
+        """ Read data and yield to the uasyncio loop once, the sensor keeps
+            its latest conversion in its registers so there is no wait
+            
+            Returns:
+            
+            tuple: X, Y and Z coordinates
+        """
+        self.update_data()
+        await asyncio.sleep_ms(0)
+        return self.get_x(), self.get_y(), self.get_z()
+      
     def get_x(self):
         """ Get the value of X coordinate
             
@@ -98,22 +231,24 @@ class TLV493D:
         azimuth = math.atan2(self.by, self.bx)
         return azimuth
 
-sensor = TLV493D()
+if __name__ == '__main__':
+    sensor = TLV493D()
+
+    while True:
+        sensor.update_data()
+        x = sensor.get_x()
+        y = sensor.get_y()
+        z = sensor.get_z()
+        br = sensor.get_br()
+        polar = sensor.get_polar()
+        azimuth = sensor.get_azimuth()
+        
+        print("X:", x)
+        print("Y:", y)
+        print("Z:", z)
+        print("BR:", br)
+        print("Polar:", polar)
+        print("Azimuth:", azimuth)
+        
+        time.sleep(1)
 
-while True:
-    sensor.update_data()
-    x = sensor.get_x()
-    y = sensor.get_y()
-    z = sensor.get_z()
-    br = sensor.get_br()
-    polar = sensor.get_polar()
-    azimuth = sensor.get_azimuth()
-    
-    print("X:", x)
-    print("Y:", y)
-    print("Z:", z)
-    print("BR:", br)
-    print("Polar:", polar)
-    print("Azimuth:", azimuth)
-    
-    time.sleep(1)
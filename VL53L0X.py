@@ -3,6 +3,11 @@ import ustruct
 import utime
 from machine import I2C
 
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
 IO_TIMEOUT = 1000
 SYSRANGE_START = const(0x00)
 EXTSUP_HV = const(0x89)
@@ -21,15 +26,54 @@ RESULT_RANGE_STATUS = const(0x14)
 OSCcalibrate = const(0xf8)
 MEASURE_PERIOD = const(0x04)
 
+# single ranging time with the default 33ms timing budget
+MEASUREMENT_TIME_US = const(33000)
+
+# Default tuning settings of the ST API as (register, value) pairs, one
+# per two bytes. A bytes constant is a single object, stored in flash
+# when the module is frozen, where the equivalent tuple of tuples is
+# built on the heap by bytecode at every import.
+_TUNING = (
+    b'\xff\x01\x00\x00'
+    b'\xff\x00\x09\x00\x10\x00\x11\x00'
+    b'\x24\x01\x25\xff\x75\x00'
+    b'\xff\x01\x4e\x2c\x48\x00\x30\x20'
+    b'\xff\x00\x30\x09\x54\x00\x31\x04\x32\x03\x40\x83\x46\x25\x60\x00'
+    b'\x27\x00\x50\x06\x51\x00\x52\x96\x56\x08\x57\x30\x61\x00\x62\x00'
+    b'\x64\x00\x65\x00\x66\xa0'
+    b'\xff\x01\x22\x32\x47\x14\x49\xff\x4a\x00'
+    b'\xff\x00\x7a\x0a\x7b\x00\x78\x21'
+    b'\xff\x01\x23\x34\x42\x00\x44\xff\x45\x26\x46\x05\x40\x40\x0e\x06'
+    b'\x20\x1a\x43\x40'
+    b'\xff\x00\x34\x03\x35\x44'
+    b'\xff\x01\x31\x04\x4b\x09\x4c\x05\x4d\x04'
+    b'\xff\x00\x44\x00\x45\x20\x47\x08\x48\x28\x67\x00\x70\x04\x71\x01'
+    b'\x72\xfe\x76\x00\x77\x00'
+    b'\xff\x01\x0d\x01'
+    b'\xff\x00\x80\x01\x01\xf8'
+    b'\xff\x01\x8e\x01\x00\x01\xff\x00\x80\x00'
+)
+
 class TimeoutError(RuntimeError):
     pass
 
 class VL53L0X:
-    def __init__(self, address, _scl, _sda):
-        self.bus = I2C(0, scl=_scl, sda=_sda)
+    # sensor protocol, see mipy/sensor.py
+    fields = ('distance',)
+    units = ('mm',)
+
+    def __init__(self, address=0x29, _scl='P6_0', _sda='P6_1', i2c=None):
+        if i2c is None:
+            i2c = I2C(0, scl=_scl, sda=_sda)
+        self.bus = i2c
         self.address = address
+        self.measurement_time_us = MEASUREMENT_TIME_US
+        # SPAD count and type, read from the sensor's NVM once
+        self._spad = None
         self.init()
         self.started = False
+        self._period = 0
+        self._pending = False
 
     def registers(self, register, values=None, struct='B'):
         if values is None:
@@ -60,6 +104,11 @@ class VL53L0X:
         for register, value in config:
             self.register(register, value)
 
+    def config_table(self, table):
+        """Write (register, value) pairs stored as consecutive bytes."""
+        for i in range(0, len(table), 2):
+            self.register(table[i], table[i + 1])
+
     def calibrate(self, vhv_init_byte):
         self.register(SYSRANGE_START, 0x01 | vhv_init_byte)
         for timeout in range(IO_TIMEOUT):
@@ -135,7 +184,9 @@ class VL53L0X:
 
         self.register(SYSTEM_SEQUENCE, 0xff)
 
-        spad_count, is_aperture = self._spad_info()
+        if self._spad is None:
+            self._spad = self._spad_info()
+        spad_count, is_aperture = self._spad
         spad_map = bytearray(self.registers(SPAD_ENABLES, struct='6B'))
 
         # set reference spads
@@ -156,65 +207,7 @@ class VL53L0X:
 
         self.registers(SPAD_ENABLES, spad_map, struct='6B')
 
-        self.config(
-            (0xff, 0x01), (0x00, 0x00),
-
-            (0xff, 0x00), (0x09, 0x00),
-            (0x10, 0x00), (0x11, 0x00),
-
-            (0x24, 0x01), (0x25, 0xFF),
-            (0x75, 0x00),
-
-            (0xFF, 0x01), (0x4E, 0x2C),
-            (0x48, 0x00), (0x30, 0x20),
-
-            (0xFF, 0x00), (0x30, 0x09),
-            (0x54, 0x00), (0x31, 0x04),
-            (0x32, 0x03), (0x40, 0x83),
-            (0x46, 0x25), (0x60, 0x00),
-            (0x27, 0x00), (0x50, 0x06),
-            (0x51, 0x00), (0x52, 0x96),
-            (0x56, 0x08), (0x57, 0x30),
-            (0x61, 0x00), (0x62, 0x00),
-            (0x64, 0x00), (0x65, 0x00),
-            (0x66, 0xA0),
-
-            (0xFF, 0x01), (0x22, 0x32),
-            (0x47, 0x14), (0x49, 0xFF),
-            (0x4A, 0x00),
-
-            (0xFF, 0x00), (0x7A, 0x0A),
-            (0x7B, 0x00), (0x78, 0x21),
-
-            (0xFF, 0x01), (0x23, 0x34),
-            (0x42, 0x00), (0x44, 0xFF),
-            (0x45, 0x26), (0x46, 0x05),
-            (0x40, 0x40), (0x0E, 0x06),
-            (0x20, 0x1A), (0x43, 0x40),
-
-            (0xFF, 0x00), (0x34, 0x03),
-            (0x35, 0x44),
-
-            (0xFF, 0x01), (0x31, 0x04),
-            (0x4B, 0x09), (0x4C, 0x05),
-            (0x4D, 0x04),
-
-            (0xFF, 0x00), (0x44, 0x00),
-            (0x45, 0x20), (0x47, 0x08),
-            (0x48, 0x28), (0x67, 0x00),
-            (0x70, 0x04), (0x71, 0x01),
-            (0x72, 0xFE), (0x76, 0x00),
-            (0x77, 0x00),
-
-            (0xFF, 0x01), (0x0D, 0x01),
-
-            (0xFF, 0x00), (0x80, 0x01),
-            (0x01, 0xF8),
-
-            (0xFF, 0x01), (0x8E, 0x01),
-            (0x00, 0x01), (0xFF, 0x00),
-            (0x80, 0x00),
-        )
+        self.config_table(_TUNING)
 
         self.register(INTERRUPT_GPIO, 0x04)
         self.flag(GPIO_MUX_ACTIVE_HIGH, 4, False)
@@ -234,6 +227,8 @@ class VL53L0X:
           (0x00, 0x01), (0xFF, 0x00),
           (0x80, 0x00),
         )
+        # kept unscaled for restore()
+        self._period = period
         if period:
             oscilator = self.register(OSCcalibrate, struct='>H')
             if oscilator:
@@ -253,14 +248,50 @@ class VL53L0X:
         )
         self.started = False
 
+    def sleep(self):
+        """Stop continuous ranging. Between single rangings the sensor
+        is in software standby already."""
+        if self.started:
+            self.stop()
+
+    def wake(self):
+        """Nothing to do, start_measurement ranges from standby."""
+        pass
+
+    def restore(self):
+        """Bring the sensor back after a bus fault. If it kept its
+        configuration only the ranging that was running is restarted,
+        otherwise it is initialized again with the SPAD information read
+        the first time."""
+        if self.register(SYSTEM_SEQUENCE) != 0xe8:
+            self.init()
+        self._pending = False
+        if self.started:
+            self.start(self._period)
+
+    def start_measurement(self):
+        """Start a single ranging and return without waiting, the next
+        read() collects its result."""
+        self.config(
+          (0x80, 0x01), (0xFF, 0x01),
+          (0x00, 0x00), (0x91, self.stop_variable),
+          (0x00, 0x01), (0xFF, 0x00),
+          (0x80, 0x00), (SYSRANGE_START, 0x01),
+        )
+        self._pending = True
+
+    def measurement_ready(self):
+        return bool(self.register(RESULT_INTERRUPT_STATUS) & 0x07)
+
+    def _read_result(self):
+        value = self.register(RESULT_RANGE_STATUS + 10, struct='>H')
+        self.register(INTERRUPT_CLEAR, 0x01)
+        self._pending = False
+        return value
+
     def read(self):
-        if not self.started:
-            self.config(
-              (0x80, 0x01), (0xFF, 0x01),
-              (0x00, 0x00), (0x91, self.stop_variable),
-              (0x00, 0x01), (0xFF, 0x00),
-              (0x80, 0x00), (SYSRANGE_START, 0x01),
-            )
+        if not self.started and not self._pending:
+            self.start_measurement()
             for timeout in range(IO_TIMEOUT):
                 if not self.register(SYSRANGE_START) & 0x01:
                     break
@@ -268,11 +299,30 @@ class VL53L0X:
             else:
                 raise TimeoutError()
         for timeout in range(IO_TIMEOUT):
-            if self.register(RESULT_INTERRUPT_STATUS) & 0x07:
+            if self.measurement_ready():
                 break
             utime.sleep_ms(1)
         else:
             raise TimeoutError()
-        value = self.register(RESULT_RANGE_STATUS + 10, struct='>H')
-        self.register(INTERRUPT_CLEAR, 0x01)
-        return value
+        return self._read_result()
+
+    def read_into(self, buf, offset=0):
+        """Store the range in mm at buf[offset], return offset + 1."""
+        buf[offset] = self.read()
+        return offset + 1
+
+    # the range register already holds millimeters
+    raw_into = read_into
+
+    async def read_async(self):
+        """Same as read(), but yields to the uasyncio loop while ranging."""
+        if not self.started and not self._pending:
+            self.start_measurement()
+            await asyncio.sleep_ms(self.measurement_time_us // 1000)
+        for timeout in range(IO_TIMEOUT):
+            if self.measurement_ready():
+                break
+            await asyncio.sleep_ms(1)
+        else:
+            raise TimeoutError()
+        return self._read_result()
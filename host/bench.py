@@ -0,0 +1,190 @@
+"""
+Bus-cost benchmark of the driver APIs.
+
+Every operation runs against the simulated fabric (sim.py and models.py)
+and is measured per call: I2C/SPI transactions, bytes on the wire
+including address bytes, modeled bus time at the configured frequency,
+sleeps, total virtual time and the peak of Python allocations.
+
+    python host/bench.py                      # table
+    python host/bench.py --json bench.json    # also write JSON
+    python host/bench.py --compare bench.json # fail on regressions
+
+With --compare the exit status is 1 if any operation needs more
+transactions, bytes, bus time or sleep time than in the given file.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [HERE, os.path.dirname(HERE)]
+
+import sim
+import models
+import machine
+
+SCL, SDA = 'P6_0', 'P6_1'
+
+# compared by --compare, lower is better
+COST_KEYS = ('transactions', 'bytes', 'bus_us', 'slept_us')
+
+
+def _i2c(freq):
+    return machine.I2C(0, scl=SCL, sda=SDA, freq=freq)
+
+
+def _dps(freq):
+    from DPS import DPS
+    sim.i2c_bus(SCL, SDA).attach(models.DPS368Model())
+    dps = DPS(i2c=_i2c(freq))
+    return dps
+
+
+def _bme(freq):
+    from BME280 import BME280
+    sim.i2c_bus(SCL, SDA).attach(models.BME280Model())
+    return BME280(_i2c(freq))
+
+
+def _tof(freq):
+    from VL53L0X import VL53L0X
+    sim.i2c_bus(SCL, SDA).attach(models.VL53L0XModel())
+    return VL53L0X(i2c=_i2c(freq))
+
+
+def _lcd(freq):
+    from LCD16x2 import LCD16x2
+    sim.i2c_bus(SCL, SDA).attach(models.PCF8574LCDModel())
+    lcd = LCD16x2(i2c=_i2c(min(freq, 100000)))
+    lcd.LCD_INIT()
+    return lcd
+
+
+def _tlv(freq):
+    from TLV import TLV493D
+    sim.i2c_bus(SCL, SDA).attach(models.TLV493DModel())
+    return TLV493D(i2c=_i2c(freq))
+
+
+def _hbridge(freq):
+    from HBridgeKit2Go import HBridgeKit2Go
+    sim.spi_bus('P9_2').attach(models.IFX9201Model('P9_3'))
+    return HBridgeKit2Go()
+
+
+def _sonar(freq):
+    from HCSR04 import HCSR04
+    models.HCSR04Model('P10_0', 'P10_1', distance_mm=1000)
+    return HCSR04('P10_0', 'P10_1')
+
+
+# name: (setup(freq) -> driver, operation(driver), calls)
+OPERATIONS = {
+    'DPS.measurePressureOnce': (_dps, lambda d: d.measurePressureOnce(), 10),
+    'DPS.measureTemperatureOnce': (_dps, lambda d: d.measureTemperatureOnce(), 10),
+    'BME280.read_compensated_data': (_bme, lambda d: d.read_compensated_data(), 10),
+    # forget the cached SPAD information so the whole sequence runs
+    'VL53L0X.init': (_tof, lambda d: (setattr(d, '_spad', None), d.init()), 1),
+    'VL53L0X.read': (_tof, lambda d: d.read(), 10),
+    'LCD16x2.LCD_INIT': (_lcd, lambda d: d.LCD_INIT(), 1),
+    'LCD16x2.LCD_resync': (_lcd, lambda d: d.LCD_resync(), 1),
+    'LCD16x2.LCD_writeString': (_lcd, lambda d: d.LCD_writeString('Hello World 1234'), 10),
+    'HBridgeKit2Go.enableOutput': (_hbridge, lambda d: d.enableOutput(), 10),
+    'TLV493D.update_data': (_tlv, lambda d: d.update_data(), 10),
+    'HCSR04.measure': (_sonar, lambda d: d.measure(5), 1),
+}
+
+
+def measure(name, freq=400000):
+    """
+    Runs one operation and returns its average cost per call as a dict
+    """
+    setup, op, calls = OPERATIONS[name]
+    sim.reset()
+    with contextlib.redirect_stdout(io.StringIO()):
+        driver = setup(freq)
+        buses = sim.buses()
+        for bus in buses:
+            bus.transactions = bus.bytes = bus.bus_us = 0
+        clock = sim.clock
+        clock.sleeps = clock.slept_us = 0
+        t0 = clock.now_us
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        for _ in range(calls):
+            op(driver)
+        peak = tracemalloc.get_traced_memory()[1] - base
+        tracemalloc.stop()
+    return {
+        'calls': calls,
+        'freq': freq,
+        'transactions': sum(b.transactions for b in buses) / calls,
+        'bytes': sum(b.bytes for b in buses) / calls,
+        'bus_us': sum(b.bus_us for b in buses) / calls,
+        'sleeps': clock.sleeps / calls,
+        'slept_us': clock.slept_us / calls,
+        'elapsed_us': (clock.now_us - t0) / calls,
+        'alloc_peak_bytes': peak,
+    }
+
+
+def run(names=None, freq=400000):
+    return {name: measure(name, freq) for name in (names or OPERATIONS)}
+
+
+def table(results):
+    lines = ['%-30s %8s %8s %10s %7s %10s %11s %9s' % (
+        'operation', 'xfers', 'bytes', 'bus us', 'sleeps', 'slept us',
+        'elapsed us', 'alloc B')]
+    for name, r in results.items():
+        lines.append('%-30s %8.1f %8.1f %10.1f %7.1f %10.1f %11.1f %9d' % (
+            name, r['transactions'], r['bytes'], r['bus_us'], r['sleeps'],
+            r['slept_us'], r['elapsed_us'], r['alloc_peak_bytes']))
+    return '\n'.join(lines)
+
+
+def regressions(results, baseline):
+    """
+    Returns a line per cost that grew compared with baseline
+    """
+    out = []
+    for name, r in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        for key in COST_KEYS:
+            if r[key] > old[key]:
+                out.append('%s: %s %s -> %s' % (name, key, old[key], r[key]))
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('operations', nargs='*', help='subset to run')
+    parser.add_argument('--freq', type=int, default=400000,
+                        help='I2C frequency (the LCD is capped at 100kHz)')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='baseline JSON to check against')
+    args = parser.parse_args(argv)
+
+    results = run(args.operations, args.freq)
+    print(table(results))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            found = regressions(results, json.load(f))
+        for line in found:
+            print('REGRESSION', line)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
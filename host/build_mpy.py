@@ -0,0 +1,154 @@
+"""
+Cross-compiles the drivers to .mpy bytecode for deployment.
+
+Source files are compiled by the board at every boot, which takes time
+and heap; .mpy files are loaded as they are. This runs mpy-cross (pip
+install mpy-cross) on the drivers and the mipy package and writes to
+the output directory (build by default):
+
+  deploy/            the .mpy files in the layout to copy to the board,
+                     e.g. mpremote cp -r build/deploy/. :
+  deploy/bundle.json size and source hash of every module
+  mipy-deploy.zip    the same bundle as one archive
+  manifest.py        manifest to freeze the sources into a firmware
+                     build, which leaves the bytecode and constant tables
+                     such as the VL53L0X tuning bytes in flash
+
+The generated register map blocks are checked first (host/regmap.py
+--check), so a stale driver is not deployed.
+
+    python host/build_mpy.py
+    python host/build_mpy.py --opt 1 --out build
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import zipfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+import regmap
+
+# modules that run on the board, relative to the repository root
+DRIVERS = ('BME280.py', 'DPS.py', 'HBridgeKit2Go.py', 'HCSR04.py',
+           'LCD16x2.py', 'TLV.py', 'VL53L0X.py')
+PACKAGES = ('mipy',)
+
+
+def sources():
+    """
+    Returns the board modules as paths relative to the repository root
+    """
+    files = list(DRIVERS)
+    for package in PACKAGES:
+        for name in sorted(os.listdir(os.path.join(ROOT, package))):
+            if name.endswith('.py'):
+                files.append(package + '/' + name)
+    return files
+
+
+def find_mpy_cross():
+    """
+    Returns the command line prefix that runs mpy-cross
+    """
+    exe = shutil.which('mpy-cross')
+    if exe is not None:
+        return [exe]
+    try:
+        import mpy_cross
+    except ImportError:
+        raise SystemExit('mpy-cross not found, install it with: pip install mpy-cross')
+    return [sys.executable, '-m', 'mpy_cross']
+
+
+def compile_module(mpy_cross, src, dst, opt=0, march=None):
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    cmd = mpy_cross + ['-o', dst, '-s', os.path.relpath(src, ROOT).replace(os.sep, '/')]
+    if opt:
+        cmd.append('-O%d' % opt)
+    if march:
+        cmd.append('-march=' + march)
+    subprocess.run(cmd + [src], check=True)
+
+
+def write_manifest(path):
+    """
+    Writes a MicroPython manifest freezing the board modules, paths are
+    relative to the manifest
+    """
+    base = os.path.relpath(ROOT, os.path.dirname(path)).replace(os.sep, '/')
+    lines = ['# Freezes the drivers into the firmware, written by host/build_mpy.py',
+             'include("$(PORT_DIR)/boards/manifest.py")']
+    for name in DRIVERS:
+        lines.append('module("%s", base_path="%s")' % (name, base))
+    for package in PACKAGES:
+        lines.append('package("%s", base_path="%s")' % (package, base))
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def build(out, opt=0, march=None):
+    """
+    Compiles every board module into out/deploy and writes the bundle,
+    the zip archive and the freeze manifest. Returns the bundle entries.
+    """
+    mpy_cross = find_mpy_cross()
+    deploy = os.path.join(out, 'deploy')
+    if os.path.isdir(deploy):
+        shutil.rmtree(deploy)
+    entries = []
+    for name in sources():
+        src = os.path.join(ROOT, name)
+        mpy = name[:-3] + '.mpy'
+        dst = os.path.join(deploy, mpy)
+        compile_module(mpy_cross, src, dst, opt, march)
+        with open(src, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        entries.append({'module': mpy, 'source': name,
+                        'source_bytes': os.path.getsize(src),
+                        'mpy_bytes': os.path.getsize(dst),
+                        'sha256': digest})
+    with open(os.path.join(deploy, 'bundle.json'), 'w') as f:
+        json.dump({'opt': opt, 'march': march, 'modules': entries}, f, indent=1)
+    with zipfile.ZipFile(os.path.join(out, 'mipy-deploy.zip'), 'w',
+                         zipfile.ZIP_DEFLATED) as z:
+        for e in entries:
+            z.write(os.path.join(deploy, e['module']), e['module'])
+        z.write(os.path.join(deploy, 'bundle.json'), 'bundle.json')
+    write_manifest(os.path.join(out, 'manifest.py'))
+    return entries
+
+
+def table(entries):
+    lines = ['%-24s %9s %9s' % ('module', 'source B', 'mpy B')]
+    for e in entries:
+        lines.append('%-24s %9d %9d' % (e['module'], e['source_bytes'], e['mpy_bytes']))
+    lines.append('%-24s %9d %9d' % ('total', sum(e['source_bytes'] for e in entries),
+                                    sum(e['mpy_bytes'] for e in entries)))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--out', default=os.path.join(ROOT, 'build'),
+                        help='output directory (default: build)')
+    parser.add_argument('--opt', type=int, default=0,
+                        help='mpy-cross optimization level, 1 and up drop asserts')
+    parser.add_argument('--march', help='native emitter architecture, e.g. armv7emsp '
+                        'for the PSoC6 Cortex-M4, only used by @micropython.native code')
+    args = parser.parse_args(argv)
+    if regmap.main(['--check']):
+        print('generated register maps are out of date, run host/regmap.py')
+        return 1
+    print(table(build(args.out, args.opt, args.march)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
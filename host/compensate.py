@@ -0,0 +1,174 @@
+"""
+Vectorized compensation of raw DPS and BME280 readings.
+
+The functions repeat the floating point operations of DPS.calcCompPressure,
+DPS.calcCompTemperature and BME280.compensate in the same order on NumPy
+float64 arrays, so they give the same results as the drivers running on
+CPython, bit for bit (BME280 results rounded to float32, like the array
+the driver returns). On the board, MicroPython computes in single
+precision and the last bits differ.
+
+The calibration is exported once from the device with DPS.calibration()
+or BME280.calibration(), e.g. printed as JSON:
+
+    import sys
+    sys.path[:0] = ['host', '.']
+    from compensate import dps_compensate, bme280_compensate
+    pressure, temperature = dps_compensate(raw_p, raw_t, dps_cal)
+    temperature, pressure, humidity = bme280_compensate(raw_t, raw_p, raw_h, bme_cal)
+
+Raw register blocks captured with mipy.raw are split with dps_unpack and
+bme280_unpack first.
+
+    python host/compensate.py    # agreement check against the drivers and speed
+"""
+import os
+import sys
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _be24(b):
+    return (b[:, 0].astype(np.int32) << 16) | (b[:, 1].astype(np.int32) << 8) | b[:, 2]
+
+
+def dps_unpack(data):
+    """
+    Splits raw blocks of DPS.read_raw_block (e.g. from RawRing.drain_raw)
+    into arrays of raw pressure and temperature
+    """
+    b = np.frombuffer(data, dtype=np.uint8).reshape(-1, 6)
+    raw_p = _be24(b[:, 0:3])
+    raw_t = _be24(b[:, 3:6])
+    # sign extend the 24 bit values
+    return (raw_p << 8) >> 8, (raw_t << 8) >> 8
+
+
+def bme280_unpack(data):
+    """
+    Splits raw blocks of BME280.read_raw_block into arrays of raw
+    temperature, pressure and humidity
+    """
+    b = np.frombuffer(data, dtype=np.uint8).reshape(-1, 8)
+    raw_p = _be24(b[:, 0:3]) >> 4
+    raw_t = _be24(b[:, 3:6]) >> 4
+    raw_h = (b[:, 6].astype(np.int32) << 8) | b[:, 7]
+    return raw_t, raw_p, raw_h
+
+
+def dps_compensate(raw_p, raw_t, cal):
+    """
+    Returns compensated pressure [Pa] and temperature [C] for arrays of raw
+    24 bit readings, cal as returned by DPS.calibration()
+    """
+    scaled_p = np.asarray(raw_p, dtype=np.float64) / cal['kP']
+    scaled_t = np.asarray(raw_t, dtype=np.float64) / cal['kT']
+    temperature = cal['c0'] * 0.5 + cal['c1'] * scaled_t
+    pressure = (cal['c00'] + scaled_p * (cal['c10'] + scaled_p * (cal['c20'] + scaled_p * cal['c30']))
+                + scaled_t * (cal['c01'] + scaled_p * (cal['c11'] + scaled_p * cal['c21'])))
+    return pressure, temperature
+
+
+def bme280_compensate(raw_t, raw_p, raw_h, cal):
+    """
+    Returns compensated temperature [C], pressure [Pa] and humidity [%RH]
+    for arrays of raw readings, cal as returned by BME280.calibration()
+    """
+    raw_t = np.asarray(raw_t, dtype=np.float64)
+    raw_p = np.asarray(raw_p, dtype=np.float64)
+    raw_h = np.asarray(raw_h, dtype=np.float64)
+
+    # temperature
+    var1 = (raw_t / 16384.0 - cal['dig_T1'] / 1024.0) * cal['dig_T2']
+    var2 = raw_t / 131072.0 - cal['dig_T1'] / 8192.0
+    var2 = var2 * var2 * cal['dig_T3']
+    t_fine = np.trunc(var1 + var2)
+    temp = np.clip((var1 + var2) / 5120.0, -40, 85)
+
+    # pressure
+    var1 = (t_fine / 2.0) - 64000.0
+    var2 = var1 * var1 * cal['dig_P6'] / 32768.0 + var1 * cal['dig_P5'] * 2.0
+    var2 = (var2 / 4.0) + (cal['dig_P4'] * 65536.0)
+    var1 = (cal['dig_P3'] * var1 * var1 / 524288.0 + cal['dig_P2'] * var1) / 524288.0
+    var1 = (1.0 + var1 / 32768.0) * cal['dig_P1']
+    zero = var1 == 0.0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = ((1048576.0 - raw_p) - (var2 / 4096.0)) * 6250.0 / var1
+    var1 = cal['dig_P9'] * p * p / 2147483648.0
+    var2 = p * cal['dig_P8'] / 32768.0
+    pressure = p + (var1 + var2 + cal['dig_P7']) / 16.0
+    pressure = np.where(zero, 30000.0, np.clip(pressure, 30000, 110000))
+
+    # humidity
+    h = t_fine - 76800.0
+    h = ((raw_h - (cal['dig_H4'] * 64.0 + cal['dig_H5'] / 16384.0 * h)) *
+         (cal['dig_H2'] / 65536.0 * (1.0 + cal['dig_H6'] / 67108864.0 * h *
+                                    (1.0 + cal['dig_H3'] / 67108864.0 * h))))
+    humidity = h * (1.0 - cal['dig_H1'] * h / 524288.0)
+    humidity = np.clip(humidity, 0, 100.0)
+
+    return temp, pressure, humidity
+
+
+def _check(n=20000, seed=1):
+    """
+    Compensates random raw readings with the drivers, running against the
+    simulated sensors, and with the vectorized functions, and asserts that
+    the results are identical
+    """
+    import time
+    from array import array
+    sys.path[:0] = [HERE, os.path.dirname(HERE)]
+    import sim
+    import models
+    import machine
+    from DPS import DPS
+    from BME280 import BME280
+
+    sim.reset()
+    bus = sim.i2c_bus('P6_0', 'P6_1')
+    bus.attach(models.DPS368Model())
+    bus.attach(models.BME280Model())
+    i2c = machine.I2C(0, scl='P6_0', sda='P6_1', freq=400000)
+    dps = DPS(i2c=i2c)
+    bme = BME280(i2c)
+    rng = np.random.default_rng(seed)
+
+    dps_cal = dps.calibration()
+    raw_p = rng.integers(-(1 << 23), 1 << 23, n)
+    raw_t = rng.integers(-(1 << 23), 1 << 23, n)
+    pressure, temperature = dps_compensate(raw_p, raw_t, dps_cal)
+    for i in range(n):
+        p = int(raw_p[i]) / dps.kP
+        t = int(raw_t[i]) / dps.kT
+        assert dps.calcCompPressure(p, t) == pressure[i], i
+        assert dps.calcCompTemperature(t) == temperature[i], i
+
+    bme_cal = bme.calibration()
+    raw = rng.integers(0, 1 << 20, (3, n))
+    raw[2] &= 0xFFFF
+    vec = np.array(bme280_compensate(raw[0], raw[1], raw[2], bme_cal), dtype=np.float32)
+    result = array('f', [0, 0, 0])
+    for i in range(n):
+        bme.compensate((int(raw[0, i]), int(raw[1, i]), int(raw[2, i])), result)
+        assert np.array_equal(np.array(result, dtype=np.float32), vec[:, i]), i
+    print('%d DPS and %d BME280 samples agree bit for bit' % (n, n))
+
+    m = 1000000
+    raw_p = rng.integers(-(1 << 23), 1 << 23, m)
+    raw_t = rng.integers(-(1 << 23), 1 << 23, m)
+    t0 = time.perf_counter()
+    dps_compensate(raw_p, raw_t, dps_cal)
+    t1 = time.perf_counter()
+    raw = rng.integers(0, 1 << 16, (3, m))
+    t2 = time.perf_counter()
+    bme280_compensate(raw[0], raw[1], raw[2], bme_cal)
+    t3 = time.perf_counter()
+    print('DPS %.1f M samples/s, BME280 %.1f M samples/s'
+          % (m / (t1 - t0) / 1e6, m / (t3 - t2) / 1e6))
+
+
+if __name__ == '__main__':
+    _check()
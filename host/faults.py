@@ -0,0 +1,138 @@
+"""
+Fault-injection check of the drivers behind mipy.recovery.RecoveringI2C.
+
+Every operation runs once on a clean simulated bus, then once more per
+transaction it made with exactly that transaction failing (sim fail()
+with skip). After recovery and retry the result has to equal the clean
+one; a retried read that lands on the wrong register shows up as a
+mismatch.
+
+    python host/faults.py
+    python host/faults.py DPS.getRawPressure
+
+The exit status is 1 if any result differs or a failure was given up on.
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [HERE, os.path.dirname(HERE)]
+
+import sim
+import models
+
+SCL, SDA = 'P6_0', 'P6_1'
+
+
+def _i2c(device_addr, make):
+    from mipy.recovery import RecoveringI2C
+    i2c = RecoveringI2C(0, scl=SCL, sda=SDA)
+    driver = make(i2c)
+    # TLV493D keeps no configuration, every read writes its mode
+    if hasattr(driver, 'restore'):
+        i2c.protect(device_addr, driver)
+    return i2c, driver
+
+
+def _dps():
+    from DPS import DPS
+    sim.i2c_bus(SCL, SDA).attach(models.DPS368Model())
+    return _i2c(0x77, lambda i2c: DPS(i2c=i2c))
+
+
+def _bme():
+    from BME280 import BME280
+    sim.i2c_bus(SCL, SDA).attach(models.BME280Model())
+    return _i2c(0x76, BME280)
+
+
+def _tof():
+    from VL53L0X import VL53L0X
+    sim.i2c_bus(SCL, SDA).attach(models.VL53L0XModel())
+    return _i2c(0x29, lambda i2c: VL53L0X(i2c=i2c))
+
+
+def _tlv():
+    from TLV import TLV493D
+    sim.i2c_bus(SCL, SDA).attach(models.TLV493DModel())
+    return _i2c(0x5e, TLV493D)
+
+
+def _raw(driver):
+    buf = [0] * len(driver.fields)
+    driver.raw_into(buf)
+    return buf
+
+
+def _block(driver):
+    buf = bytearray(driver.raw_block_size)
+    driver.read_raw_block(buf)
+    return bytes(buf)
+
+
+# name: (setup() -> (i2c, driver), operation(driver) -> result)
+OPERATIONS = {
+    'DPS.getRawPressure': (_dps, lambda d: d.getRawPressure()),
+    'DPS.getRawTemperature': (_dps, lambda d: d.getRawTemperature()),
+    'DPS.measurement_ready': (_dps, lambda d: d.measurement_ready()),
+    'DPS.readCalibration': (_dps, lambda d: (d.readCalibration(), d.calibration())[1]),
+    'DPS.read_raw_block': (_dps, _block),
+    'BME280.raw_into': (_bme, _raw),
+    'BME280.read_compensated_data': (_bme, lambda d: d.read_compensated_data()),
+    'VL53L0X.read': (_tof, lambda d: d.read()),
+    'TLV493D.raw_into': (_tlv, _raw),
+}
+
+
+def _run(name, fail_at=None):
+    setup, op = OPERATIONS[name]
+    sim.reset()
+    with contextlib.redirect_stdout(io.StringIO()):
+        i2c, driver = setup()
+        bus = sim.i2c_bus(SCL, SDA)
+        bus.transactions = 0
+        if fail_at is not None:
+            bus.fail(1, skip=fail_at)
+        result = op(driver)
+    return result, bus.transactions, i2c.stats()
+
+
+def check(name):
+    """
+    Returns (transactions of a clean run, lines describing mismatches)
+    """
+    clean, n, _ = _run(name)
+    problems = []
+    for k in range(n):
+        try:
+            result, _, stats = _run(name, k)
+        except OSError as e:
+            problems.append('%s: transaction %d: raised %r' % (name, k, e))
+            continue
+        if result != clean:
+            problems.append('%s: transaction %d failed: %r instead of %r'
+                            % (name, k, result, clean))
+        elif stats['failures'] or not stats['recoveries']:
+            problems.append('%s: transaction %d: %r' % (name, k, stats))
+    return n, problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('operations', nargs='*', help='subset to run')
+    args = parser.parse_args(argv)
+    found = []
+    for name in args.operations or OPERATIONS:
+        n, problems = check(name)
+        print('%-30s %3d transactions %s' % (name, n, 'FAIL' if problems else 'ok'))
+        found += problems
+    for line in found:
+        print(line)
+    return 1 if found else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
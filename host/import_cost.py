@@ -0,0 +1,128 @@
+"""
+Import cost of the drivers: time and heap per module.
+
+Runs on the board as well as on the PC. Deploy the sources or the .mpy
+bundle of host/build_mpy.py, measure each with
+
+    mpremote run host/import_cost.py > source.json
+    mpremote run host/import_cost.py > mpy.json
+
+and compare on the PC:
+
+    python host/import_cost.py --compare source.json mpy.json
+
+Every output line is a JSON object for one module: the file it was
+loaded from, import_us, heap_bytes (heap still used after a collection)
+and transient_bytes (heap used right after the import, including what
+compiling the source left behind, unless a collection ran meanwhile).
+The last line gives mem_free after all imports. Under CPython without
+--compare the host stand-ins are imported and heap is taken from
+tracemalloc, which only shows relative sizes.
+"""
+import gc
+import json
+import sys
+
+MODULES = ('BME280', 'DPS', 'HBridgeKit2Go', 'HCSR04', 'LCD16x2', 'TLV',
+           'VL53L0X', 'mipy.sensor', 'mipy.bus', 'mipy.sched', 'mipy.raw',
+           'mipy.capture', 'mipy.logger', 'mipy.telemetry', 'mipy.altitude',
+           'mipy.power', 'mipy.adaptive', 'mipy.magcal', 'mipy.recovery', 'mipy.trace', 'mipy.record')
+
+MICROPYTHON = sys.implementation.name == 'micropython'
+
+
+if MICROPYTHON:
+    import utime as time
+
+    def _ticks():
+        return time.ticks_us()
+
+    def _elapsed(t0):
+        return time.ticks_diff(time.ticks_us(), t0)
+
+    def _free():
+        return gc.mem_free()
+else:
+    import time
+    import tracemalloc
+
+    def _ticks():
+        return time.perf_counter()
+
+    def _elapsed(t0):
+        return int((time.perf_counter() - t0) * 1000000)
+
+    def _free():
+        # negated so that used heap is a decrease, as with gc.mem_free
+        return -tracemalloc.get_traced_memory()[0]
+
+
+def measure(modules=MODULES):
+    """
+    Imports every module in turn, yields one result dict per module and
+    a last one with mem_free
+    """
+    for name in modules:
+        gc.collect()
+        free0 = _free()
+        t0 = _ticks()
+        __import__(name)
+        us = _elapsed(t0)
+        transient = free0 - _free()
+        gc.collect()
+        mod = sys.modules[name]
+        yield {'module': name, 'file': getattr(mod, '__file__', 'frozen'),
+               'import_us': us, 'heap_bytes': free0 - _free(),
+               'transient_bytes': transient}
+    gc.collect()
+    yield {'module': 'total', 'mem_free': _free() if MICROPYTHON else None}
+
+
+def _load(path):
+    with open(path) as f:
+        return {r['module']: r for r in (json.loads(line) for line in f if line.strip())}
+
+
+def compare(a_path, b_path):
+    a, b = _load(a_path), _load(b_path)
+    print('%-16s %10s %10s %10s %10s %10s %10s' % (
+        'module', 'us a', 'us b', 'heap a', 'heap b', 'trans a', 'trans b'))
+    sums = [0] * 6
+    for name in a:
+        if name == 'total' or name not in b:
+            continue
+        row = (a[name]['import_us'], b[name]['import_us'],
+               a[name]['heap_bytes'], b[name]['heap_bytes'],
+               a[name]['transient_bytes'], b[name]['transient_bytes'])
+        sums = [s + v for s, v in zip(sums, row)]
+        print('%-16s %10d %10d %10d %10d %10d %10d' % ((name,) + row))
+    print('%-16s %10d %10d %10d %10d %10d %10d' % tuple(['sum'] + sums))
+    if 'total' in a and 'total' in b:
+        print('mem_free after import: a %s, b %s' % (a['total']['mem_free'],
+                                                     b['total']['mem_free']))
+
+
+def main():
+    if MICROPYTHON:
+        for result in measure():
+            print(json.dumps(result))
+        return 0
+    import argparse
+    import os
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--compare', nargs=2, metavar=('A', 'B'),
+                        help='compare two measurements taken on the board')
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return 0
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path[:0] = [here, os.path.dirname(here)]
+    tracemalloc.start()
+    for result in measure():
+        print(json.dumps(result))
+    return 0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+Reads the files written by mipy.logger into NumPy structured arrays.
+
+The data blocks are memory mapped, not copied, so opening a large log is
+instant and only the records that are used are read from disk.
+
+    import sys
+    sys.path[:0] = ['host', '.']
+    import logreader
+    samples = logreader.load_all('log')       # log0000.log, log0001.log, ...
+    print(samples.dtype.names)                # ('ticks_us', 'bme.temperature', ...)
+    t = logreader.unwrap_ticks(samples['ticks_us'])
+
+    python host/logreader.py log0000.log [...] [--csv out.csv]
+"""
+import argparse
+import glob
+import json
+import os
+import struct
+import sys
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [HERE, os.path.dirname(HERE)]
+
+from mipy.logger import (MAGIC, VERSION, HEADER, HEADER_SIZE, BLOCK_SYNC,
+                         BLOCK_HEADER_SIZE)
+
+# MicroPython ticks_us wraps at 2**30 on most ports
+TICKS_PERIOD = 1 << 30
+
+
+def read_header(path):
+    """
+    Returns the file header as a dict: block_size, record_size,
+    per_block and the schema entries format, fields and units
+    """
+    with open(path, 'rb') as f:
+        head = f.read(HEADER_SIZE)
+        magic, version, block_size, record_size, per_block, length = \
+            struct.unpack(HEADER, head)
+        if magic != MAGIC:
+            raise ValueError('%s is not a sample log' % path)
+        if version != VERSION:
+            raise ValueError('%s: unsupported log version %d' % (path, version))
+        schema = json.loads(f.read(length))
+    schema.update(block_size=block_size, record_size=record_size,
+                  per_block=per_block)
+    return schema
+
+
+def record_dtype(header):
+    """
+    NumPy dtype of one record described by a file header
+    """
+    fmt = header['format']
+    codes = fmt[1:] if fmt[0] in '<>=!@' else fmt
+    return np.dtype([(name, '<' + code) for name, code
+                     in zip(header['fields'], codes)])
+
+
+def block_dtype(header):
+    rec = record_dtype(header)
+    used = BLOCK_HEADER_SIZE + header['per_block'] * rec.itemsize
+    fields = [('sync', '<u2'), ('count', '<u2'), ('seq', '<u4'),
+              ('records', rec, (header['per_block'],))]
+    if header['block_size'] > used:
+        fields.append(('pad', 'V%d' % (header['block_size'] - used)))
+    return np.dtype(fields)
+
+
+def load_blocks(path):
+    """
+    Memory maps the data blocks of a log file. Returns (header, blocks);
+    a trailing partial block, left by a reset while writing, is ignored.
+    """
+    header = read_header(path)
+    dtype = block_dtype(header)
+    size = os.path.getsize(path) - header['block_size']
+    n = max(size, 0) // dtype.itemsize
+    if n == 0:
+        return header, np.zeros(0, dtype)
+    blocks = np.memmap(path, dtype=dtype, mode='r', offset=header['block_size'],
+                       shape=(n,))
+    return header, blocks
+
+
+def load(path):
+    """
+    Returns the valid records of a log file as a structured array
+    """
+    header, blocks = load_blocks(path)
+    return _records(path, blocks)
+
+
+def _records(path, blocks):
+    bad = blocks['sync'] != BLOCK_SYNC
+    if bad.any():
+        raise ValueError('%s: corrupt block %d' % (path, np.flatnonzero(bad)[0]))
+    per_block = blocks.dtype['records'].shape[0]
+    valid = np.arange(per_block) < blocks['count'][:, None]
+    return blocks['records'][valid]
+
+
+def find(prefix):
+    """
+    Returns the files prefix0000.log, prefix0001.log, ... in order
+    """
+    return sorted(glob.glob(glob.escape(prefix) + '[0-9][0-9][0-9][0-9].log'))
+
+
+def load_all(prefix_or_paths):
+    """
+    Concatenates the records of several log files of the same schema.
+    Gaps in the block sequence numbers (lost blocks or files) are
+    reported on stderr.
+    """
+    if isinstance(prefix_or_paths, str):
+        paths = find(prefix_or_paths)
+    else:
+        paths = list(prefix_or_paths)
+    if not paths:
+        raise ValueError('no log files')
+    parts = []
+    expect = None
+    for path in paths:
+        header, blocks = load_blocks(path)
+        if len(blocks):
+            seq = blocks['seq'].astype(np.int64)
+            if expect is not None and seq[0] != expect:
+                sys.stderr.write('%s: blocks %d to %d missing\n'
+                                 % (path, expect, seq[0] - 1))
+            gaps = np.flatnonzero(np.diff(seq) != 1)
+            for i in gaps:
+                sys.stderr.write('%s: blocks %d to %d missing\n'
+                                 % (path, seq[i] + 1, seq[i + 1] - 1))
+            expect = seq[-1] + 1
+        parts.append(_records(path, blocks))
+    if len({p.dtype for p in parts}) > 1:
+        raise ValueError('log files have different schemas')
+    return np.concatenate(parts)
+
+
+def unwrap_ticks(ticks, period=TICKS_PERIOD):
+    """
+    Turns wrapping ticks_us values into monotonic int64 microseconds
+    counted from the first record
+    """
+    ticks = np.asarray(ticks, dtype=np.int64)
+    if len(ticks) == 0:
+        return ticks
+    step = np.diff(ticks) % period
+    return np.concatenate(([0], np.cumsum(step)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Summarize or export sample logs.')
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--csv', help='write the records to this CSV file')
+    args = parser.parse_args(argv)
+    header = read_header(args.paths[0])
+    samples = load_all(args.paths)
+    t = unwrap_ticks(samples['ticks_us'])
+    print('%d records over %.3f s, %d per block of %d bytes'
+          % (len(samples), t[-1] / 1e6 if len(t) else 0,
+             header['per_block'], header['block_size']))
+    for name, unit in zip(header['fields'][1:], header['units'][1:]):
+        col = samples[name]
+        print('%-24s %-4s min %12g  mean %12g  max %12g'
+              % (name, unit, col.min(), col.mean(), col.max()))
+    if args.csv:
+        np.savetxt(args.csv, samples, delimiter=',',
+                   header=','.join(header['fields']), comments='',
+                   fmt=['%d'] + ['%.9g'] * (len(header['fields']) - 1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Host stand-in for the MicroPython `machine` module, backed by sim.py.
+"""
+import sim
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_RISING = sim.PinState.IRQ_RISING
+    IRQ_FALLING = sim.PinState.IRQ_FALLING
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.name = sim._pin_name(id)
+        self._state = sim.pin(self.name)
+        self.init(mode, pull, value)
+
+    def init(self, mode=-1, pull=-1, value=None):
+        if mode != -1:
+            self._state.mode = mode
+        if value is not None:
+            self._state.set(value)
+
+    def value(self, x=None):
+        if x is None:
+            sim.clock.advance(sim.CALL_COST_US)
+            return self._state.value
+        self._state.set(x)
+
+    def __call__(self, x=None):
+        return self.value(x)
+
+    def on(self):
+        self._state.set(1)
+
+    def off(self):
+        self._state.set(0)
+
+    def irq(self, handler=None, trigger=IRQ_RISING | IRQ_FALLING, hard=False):
+        self._state.handler = handler
+        self._state.trigger = trigger
+        self._state.owner = self
+
+    def __repr__(self):
+        return "Pin('%s')" % self.name
+
+
+class I2C:
+
+    def __init__(self, id=0, scl='P6_0', sda='P6_1', freq=400000, timeout=50000):
+        self._bus = sim.i2c_bus(scl, sda)
+        # a new I2C object reconfigures the peripheral for everyone on it
+        self._bus.freq = freq
+
+    def init(self, scl='P6_0', sda='P6_1', freq=400000):
+        self._bus = sim.i2c_bus(scl, sda)
+        self._bus.freq = freq
+
+    def deinit(self):
+        pass
+
+    def scan(self):
+        return sorted(self._bus.devices)
+
+    def writeto(self, addr, buf, stop=True):
+        self._bus.write(addr, buf)
+        return len(buf)
+
+    def readfrom(self, addr, nbytes, stop=True):
+        return self._bus.read(addr, nbytes)
+
+    def readfrom_into(self, addr, buf, stop=True):
+        buf[:] = self._bus.read(addr, len(buf))
+
+    def writeto_mem(self, addr, memaddr, buf, addrsize=8):
+        self._bus.write_mem(addr, memaddr, buf)
+
+    def readfrom_mem(self, addr, memaddr, nbytes, addrsize=8):
+        return self._bus.read_mem(addr, memaddr, nbytes)
+
+    def readfrom_mem_into(self, addr, memaddr, buf, addrsize=8):
+        buf[:] = self._bus.read_mem(addr, memaddr, len(buf))
+
+
+class SPI:
+    MSB = 0
+    LSB = 1
+
+    def __init__(self, id=0, baudrate=1000000, polarity=0, phase=0, bits=8,
+                 firstbit=MSB, sck='P9_2', mosi='P9_0', miso='P9_1'):
+        self._bus = sim.spi_bus(sck)
+        self._bus.baudrate = baudrate
+
+    def init(self, baudrate=1000000, **kwargs):
+        self._bus.baudrate = baudrate
+
+    def deinit(self):
+        pass
+
+    def write(self, buf):
+        self._bus.transfer(buf)
+
+    def read(self, nbytes, write=0x00):
+        return self._bus.transfer(bytes([write]) * nbytes)
+
+    def readinto(self, buf, write=0x00):
+        buf[:] = self._bus.transfer(bytes([write]) * len(buf))
+
+    def write_readinto(self, write_buf, read_buf):
+        read_buf[:] = self._bus.transfer(write_buf)
+
+
+_irq_state = [True]
+
+
+def disable_irq():
+    state = _irq_state[0]
+    _irq_state[0] = False
+    return state
+
+
+def enable_irq(state=True):
+    _irq_state[0] = state
+
+
+def idle():
+    sim.clock.advance(sim.CALL_COST_US)
+
+
+def lightsleep(time_ms=None):
+    sim.clock.advance((time_ms or 0) * 1000)
+
+
+def deepsleep(time_ms=None):
+    sim.clock.advance((time_ms or 0) * 1000)
+
+
+def freq():
+    return 150000000
+
+
+def unique_id():
+    return b'MIPYSIM0'
+
+
+def reset():
+    sim.reset()
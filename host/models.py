@@ -0,0 +1,539 @@
+"""
+Register-level models of the parts the drivers talk to, for sim.py.
+
+I2C models are attached with sim.i2c_bus(...).attach(model), SPI models
+with sim.spi_bus(...).attach(model). HCSR04Model works on pins instead of
+a bus. The models implement what the drivers use and the timing they
+depend on, not every feature of the parts.
+"""
+import struct
+
+import sim
+
+
+class I2CModel:
+    """
+    Register file with an auto-incrementing pointer: the first byte of a
+    write selects the register, further bytes are written from there and
+    reads continue from the pointer.
+    """
+
+    max_freq = 400000
+
+    def __init__(self, address):
+        self.address = address
+        self.regs = bytearray(256)
+        self.ptr = 0
+        self.clock = None
+        self.freq_violations = 0
+        # set by the bus before each transfer
+        self.xfer_start_us = 0
+        self.byte_us = 0
+
+    def attach(self, clock):
+        self.clock = clock
+
+    @property
+    def now(self):
+        return self.clock.now_us
+
+    def write(self, data):
+        if not data:
+            return
+        self.ptr = data[0]
+        for b in data[1:]:
+            self.write_reg(self.ptr, b)
+            self.ptr = (self.ptr + 1) & 0xFF
+
+    def read(self, nbytes):
+        out = bytearray(nbytes)
+        for i in range(nbytes):
+            out[i] = self.read_reg(self.ptr)
+            self.ptr = (self.ptr + 1) & 0xFF
+        return out
+
+    def write_reg(self, reg, value):
+        self.regs[reg] = value
+
+    def read_reg(self, reg):
+        return self.regs[reg]
+
+
+class BME280Model(I2CModel):
+    """
+    BME280 in sleep, forced and normal mode. The raw ADC words returned
+    after a conversion are adc_t, adc_p and adc_h; the default calibration
+    and raw values are the datasheet example (25.08C, 100653Pa).
+    """
+
+    # CONFIG t_sb standby times
+    T_SB_US = (500, 62500, 125000, 250000, 500000, 1000000, 10000, 20000)
+
+    CALIB = dict(T1=27504, T2=26435, T3=-1000, P1=36477, P2=-10685,
+                 P3=3024, P4=2855, P5=140, P6=-7, P7=15500, P8=-14600,
+                 P9=6000, H1=75, H2=362, H3=0, H4=313, H5=50, H6=30)
+
+    def __init__(self, address=0x76, calib=None):
+        super().__init__(address)
+        self.calib = dict(self.CALIB, **(calib or {}))
+        c = self.calib
+        self.regs[0xD0] = 0x60
+        self.regs[0x88:0xA0] = struct.pack(
+            '<HhhHhhhhhhhh', c['T1'], c['T2'], c['T3'], c['P1'], c['P2'],
+            c['P3'], c['P4'], c['P5'], c['P6'], c['P7'], c['P8'], c['P9'])
+        self.regs[0xA1] = c['H1']
+        h4, h5 = c['H4'] & 0xFFF, c['H5'] & 0xFFF
+        self.regs[0xE1:0xE8] = struct.pack('<hB', c['H2'], c['H3']) + bytes(
+            [h4 >> 4, (h4 & 0xF) | ((h5 & 0xF) << 4), h5 >> 4, c['H6'] & 0xFF])
+        self.adc_t = 519888
+        self.adc_p = 415148
+        self.adc_h = 30000
+        self.busy_until = 0
+        self.conversions = 0
+        # bumped on every mode change, drops the events of normal mode
+        self._gen = 0
+
+    def _osr(self, bits):
+        return (1 << (bits - 1)) if bits else 0
+
+    def write_reg(self, reg, value):
+        self.regs[reg] = value
+        if reg == 0xF4:
+            self._gen += 1
+            if value & 0x03:
+                self._convert()
+        elif reg == 0xE0 and value == 0xB6:
+            self._gen += 1
+            self.regs[0xF2:0xF6] = bytes(4)
+
+    def _convert(self):
+        value = self.regs[0xF4]
+        ctrl_hum = self.regs[0xF2] & 0x07
+        t = 1250 + 2300 * self._osr(value >> 5)
+        if (value >> 2) & 0x07:
+            t += 2300 * self._osr((value >> 2) & 0x07) + 575
+        if ctrl_hum:
+            t += 2300 * self._osr(ctrl_hum) + 575
+        self.busy_until = self.now + t
+        self.conversions += 1
+        gen = self._gen
+        self.clock.at(self.busy_until, lambda: self._done(gen))
+
+    def _done(self, gen):
+        if gen != self._gen:
+            return
+        # result registers update, forced mode returns to sleep mode and
+        # normal mode converts again after the standby time
+        p, t, h = self.adc_p, self.adc_t, self.adc_h
+        self.regs[0xF7:0xFF] = bytes([p >> 12, (p >> 4) & 0xFF, (p & 0xF) << 4,
+                                      t >> 12, (t >> 4) & 0xFF, (t & 0xF) << 4,
+                                      h >> 8, h & 0xFF])
+        if self.regs[0xF4] & 0x03 == 0x03:
+            standby = self.T_SB_US[self.regs[0xF5] >> 5]
+            self.clock.at(self.now + standby, lambda: gen == self._gen and self._convert())
+        else:
+            self.regs[0xF4] &= 0xFC
+
+    def read_reg(self, reg):
+        if reg == 0xF3:
+            return 0x08 if self.now < self.busy_until else 0x00
+        return self.regs[reg]
+
+
+class DPS368Model(I2CModel):
+    """
+    DPS368 in standby or background mode. set_environment() picks the raw
+    values that compensate to a pressure and temperature with the model's
+    calibration coefficients.
+    """
+
+    COEFFS = dict(c0=204, c1=-261, c00=80469, c10=-54410, c01=-2237,
+                  c11=1305, c20=-10433, c21=170, c30=-1368)
+
+    def __init__(self, address=0x77, coeffs=None, kP=1040384, kT=1040384):
+        super().__init__(address)
+        self.coeffs = dict(self.COEFFS, **(coeffs or {}))
+        self.kP = kP
+        self.kT = kT
+        self.regs[0x0D] = 0x10
+        self._pack_coeffs()
+        # COEF_RDY and SENSOR_RDY
+        self.regs[0x08] = 0xC0
+        self.bg_start = 0
+        self.bg_seen = 0
+        self.raw_p = 0
+        self.raw_t = 0
+        self.set_environment(101325.0, 22.0)
+
+    def _pack_coeffs(self):
+        c = {k: v & ((1 << (20 if k in ('c00', 'c10') else
+                          12 if k in ('c0', 'c1') else 16)) - 1)
+             for k, v in self.coeffs.items()}
+        r = self.regs
+        r[0x10] = c['c0'] >> 4
+        r[0x11] = ((c['c0'] & 0xF) << 4) | (c['c1'] >> 8)
+        r[0x12] = c['c1'] & 0xFF
+        r[0x13] = c['c00'] >> 12
+        r[0x14] = (c['c00'] >> 4) & 0xFF
+        r[0x15] = ((c['c00'] & 0xF) << 4) | (c['c10'] >> 16)
+        r[0x16] = (c['c10'] >> 8) & 0xFF
+        r[0x17] = c['c10'] & 0xFF
+        for reg, k in ((0x18, 'c01'), (0x1A, 'c11'), (0x1C, 'c20'),
+                       (0x1E, 'c21'), (0x20, 'c30')):
+            r[reg] = c[k] >> 8
+            r[reg + 1] = c[k] & 0xFF
+
+    def compensate(self, raw_p, raw_t):
+        c = self.coeffs
+        p = raw_p / self.kP
+        t = raw_t / self.kT
+        temp = c['c0'] * 0.5 + c['c1'] * t
+        press = (c['c00'] + p * (c['c10'] + p * (c['c20'] + p * c['c30']))
+                 + t * (c['c01'] + p * (c['c11'] + p * c['c21'])))
+        return press, temp
+
+    def set_environment(self, pressure, temperature):
+        c = self.coeffs
+        t = (temperature - c['c0'] * 0.5) / c['c1']
+        self.raw_t = int(round(t * self.kT))
+        t = self.raw_t / self.kT
+        # Newton on the pressure polynomial in the scaled raw value
+        p = 0.0
+        for _ in range(30):
+            f = self.compensate(p * self.kP, self.raw_t)[0] - pressure
+            df = (c['c10'] + 2 * p * c['c20'] + 3 * p * p * c['c30']
+                  + t * (c['c11'] + 2 * p * c['c21']))
+            p -= f / df
+        self.raw_p = int(round(p * self.kP))
+        self._store()
+
+    def _store(self):
+        for reg, v in ((0x00, self.raw_p), (0x03, self.raw_t)):
+            v &= 0xFFFFFF
+            self.regs[reg:reg + 3] = bytes([v >> 16, (v >> 8) & 0xFF, v & 0xFF])
+
+    @property
+    def period_us(self):
+        return 1000000 >> ((self.regs[0x06] >> 4) & 0x07)
+
+    def _update(self):
+        if self.regs[0x08] & 0x07 != 0x07:
+            return
+        n = (self.now - self.bg_start) // self.period_us
+        if n > self.bg_seen:
+            self.bg_seen = n
+            self.regs[0x08] |= 0x30
+
+    def write_reg(self, reg, value):
+        if reg == 0x08:
+            if value & 0x07 == 0x07 and self.regs[0x08] & 0x07 != 0x07:
+                self.bg_start = self.now
+                self.bg_seen = 0
+            self.regs[0x08] = (self.regs[0x08] & 0xF0) | (value & 0x07)
+            return
+        self.regs[reg] = value
+
+    def read_reg(self, reg):
+        self._update()
+        if reg == 0x00:
+            self.regs[0x08] &= ~0x10 & 0xFF
+        elif reg == 0x03:
+            self.regs[0x08] &= ~0x20 & 0xFF
+        return self.regs[reg]
+
+    @property
+    def standby(self):
+        return self.regs[0x08] & 0x07 == 0
+
+
+class TLV493DModel(I2CModel):
+    """
+    TLV493D-A1B6. Reads always start at register 0, writes go to the
+    separate write registers (MOD1 at index 1 selects the power mode).
+    Field values are raw 12-bit LSBs, temperature the raw 12-bit word.
+    """
+
+    max_freq = 1000000
+
+    def __init__(self, address=0x5E):
+        super().__init__(address)
+        self.wregs = bytearray(4)
+        self.bx = 100
+        self.by = -200
+        self.bz = 300
+        self.temp = 340
+        self.frame = 0
+
+    def write(self, data):
+        for i, b in enumerate(data[:4]):
+            self.wregs[i] = b
+
+    @property
+    def power_down(self):
+        return self.wregs[1] & 0x03 == 0
+
+    def read(self, nbytes):
+        bx, by, bz, t = (v & 0xFFF for v in (self.bx, self.by, self.bz, self.temp))
+        self.frame = (self.frame + 1) & 0x03
+        regs = bytes([bx >> 4, by >> 4, bz >> 4,
+                      ((t >> 8) << 4) | (self.frame << 2),
+                      ((bx & 0xF) << 4) | (by & 0xF), bz & 0xF,
+                      t & 0xFF, 0, 0, 0])
+        return regs[:nbytes]
+
+
+class VL53L0XModel(I2CModel):
+    """
+    VL53L0X with single, back-to-back and timed ranging. Register pages
+    are not modeled; the registers the driver polls during init and
+    ranging behave like on the part.
+    """
+
+    def __init__(self, address=0x29, distance_mm=500):
+        super().__init__(address)
+        self.distance_mm = distance_mm
+        self.measurement_us = 33000
+        self.regs[0x91] = 0x3C
+        self.regs[0x92] = 0x85
+        self.regs[0xB0:0xB6] = b'\xff' * 6
+        self.regs[0xF8:0xFA] = struct.pack('>H', 0x0100)
+        self.continuous = False
+        self.rangings = 0
+
+    def write_reg(self, reg, value):
+        if reg == 0x00:
+            if value & 0x06:
+                self.continuous = True
+                self._start()
+            elif value & 0x01:
+                if self.continuous:
+                    self.continuous = False
+                else:
+                    self._start()
+            return
+        if reg == 0x0B:
+            if value & 0x01:
+                self.regs[0x13] = 0
+            return
+        if reg == 0x83 and value == 0x00:
+            # spad info becomes available
+            self.regs[0x83] = 0x10
+            return
+        self.regs[reg] = value
+
+    def _start(self):
+        self.rangings += 1
+        self.clock.after(self.measurement_us, self._done)
+
+    def _done(self):
+        self.regs[0x13] = 0x04
+        self.regs[0x14] = 0x0B << 3
+        self.regs[0x1E:0x20] = struct.pack('>H', self.distance_mm)
+        if self.continuous:
+            self.clock.after(self.measurement_us, self._done)
+
+
+class PCF8574LCDModel(I2CModel):
+    """
+    HD44780 16x2 display behind a PCF8574 backpack (P0 RS, P1 RW, P2 EN,
+    P3 backlight, P4-P7 D4-D7). Nibbles are latched on the falling edge
+    of EN. An instruction that arrives while the controller is still busy
+    counts as a timing violation.
+    """
+
+    max_freq = 100000
+    POWER_ON_US = 40000
+
+    def __init__(self, address=0x27):
+        super().__init__(address)
+        self.ddram = bytearray(b' ' * 128)
+        self.cgram = bytearray(64)
+        self.ac = 0
+        self.cgram_mode = False
+        self.four_bit = False
+        self.init_steps = 0
+        self.increment = True
+        self.display_on = False
+        self.cursor = False
+        self.blink = False
+        self.shift = 0
+        self.backlight = False
+        self.busy_until = 0
+        self.violations = 0
+        self.instructions = 0
+        self.data_writes = 0
+        self._last = 0
+        self._nibble = None
+        self._t = 0
+
+    def attach(self, clock):
+        super().attach(clock)
+        self.busy_until = clock.now_us + self.POWER_ON_US
+
+    def write(self, data):
+        for i, b in enumerate(data):
+            self.backlight = bool(b & 0x08)
+            if self._last & 0x04 and not b & 0x04:
+                # the port changes once the byte has been clocked in
+                self._t = self.xfer_start_us + (i + 1) * self.byte_us
+                self._latch(self._last)
+            self._last = b
+
+    def read(self, nbytes):
+        return bytes([self._last]) * nbytes
+
+    def _latch(self, b):
+        nibble = b >> 4
+        rs = b & 0x01
+        if not self.four_bit:
+            self._execute(nibble << 4, rs)
+        elif self._nibble is None:
+            self._nibble = nibble
+        else:
+            value = (self._nibble << 4) | nibble
+            self._nibble = None
+            self._execute(value, rs)
+
+    def _execute(self, value, rs):
+        now = self._t
+        if now < self.busy_until:
+            self.violations += 1
+        t = 37
+        if rs:
+            self.data_writes += 1
+            if self.cgram_mode:
+                self.cgram[self.ac & 0x3F] = value & 0x1F
+                self.ac = (self.ac + 1) & 0x3F
+            else:
+                self.ddram[self.ac & 0x7F] = value
+                self.ac = (self.ac + (1 if self.increment else -1)) & 0x7F
+        else:
+            self.instructions += 1
+            if value & 0x80:
+                self.ac = value & 0x7F
+                self.cgram_mode = False
+            elif value & 0x40:
+                self.ac = value & 0x3F
+                self.cgram_mode = True
+            elif value & 0x20:
+                if not self.four_bit:
+                    # 8-bit function sets of the reset sequence
+                    self.init_steps += 1
+                    t = (4100, 100, 37)[min(self.init_steps, 3) - 1]
+                    if not value & 0x10:
+                        self.four_bit = True
+            elif value & 0x10:
+                if value & 0x08:
+                    self.shift += -1 if value & 0x04 else 1
+            elif value & 0x08:
+                self.display_on = bool(value & 0x04)
+                self.cursor = bool(value & 0x02)
+                self.blink = bool(value & 0x01)
+            elif value & 0x04:
+                self.increment = bool(value & 0x02)
+            elif value & 0x02:
+                self.ac = 0
+                self.shift = 0
+                t = 1520
+            elif value & 0x01:
+                self.ddram[:] = b' ' * 128
+                self.ac = 0
+                self.shift = 0
+                self.increment = True
+                t = 1520
+        self.busy_until = now + t
+
+    def line(self, row, width=16):
+        """
+        Visible text of a row, taking the display shift into account
+        """
+        base = 0x40 if row else 0x00
+        out = bytearray(width)
+        for i in range(width):
+            out[i] = self.ddram[base + (i + self.shift) % 40]
+        return bytes(out)
+
+
+class HCSR04Model:
+    """
+    HC-SR04 on a trigger and an echo pin. A trigger pulse of at least 10us
+    makes the echo pin go high after the burst and stay high for the
+    round trip time to an object distance_mm away, or 38ms without one.
+    """
+
+    BURST_US = 460
+    NO_ECHO_US = 38000
+
+    def __init__(self, trigger, echo, distance_mm=1000, temperature=20.0):
+        self.trigger = sim.pin(trigger)
+        self.echo = sim.pin(echo)
+        self.distance_mm = distance_mm
+        self.temperature = temperature
+        self.pings = 0
+        self._high_at = None
+        self.trigger.listeners.append(self._on_trigger)
+
+    def _on_trigger(self, pin, value):
+        now = sim.clock.now_us
+        if value:
+            self._high_at = now
+        elif self._high_at is not None and now - self._high_at >= 10:
+            self._high_at = None
+            if self.echo.value:
+                return
+            self.pings += 1
+            if self.distance_mm is None:
+                width = self.NO_ECHO_US
+            else:
+                speed = 331.3 + 0.606 * self.temperature
+                width = int(2 * self.distance_mm / speed * 1000)
+            start = now + self.BURST_US
+            sim.clock.at(start, lambda: self.echo.drive(1))
+            sim.clock.at(start + width, lambda: self.echo.drive(0))
+
+
+class IFX9201Model:
+    """
+    H-bridge kit: IFX9201SG behind the XMC1100, on SPI with a chip select.
+    The answer to a command is shifted out during the next transfer.
+    """
+
+    def __init__(self, cs='P9_3'):
+        self.cs = cs
+        self.ctrl = 0x00
+        self.dia = 0x0F
+        self.rev = 0x01
+        self.clock = None
+        self._answer = 0x00
+
+    def attach(self, clock):
+        self.clock = clock
+
+    def transfer(self, out):
+        data = bytearray(len(out))
+        for i, cmd in enumerate(out):
+            data[i] = self._answer
+            self._answer = self._command(cmd)
+        return data
+
+    def _command(self, cmd):
+        if cmd & 0xE0 == 0xE0:
+            # WR_CTRL, answers with the new control register
+            self.ctrl = cmd & 0x1F
+            return 0x60 | self.ctrl
+        if cmd & 0xE0 == 0xC0:
+            # WR_CTRL_RD_DIA
+            self.ctrl = cmd & 0x1F
+            return self.dia
+        if cmd == 0x80:
+            self.dia = 0x0F
+            return self.dia
+        if cmd & 0xE0 == 0x60:
+            return 0x60 | self.ctrl
+        if cmd & 0xE0 == 0x20:
+            return self.rev
+        return self.dia
+
+    @property
+    def output_enabled(self):
+        return bool(self.ctrl & 0x04)
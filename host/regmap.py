@@ -0,0 +1,205 @@
+"""
+Generates register map constants for the drivers from regmaps/*.json.
+
+Each JSON file describes one device: registers with their address and
+bit fields, named field values, SPI commands, burst reads of contiguous
+registers, burst writes whose bytes are assembled from field values, and
+raw write sequences for device quirks. The generator writes MicroPython
+const() definitions for them between the markers
+
+    # BEGIN GENERATED regmaps/<device>.json
+    # END GENERATED regmaps/<device>.json
+
+in every file listed in "targets", so the compiler folds them into the
+driver code and no register arithmetic is left for run time.
+
+Names are <prefix>_<register> for addresses, <prefix>_<field> for field
+masks with <prefix>_<field>_SHIFT for fields wider than one bit,
+<prefix>_<field>_<value> for field values, <prefix>_<register>_MASK for
+all fields of a register, <prefix>_<command> for commands,
+<prefix>_<read>_REG and _LEN for burst reads, <prefix>_<write>_REG and
+<prefix>_<write> (the data bytes) for burst writes, and <prefix>_<sequence>
+for (register, value) byte pairs.
+
+    python host/regmap.py            # regenerate the drivers
+    python host/regmap.py --check    # exit 1 if a driver is out of date
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REGMAPS = os.path.join(ROOT, 'regmaps')
+
+
+def _int(value):
+    return int(value, 0) if isinstance(value, str) else int(value)
+
+
+def _bits(spec):
+    """
+    Returns (shift, width) of a bit spec like '6:4' or '7'
+    """
+    spec = str(spec)
+    if ':' in spec:
+        hi, lo = (int(s) for s in spec.split(':'))
+    else:
+        hi = lo = int(spec)
+    if hi < lo:
+        raise ValueError('bits %r: high bit first' % spec)
+    return lo, hi - lo + 1
+
+
+def _bytes(data):
+    return "b'" + ''.join('\\x%02x' % b for b in data) + "'"
+
+
+class Generator:
+    
+    def __init__(self, spec, source):
+        self.spec = spec
+        self.source = source
+        self.prefix = spec['prefix']
+        self.lines = []
+        self.names = set()
+        self.fields = {}
+        
+    def emit(self, name, value, doc=None):
+        name = '%s_%s' % (self.prefix, name)
+        if name in self.names:
+            raise ValueError('%s: %s defined twice' % (self.source, name))
+        self.names.add(name)
+        if doc:
+            self.lines.append('# ' + doc)
+        self.lines.append('%s = %s' % (name, value))
+        
+    def section(self, title):
+        if self.lines:
+            self.lines.append('')
+        self.lines.append('# ' + title)
+        
+    def generate(self):
+        spec = self.spec
+        registers = spec.get('registers', {})
+        if spec.get('commands'):
+            self.section('%s commands' % spec['device'])
+            if spec.get('doc'):
+                self.lines.append('# ' + spec['doc'])
+            for name, cmd in spec['commands'].items():
+                self.emit(name, 'const(0x%02x)' % _int(cmd['code']), cmd.get('doc'))
+        addressed = [(n, r) for n, r in registers.items() if 'addr' in r]
+        if addressed:
+            self.section('%s registers' % spec['device'])
+            for name, reg in addressed:
+                self.emit(name, 'const(0x%02x)' % _int(reg['addr']), reg.get('doc'))
+        for rname, reg in registers.items():
+            fields = reg.get('fields')
+            if not fields:
+                continue
+            self.section('%s fields' % rname)
+            mask_all = 0
+            for fname, field in fields.items():
+                shift, width = _bits(field['bits'])
+                mask = ((1 << width) - 1) << shift
+                mask_all |= mask
+                self.fields[fname] = (rname, shift, width, field.get('values', {}))
+                self.emit(fname, 'const(0x%02x)' % mask, field.get('doc'))
+                if width > 1:
+                    self.emit(fname + '_SHIFT', 'const(%d)' % shift)
+                for vname, value in field.get('values', {}).items():
+                    value = _int(value)
+                    if value >> width:
+                        raise ValueError('%s: %s_%s does not fit %d bits'
+                                         % (self.source, fname, vname, width))
+                    self.emit('%s_%s' % (fname, vname), 'const(0x%02x)' % value)
+            self.emit(rname + '_MASK', 'const(0x%02x)' % mask_all)
+        if spec.get('reads'):
+            self.section('burst reads, start register and length')
+            for name, read in spec['reads'].items():
+                start = _int(registers[read['start']]['addr'])
+                self.emit(name + '_REG', 'const(0x%02x)' % start, read.get('doc'))
+                self.emit(name + '_LEN', 'const(%d)' % read['length'])
+        if spec.get('writes'):
+            self.section('burst writes, start register and the bytes to write')
+            for name, write in spec['writes'].items():
+                start, data = self._burst(name, write['registers'])
+                self.emit(name + '_REG', 'const(0x%02x)' % start, write.get('doc'))
+                self.emit(name, _bytes(data))
+        if spec.get('sequences'):
+            self.section('write sequences, (register, value) byte pairs')
+            for name, seq in spec['sequences'].items():
+                data = [_int(v) for pair in seq['writes'] for v in pair]
+                self.emit(name, _bytes(data), seq.get('doc'))
+        return self.lines
+        
+    def _burst(self, name, values):
+        registers = self.spec['registers']
+        addrs = [_int(registers[r]['addr']) for r in values]
+        if addrs != list(range(addrs[0], addrs[0] + len(addrs))):
+            raise ValueError('%s: burst write %s is not contiguous' % (self.source, name))
+        data = []
+        for rname, fields in values.items():
+            byte = 0
+            for fname, value in fields.items():
+                freg, shift, width, named = self.fields[fname]
+                if freg != rname:
+                    raise ValueError('%s: %s is not a field of %s' % (self.source, fname, rname))
+                value = _int(named[value]) if isinstance(value, str) and value in named else _int(value)
+                if value >> width:
+                    raise ValueError('%s: %s = %d does not fit' % (self.source, fname, value))
+                byte |= value << shift
+            data.append(byte)
+        return addrs[0], data
+
+
+def generate(path):
+    with open(path) as f:
+        spec = json.load(f)
+    source = os.path.relpath(path, ROOT).replace(os.sep, '/')
+    return spec, source, Generator(spec, source).generate()
+
+
+def update(target, source, lines, check=False):
+    """
+    Replaces the generated block of source in target. Returns True if the
+    file changed (or would change with check).
+    """
+    path = os.path.join(ROOT, target)
+    with open(path, 'rb') as f:
+        text = f.read().decode()
+    newline = '\r\n' if '\r\n' in text else '\n'
+    begin = '# BEGIN GENERATED %s' % source
+    end = '# END GENERATED %s' % source
+    a = text.find(begin)
+    b = text.find(end)
+    if a < 0 or b < a:
+        raise ValueError('%s has no %r ... %r markers' % (target, begin, end))
+    a += len(begin)
+    block = newline + newline.join(lines) + newline
+    if text[a:b] == block:
+        return False
+    if not check:
+        with open(path, 'wb') as f:
+            f.write((text[:a] + block + text[b:]).encode())
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate register map constants.')
+    parser.add_argument('--check', action='store_true',
+                        help='only check that the drivers are up to date')
+    args = parser.parse_args(argv)
+    stale = False
+    for path in sorted(glob.glob(os.path.join(REGMAPS, '*.json'))):
+        spec, source, lines = generate(path)
+        for target in spec['targets']:
+            if update(target, source, lines, args.check):
+                stale = True
+                print('%s %s' % ('out of date:' if args.check else 'updated', target))
+    return 1 if args.check and stale else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,351 @@
+"""
+Replays bus recordings made with mipy.record to the drivers on a PC.
+
+ReplayI2C and ReplaySPI stand in for the bus objects of the drivers and
+answer every transfer with the bytes the device sent in the recording.
+Two modes:
+
+  strict  every transfer must match the recorded one in order: operation,
+          address, register, bytes written and number of bytes read.
+          Transfers are matched per recorded bus, so the interleaving of
+          different buses does not matter.
+  image   I2C reads are served from per-register images of everything
+          the device answered, so a driver may reorder, merge or split
+          reads (e.g. burst reads instead of single registers). Repeated
+          reads of a register return the recorded values in order, then
+          keep the last one. done() checks that the driver left every
+          register with the value the recording wrote to it last. SPI
+          is always replayed strictly.
+
+    import sys
+    sys.path[:0] = ['host', '.']
+    from replay import Replay
+    rep = Replay('boot.rec', section='VL53L0X.init', mode='image')
+    tof = VL53L0X(i2c=rep.i2c())
+    print(rep.done())   # transfers and bytes, recorded vs issued
+
+    python host/replay.py boot.rec [--section NAME]   # list the records
+"""
+import argparse
+import os
+import struct
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [HERE, os.path.dirname(HERE)]
+
+from mipy.record import (MAGIC, VERSION, RECORD, RECORD_SIZE, NO_REG,
+                         OP_WRITE, OP_READ, OP_WRITE_MEM, OP_READ_MEM,
+                         OP_SPI_WRITE, OP_SPI_READ, OP_SPI_TRANSFER, OP_MARK,
+                         OP_NAMES)
+
+STRICT = 'strict'
+IMAGE = 'image'
+
+_READS = (OP_READ, OP_READ_MEM, OP_SPI_READ, OP_SPI_TRANSFER)
+
+
+class ReplayMismatch(AssertionError):
+    """
+    The driver issued a transfer the recording cannot answer
+    """
+
+
+class Record:
+    
+    __slots__ = ('index', 'source', 'op', 'addr', 'reg', 'out', 'data', 'section')
+    
+    def __init__(self, index, source, op, addr, reg, out, data, section):
+        self.index = index
+        self.source = source
+        self.op = op
+        self.addr = addr
+        self.reg = reg
+        self.out = out
+        self.data = data
+        self.section = section
+        
+    def __repr__(self):
+        if self.op == OP_MARK:
+            return '#%d mark %s' % (self.index, self.out.decode())
+        reg = '' if self.reg == NO_REG else ' reg=0x%02x' % self.reg
+        return '#%d bus%d %s addr=0x%02x%s out=%s in=%s' % (
+            self.index, self.source, OP_NAMES[self.op], self.addr, reg,
+            self.out.hex(), self.data.hex())
+
+
+def load(recording):
+    """
+    Parses a recording (path or bytes) into a list of Records, marks
+    included. Every record carries the name of the section it is in.
+    """
+    if isinstance(recording, (bytes, bytearray)):
+        raw = bytes(recording)
+    else:
+        with open(recording, 'rb') as f:
+            raw = f.read()
+    if raw[:len(MAGIC)] != MAGIC:
+        raise ValueError('not a bus recording')
+    if raw[len(MAGIC)] != VERSION:
+        raise ValueError('unsupported recording version %d' % raw[len(MAGIC)])
+    records = []
+    section = None
+    pos = len(MAGIC) + 1
+    while pos < len(raw):
+        if pos + RECORD_SIZE > len(raw):
+            raise ValueError('truncated record at byte %d' % pos)
+        op, addr, reg, nout, nin = struct.unpack_from(RECORD, raw, pos)
+        pos += RECORD_SIZE
+        out = raw[pos:pos + nout]
+        pos += nout
+        data = raw[pos:pos + nin]
+        pos += nin
+        if op == OP_MARK:
+            section = out.decode()
+        records.append(Record(len(records), op >> 4, op & 0x0F, addr, reg,
+                              out, data, section))
+    return records
+
+
+class Replay:
+    """
+    Serves the transfers of a recording, or of one of its sections, to
+    ReplayI2C and ReplaySPI objects
+    """
+    
+    def __init__(self, recording, section=None, mode=STRICT):
+        if mode not in (STRICT, IMAGE):
+            raise ValueError('mode must be %r or %r' % (STRICT, IMAGE))
+        records = [r for r in load(recording) if r.op != OP_MARK]
+        if section is not None:
+            records = [r for r in records if r.section == section]
+            if not records:
+                raise ValueError('no transfers in section %r' % section)
+        self.mode = mode
+        self.records = records
+        self._streams = {}
+        self._pos = {}
+        self._spi = set()
+        for r in records:
+            self._streams.setdefault(r.source, []).append(r)
+            self._pos[r.source] = 0
+            if r.op >= OP_SPI_WRITE:
+                self._spi.add(r.source)
+        self.issued = {}
+        self._values = {}
+        self._reads = {}
+        self._pointer = {}
+        self._expected = {}
+        self._written = {}
+        if mode == IMAGE:
+            self._build_images()
+            
+    def i2c(self, source=0):
+        return ReplayI2C(self, source)
+        
+    def spi(self, source=0):
+        return ReplaySPI(self, source)
+        
+    def _build_images(self):
+        pointer = {}
+        for r in self.records:
+            if r.source in self._spi:
+                continue
+            dev = (r.source, r.addr)
+            values = self._values.setdefault(dev, {})
+            expected = self._expected.setdefault(dev, {})
+            if r.op == OP_WRITE:
+                if r.out:
+                    pointer[dev] = r.out[0]
+                    _store(expected, r.out[0] + 1, r.out[1:])
+            elif r.op == OP_WRITE_MEM:
+                _store(expected, r.reg, r.out)
+            else:
+                reg = r.reg if r.op == OP_READ_MEM else pointer.get(dev, 0)
+                for i, b in enumerate(r.data):
+                    values.setdefault(reg + i, []).append(b)
+                    
+    def _count(self, source, nbytes):
+        n, b = self.issued.get(source, (0, 0))
+        self.issued[source] = (n + 1, b + nbytes)
+        
+    def transfer(self, source, op, addr, reg, out, nin):
+        """
+        Answers one transfer of the driver with the recorded bytes
+        """
+        self._count(source, len(out) + nin)
+        if self.mode == IMAGE and source not in self._spi:
+            return self._image(source, op, addr, reg, out, nin)
+        stream = self._streams.get(source, ())
+        pos = self._pos.get(source, 0)
+        got = '%s addr=0x%02x reg=%s out=%s nin=%d' % (
+            OP_NAMES[op], addr, 'none' if reg == NO_REG else hex(reg),
+            bytes(out).hex(), nin)
+        if pos >= len(stream):
+            raise ReplayMismatch('bus%d: transfer beyond the recording: %s'
+                                 % (source, got))
+        r = stream[pos]
+        if (r.op != op or r.addr != addr or r.reg != reg
+                or r.out != bytes(out) or len(r.data) != nin):
+            raise ReplayMismatch('bus%d transfer %d: expected %r, got %s'
+                                 % (source, pos, r, got))
+        self._pos[source] = pos + 1
+        return r.data
+        
+    def _image(self, source, op, addr, reg, out, nin):
+        dev = (source, addr)
+        if op == OP_WRITE:
+            if out:
+                self._pointer[dev] = out[0]
+                _store(self._written.setdefault(dev, {}), out[0] + 1, out[1:])
+            return b''
+        if op == OP_WRITE_MEM:
+            _store(self._written.setdefault(dev, {}), reg, out)
+            return b''
+        if op == OP_READ:
+            reg = self._pointer.get(dev, 0)
+        values = self._values.get(dev)
+        if values is None:
+            raise ReplayMismatch('bus%d: device 0x%02x is not in the recording'
+                                 % (source, addr))
+        reads = self._reads.setdefault(dev, {})
+        data = bytearray(nin)
+        for i in range(nin):
+            seq = values.get(reg + i)
+            if seq is None:
+                raise ReplayMismatch('bus%d: register 0x%02x of device 0x%02x '
+                                     'was never read in the recording'
+                                     % (source, reg + i, addr))
+            n = reads.get(reg + i, 0)
+            data[i] = seq[min(n, len(seq) - 1)]
+            reads[reg + i] = n + 1
+        return bytes(data)
+        
+    def done(self):
+        """
+        Checks that the driver issued everything the recording expects and
+        returns {bus: (recorded transfers, issued transfers, recorded
+        bytes, issued bytes)}
+        """
+        for source, stream in self._streams.items():
+            if self.mode == IMAGE and source not in self._spi:
+                continue
+            pos = self._pos[source]
+            if pos < len(stream):
+                raise ReplayMismatch('bus%d: %d recorded transfers were not '
+                                     'issued, next %r'
+                                     % (source, len(stream) - pos, stream[pos]))
+        for dev, expected in self._expected.items():
+            written = self._written.get(dev, {})
+            for reg, value in sorted(expected.items()):
+                if written.get(reg) != value:
+                    raise ReplayMismatch(
+                        'bus%d device 0x%02x: register 0x%02x ends as %s, '
+                        'recorded 0x%02x' % (dev[0], dev[1], reg,
+                                             _hex(written.get(reg)), value))
+        summary = {}
+        for source, stream in self._streams.items():
+            n, b = self.issued.get(source, (0, 0))
+            summary[source] = (len(stream), n,
+                               sum(len(r.out) + len(r.data) for r in stream), b)
+        return summary
+
+
+def _store(regs, reg, data):
+    for i, b in enumerate(data):
+        regs[reg + i] = b
+
+
+def _hex(value):
+    return 'unwritten' if value is None else '0x%02x' % value
+
+
+class ReplayI2C:
+    """
+    machine.I2C stand-in answering from a Replay
+    """
+    
+    def __init__(self, replay, source=0):
+        self.replay = replay
+        self.source = source
+        
+    def __enter__(self):
+        return self
+        
+    def __exit__(self, *exc):
+        pass
+        
+    def scan(self):
+        return sorted({r.addr for r in self.replay.records
+                       if r.source == self.source})
+        
+    def writeto(self, addr, buf, stop=True):
+        self.replay.transfer(self.source, OP_WRITE, addr, NO_REG, buf, 0)
+        return len(buf)
+        
+    def readfrom(self, addr, nbytes, stop=True):
+        return self.replay.transfer(self.source, OP_READ, addr, NO_REG, b'', nbytes)
+        
+    def readfrom_into(self, addr, buf, stop=True):
+        buf[:] = self.readfrom(addr, len(buf), stop)
+        
+    def writeto_mem(self, addr, memaddr, buf, addrsize=8):
+        self.replay.transfer(self.source, OP_WRITE_MEM, addr, memaddr, buf, 0)
+        
+    def readfrom_mem(self, addr, memaddr, nbytes, addrsize=8):
+        return self.replay.transfer(self.source, OP_READ_MEM, addr, memaddr,
+                                    b'', nbytes)
+        
+    def readfrom_mem_into(self, addr, memaddr, buf, addrsize=8):
+        buf[:] = self.readfrom_mem(addr, memaddr, len(buf), addrsize)
+
+
+class ReplaySPI:
+    """
+    machine.SPI stand-in answering from a Replay, always strict
+    """
+    
+    def __init__(self, replay, source=0):
+        self.replay = replay
+        self.source = source
+        
+    def init(self, *args, **kwargs):
+        pass
+        
+    def deinit(self):
+        pass
+        
+    def write(self, buf):
+        self.replay.transfer(self.source, OP_SPI_WRITE, 0, NO_REG, buf, 0)
+        
+    def read(self, nbytes, write=0x00):
+        return self.replay.transfer(self.source, OP_SPI_READ, 0, write, b'', nbytes)
+        
+    def readinto(self, buf, write=0x00):
+        buf[:] = self.read(len(buf), write)
+        
+    def write_readinto(self, write_buf, read_buf):
+        read_buf[:] = self.replay.transfer(self.source, OP_SPI_TRANSFER, 0,
+                                           NO_REG, write_buf, len(read_buf))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='List a bus recording.')
+    parser.add_argument('recording')
+    parser.add_argument('--section', help='only list this section')
+    args = parser.parse_args(argv)
+    records = load(args.recording)
+    counts = {}
+    for r in records:
+        if r.op != OP_MARK:
+            n, b = counts.get(r.section, (0, 0))
+            counts[r.section] = (n + 1, b + len(r.out) + len(r.data))
+        if args.section is None or r.section == args.section:
+            print(r)
+    print()
+    for section, (n, b) in counts.items():
+        print('%-30s %6d transfers %7d bytes' % (section or '(unmarked)', n, b))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,343 @@
+"""
+Simulated hardware fabric behind the host `machine`/`utime` stand-ins.
+
+Putting this directory first on sys.path makes the drivers importable
+with CPython: `machine`, `utime`, `micropython`, `ustruct` and
+`uasyncio` resolve to the modules next to this one, which talk to the
+fabric defined here instead of real peripherals. Time is virtual: sleeps
+and bus transfers advance `clock` instantly, so simulated runs are fast
+and deterministic.
+
+    import sys
+    sys.path[:0] = ['host', '.']
+    import sim, models
+    sim.reset()
+    sim.i2c_bus('P6_0', 'P6_1').attach(models.BME280Model())
+    from BME280 import BME280
+    import machine
+    bme = BME280(machine.I2C(0, scl='P6_0', sda='P6_1', freq=400000))
+    print(bme.values, sim.clock.now_us)
+
+Bus transfers take the time the bits need at the configured frequency,
+including start, address, acknowledge and stop bits.
+"""
+import heapq
+
+# MicroPython ticks wrap at 2**30 on most ports
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALF = TICKS_PERIOD >> 1
+
+# Simulated cost of one call into utime.ticks_* or Pin.value(), so that
+# polling loops make progress in virtual time
+CALL_COST_US = 2
+
+ENODEV = 19
+EIO = 5
+ETIMEDOUT = 110
+
+# SCL clocks a device holding SDA low needs before it lets go, the rest of
+# the byte it was sending
+STUCK_CLOCKS = 5
+
+
+class Clock:
+    """
+    Virtual microsecond clock with an event queue. Events run when the
+    clock is advanced past their time.
+    """
+
+    def __init__(self):
+        self.now_us = 0
+        self._events = []
+        self._seq = 0
+        self.sleeps = 0
+        self.slept_us = 0
+
+    def at(self, t_us, fn):
+        """
+        Runs fn() once the clock reaches t_us
+        """
+        self._seq += 1
+        heapq.heappush(self._events, (t_us, self._seq, fn))
+
+    def after(self, delay_us, fn):
+        self.at(self.now_us + delay_us, fn)
+
+    def advance(self, us):
+        end = self.now_us + max(0, int(us))
+        events = self._events
+        while events and events[0][0] <= end:
+            t, _, fn = heapq.heappop(events)
+            if t > self.now_us:
+                self.now_us = t
+            fn()
+        self.now_us = end
+
+    def sleep_us(self, us):
+        self.sleeps += 1
+        self.slept_us += max(0, int(us))
+        self.advance(us)
+
+
+class PinState:
+    """
+    Level of one pin, shared by every machine.Pin on it. The MCU side
+    changes it with Pin.value(), models with drive(), which fires the
+    interrupt handler registered with Pin.irq().
+    """
+
+    IRQ_RISING = 1
+    IRQ_FALLING = 2
+
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+        self.mode = None
+        self.handler = None
+        self.trigger = 0
+        self.owner = None
+        # models notified of changes made by the MCU, called as fn(pin, value)
+        self.listeners = []
+
+    def set(self, value):
+        """
+        Level change by the MCU
+        """
+        value = 1 if value else 0
+        if value != self.value:
+            self.value = value
+            for fn in self.listeners:
+                fn(self, value)
+
+    def drive(self, value):
+        """
+        Level change by a device model
+        """
+        value = 1 if value else 0
+        if value == self.value:
+            return
+        self.value = value
+        edge = self.IRQ_RISING if value else self.IRQ_FALLING
+        if self.handler is not None and self.trigger & edge:
+            self.handler(self.owner)
+
+
+def _pin_name(pin):
+    return getattr(pin, 'name', pin)
+
+
+class I2CFabric:
+    """
+    One I2C bus with the device models attached to it
+    """
+
+    def __init__(self, scl, sda):
+        self.scl = scl
+        self.sda = sda
+        self.freq = 400000
+        self.devices = {}
+        self.transactions = 0
+        self.bytes = 0
+        self.bus_us = 0
+        # called as fn(op, addr, reg, out, data, duration_us) per transaction
+        self.listeners = []
+        # fault injection, see fail() and hold_sda()
+        self.failures = 0
+        self._skip = 0
+        self.stuck = False
+        self._clocks = 0
+
+    def attach(self, model):
+        self.devices[model.address] = model
+        model.attach(clock)
+        return model
+
+    def fail(self, count=1, skip=0):
+        """
+        Makes count transactions fail as if a glitch corrupted them: the
+        address goes out, then OSError(EIO) is raised. The first skip
+        transactions still go through.
+        """
+        self.failures += count
+        self._skip = skip
+
+    def hold_sda(self):
+        """
+        Makes a device hold SDA low, as one does after losing track of a
+        transfer. Every transaction times out until SCL is clocked
+        STUCK_CLOCKS times with the pins as GPIO (wired-AND: the MCU
+        cannot pull SDA high meanwhile).
+        """
+        self.stuck = True
+        self._clocks = 0
+        sda, scl = pin(self.sda), pin(self.scl)
+        if self._sda_changed not in sda.listeners:
+            sda.listeners.append(self._sda_changed)
+            scl.listeners.append(self._scl_changed)
+        sda.drive(0)
+
+    def _sda_changed(self, p, value):
+        if self.stuck and value:
+            p.drive(0)
+
+    def _scl_changed(self, p, value):
+        if self.stuck and value:
+            self._clocks += 1
+            if self._clocks >= STUCK_CLOCKS:
+                self.stuck = False
+                pin(self.sda).drive(1)
+
+    def _device(self, addr):
+        if self.stuck:
+            clock.advance(10000)
+            raise OSError(ETIMEDOUT)
+        if self.failures and self._skip:
+            self._skip -= 1
+        elif self.failures:
+            self.failures -= 1
+            self._account(0)
+            raise OSError(EIO)
+        dev = self.devices.get(addr)
+        if dev is None:
+            # not acknowledged, the address byte still went out
+            self._account(0)
+            raise OSError(ENODEV)
+        if self.freq > dev.max_freq:
+            dev.freq_violations += 1
+        return dev
+
+    def _account(self, nbytes, restarts=0, dev=None):
+        # start, address byte and stop plus 9 clocks per data byte and one
+        # more address byte per repeated start
+        bits = 2 + 9 + 9 * nbytes + restarts * 10
+        us = (bits * 1000000 + self.freq - 1) // self.freq
+        if dev is not None:
+            # lets models time individual bytes within the transfer
+            dev.xfer_start_us = clock.now_us + 10 * 1000000 / self.freq
+            dev.byte_us = 9 * 1000000 / self.freq
+        self.transactions += 1
+        self.bytes += nbytes + 1 + restarts
+        self.bus_us += us
+        clock.advance(us)
+        return us
+
+    def _notify(self, op, addr, reg, out, data, us):
+        for fn in self.listeners:
+            fn(op, addr, reg, out, data, us)
+
+    def write(self, addr, buf):
+        dev = self._device(addr)
+        buf = bytes(buf)
+        us = self._account(len(buf), dev=dev)
+        dev.write(buf)
+        self._notify('writeto', addr, None, buf, b'', us)
+
+    def read(self, addr, nbytes):
+        dev = self._device(addr)
+        us = self._account(nbytes)
+        data = bytes(dev.read(nbytes))
+        self._notify('readfrom', addr, None, b'', data, us)
+        return data
+
+    def write_mem(self, addr, reg, buf):
+        dev = self._device(addr)
+        buf = bytes(buf)
+        us = self._account(len(buf) + 1)
+        dev.write(bytes([reg]) + buf)
+        self._notify('writeto_mem', addr, reg, buf, b'', us)
+
+    def read_mem(self, addr, reg, nbytes):
+        dev = self._device(addr)
+        us = self._account(nbytes + 1, restarts=1)
+        dev.write(bytes([reg]))
+        data = bytes(dev.read(nbytes))
+        self._notify('readfrom_mem', addr, reg, b'', data, us)
+        return data
+
+
+class SPIFabric:
+    """
+    One SPI bus, devices are selected by their chip select pin being low
+    """
+
+    def __init__(self, sck):
+        self.sck = sck
+        self.baudrate = 1000000
+        self.devices = []
+        self.transactions = 0
+        self.bytes = 0
+        self.bus_us = 0
+        # called as fn(op, cs, None, out, data, duration_us) per transfer
+        self.listeners = []
+
+    def attach(self, model):
+        self.devices.append(model)
+        model.attach(clock)
+        return model
+
+    def transfer(self, out):
+        out = bytes(out)
+        us = (len(out) * 8 * 1000000 + self.baudrate - 1) // self.baudrate
+        self.transactions += 1
+        self.bytes += len(out)
+        self.bus_us += us
+        clock.advance(us)
+        data = bytes(len(out))
+        cs = None
+        for dev in self.devices:
+            if pin(dev.cs).value == 0:
+                data = bytes(dev.transfer(out))
+                cs = dev.cs
+                break
+        for fn in self.listeners:
+            fn('write_readinto', cs, None, out, data, us)
+        return data
+
+
+clock = Clock()
+_pins = {}
+_i2c = {}
+_spi = {}
+
+
+def reset():
+    """
+    Forgets all pins, buses and models and restarts the clock at 0
+    """
+    global clock
+    clock = Clock()
+    _pins.clear()
+    _i2c.clear()
+    _spi.clear()
+
+
+def pin(name):
+    name = _pin_name(name)
+    p = _pins.get(name)
+    if p is None:
+        p = _pins[name] = PinState(name)
+    return p
+
+
+def i2c_bus(scl='P6_0', sda='P6_1'):
+    key = (_pin_name(scl), _pin_name(sda))
+    bus = _i2c.get(key)
+    if bus is None:
+        bus = _i2c[key] = I2CFabric(*key)
+    return bus
+
+
+def spi_bus(sck='P9_2'):
+    key = _pin_name(sck)
+    bus = _spi.get(key)
+    if bus is None:
+        bus = _spi[key] = SPIFabric(key)
+    return bus
+
+
+def buses():
+    """
+    Every I2C and SPI bus created so far
+    """
+    return list(_i2c.values()) + list(_spi.values())
@@ -0,0 +1,291 @@
+"""
+Decodes the SLIP framed telemetry of mipy.telemetry into NumPy arrays.
+
+The stream is read in large chunks and decoded a batch at a time: the
+whole chunk is unescaped and split into frames with NumPy operations,
+the frames are grouped by length and converted with one view per group,
+so throughput does not depend on a Python loop over samples. Samples
+come out in stream order per sensor. Lost frames are counted from the
+sequence numbers.
+
+    import sys
+    sys.path[:0] = ['host', '.']
+    from telemetry_host import TelemetryReader, open_serial
+    reader = TelemetryReader(open_serial('/dev/ttyACM0'))
+    while True:
+        for sensor, samples in reader.poll().items():
+            print(sensor, samples['ticks_us'], samples.dtype.names)
+
+    python host/telemetry_host.py              # self test over a pseudo terminal
+    python host/telemetry_host.py /dev/ttyACM0 # print decoded samples
+"""
+import json
+import os
+import sys
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [HERE, os.path.dirname(HERE)]
+
+from mipy.telemetry import (END, ESC, ESC_END, ESC_ESC, FRAME_HEADER_SIZE,
+                            KIND_VALUES, KIND_RAW, KIND_SCHEMA)
+
+HEADER_DTYPE = [('sensor', 'u1'), ('kind', 'u1'), ('seq', '<u2'), ('ticks_us', '<u4')]
+
+
+class Decoder:
+    """
+    Incremental decoder. feed() takes any chunk of the byte stream and
+    returns the samples of the frames completed by it as a dict of
+    structured arrays per sensor, named after the sensor schema if one
+    was received and by sensor id otherwise.
+    """
+    
+    def __init__(self):
+        self._rest = b''
+        self.schemas = {}
+        self.frames = 0
+        self.bad = 0
+        self.dropped = 0
+        self._last_seq = None
+        
+    def feed(self, data):
+        data = self._rest + data
+        raw = np.frombuffer(data, dtype=np.uint8)
+        ends = np.flatnonzero(raw == END)
+        if not len(ends):
+            self._rest = data
+            return {}
+        last = int(ends[-1])
+        self._rest = data[last + 1:]
+        return self._decode(*self._unescape(raw[:last + 1]))
+        
+    @staticmethod
+    def _unescape(raw):
+        """
+        Unescapes a chunk of complete frames, ending in END, at once.
+        Returns the unescaped bytes and the start and length of every
+        non-empty frame in them.
+        """
+        esc = np.flatnonzero(raw[:-1] == ESC)
+        code = raw[esc + 1]
+        esc = esc[(code == ESC_END) | (code == ESC_ESC)]
+        buf = raw.copy()
+        buf[esc + 1] = np.where(raw[esc + 1] == ESC_END, END, ESC)
+        keep = np.ones(len(raw), dtype=bool)
+        keep[esc] = False
+        # frame ends from the escaped stream, an unescaped END is payload
+        ends = np.flatnonzero((raw == END)[keep])
+        starts = np.concatenate(([0], ends[:-1] + 1))
+        lengths = ends - starts
+        used = lengths > 0
+        return buf[keep], starts[used], lengths[used]
+        
+    def _decode(self, buf, starts, lengths):
+        seq = np.full(len(starts), -1, dtype=np.int64)
+        valid = lengths >= FRAME_HEADER_SIZE
+        self.bad += int((~valid).sum())
+        kinds = np.zeros(len(starts), dtype=np.uint8)
+        kinds[valid] = buf[starts[valid] + 1]
+        schema = valid & (kinds == KIND_SCHEMA)
+        for i in np.flatnonzero(schema):
+            f = buf[starts[i]:starts[i] + lengths[i]].tobytes()
+            self._schema(f)
+            seq[i] = f[2] | f[3] << 8
+        samples = valid & ~schema
+        odd = samples & ((lengths - FRAME_HEADER_SIZE) % 4 != 0)
+        self.bad += int(odd.sum())
+        samples &= ~odd
+        out = {}
+        for n, kind in set(zip(lengths[samples].tolist(), kinds[samples].tolist())):
+            index = np.flatnonzero(samples & (lengths == n) & (kinds == kind))
+            if kind not in (KIND_VALUES, KIND_RAW):
+                self.bad += len(index)
+                continue
+            values = (n - FRAME_HEADER_SIZE) // 4
+            dtype = np.dtype(HEADER_DTYPE + [
+                ('values', '<f4' if kind == KIND_VALUES else '<i4', (values,))])
+            arr = buf[starts[index, None] + np.arange(n)].view(dtype)[:, 0]
+            seq[index] = arr['seq']
+            for sensor in np.unique(arr['sensor']):
+                mine = arr['sensor'] == sensor
+                self._collect(out, int(sensor), arr[mine], index[mine])
+        self._count_drops(seq[seq >= 0])
+        self.frames += int((seq >= 0).sum())
+        return {key: self._merge(parts) for key, parts in out.items()}
+        
+    @staticmethod
+    def _merge(parts):
+        """
+        Joins the samples of one sensor from frames of different lengths
+        or kinds in stream order. Fields missing from some frames are 0
+        there.
+        """
+        if len(parts) == 1:
+            return parts[0][0]
+        codes = {}
+        for samples, _ in parts:
+            for name in samples.dtype.names:
+                code = samples.dtype[name]
+                codes[name] = np.promote_types(codes[name], code) if name in codes else code
+        merged = np.zeros(sum(len(p[0]) for p in parts), dtype=list(codes.items()))
+        pos = 0
+        for samples, _ in parts:
+            for name in samples.dtype.names:
+                merged[name][pos:pos + len(samples)] = samples[name]
+            pos += len(samples)
+        order = np.concatenate([p[1] for p in parts])
+        return merged[np.argsort(order, kind='stable')]
+        
+    def _schema(self, frame):
+        try:
+            schema = json.loads(frame[FRAME_HEADER_SIZE:].decode())
+        except ValueError:
+            self.bad += 1
+            return
+        self.schemas[frame[0]] = schema
+        
+    def _collect(self, out, sensor, arr, index):
+        schema = self.schemas.get(sensor)
+        width = arr.dtype['values'].shape[0]
+        if schema is not None and len(schema['fields']) == width:
+            key = schema['name']
+            names = schema['fields']
+        else:
+            key = sensor
+            names = ['v%d' % i for i in range(width)]
+        code = arr.dtype['values'].base
+        dtype = np.dtype([('seq', '<u2'), ('ticks_us', '<u4')]
+                         + [(name, code) for name in names])
+        samples = np.empty(len(arr), dtype=dtype)
+        samples['seq'] = arr['seq']
+        samples['ticks_us'] = arr['ticks_us']
+        for i, name in enumerate(names):
+            samples[name] = arr['values'][:, i]
+        out.setdefault(key, []).append((samples, index))
+        
+    def _count_drops(self, seq):
+        if not len(seq):
+            return
+        if self._last_seq is not None:
+            seq = np.concatenate(([self._last_seq], seq))
+        steps = np.diff(seq) % 65536
+        self.dropped += int((steps - 1).sum())
+        self._last_seq = int(seq[-1])
+
+
+class TelemetryReader:
+    """
+    Reads a telemetry stream from a file object, a pyserial port or a file
+    descriptor in large chunks
+    """
+    
+    def __init__(self, source, chunk=65536):
+        self.source = source
+        self.chunk = chunk
+        self.decoder = Decoder()
+        
+    def read(self):
+        if isinstance(self.source, int):
+            return os.read(self.source, self.chunk)
+        waiting = getattr(self.source, 'in_waiting', None)
+        if waiting is not None:
+            return self.source.read(min(max(waiting, 1), self.chunk))
+        return self.source.read(self.chunk)
+        
+    def poll(self):
+        """
+        Reads one chunk and returns its decoded samples
+        """
+        return self.decoder.feed(self.read())
+
+
+def open_serial(port, baudrate=115200):
+    """
+    Opens a serial port with pyserial, which is only needed for this
+    """
+    import serial
+    return serial.Serial(port, baudrate, timeout=0.1)
+
+
+def _self_test(count=20000, lose=(1234, 5000, 5001)):
+    """
+    Streams samples from mipy.telemetry through a pseudo terminal, with a
+    few frames deliberately not sent, and checks the decoded result
+    """
+    import threading
+    import tty
+    from array import array
+    from mipy.telemetry import Telemetry
+
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    tty.setraw(master)
+
+    class Lossy:
+        # writes to the pty, skipping the frames listed in lose
+        def __init__(self, tel):
+            self.tel = tel
+        def write(self, data):
+            if self.tel.frames not in lose:
+                os.write(slave, bytes(data))
+
+    def board():
+        tel = Telemetry(max_values=3)
+        tel.stream = Lossy(tel)
+        tel.describe(0, 'bme', ('temperature', 'pressure', 'humidity'),
+                     ('C', 'Pa', '%RH'))
+        values = array('f', [0, 0, 0])
+        raw = array('i', [0, 0])
+        for i in range(count):
+            values[0] = 20 + i / 1000
+            values[1] = 101325 - i
+            values[2] = 40.5
+            tel.send(0, values, ticks=i * 1000)
+            # bytes that need escaping in the payload
+            raw[0] = END | ESC << 8
+            raw[1] = -i
+            tel.send(7, raw, ticks=i * 1000, raw=True)
+        os.close(slave)
+
+    writer = threading.Thread(target=board)
+    writer.start()
+    reader = TelemetryReader(master)
+    got = {}
+    while True:
+        try:
+            batch = reader.poll()
+        except OSError:
+            break
+        for key, samples in batch.items():
+            got.setdefault(key, []).append(samples)
+    writer.join()
+    os.close(master)
+    bme = np.concatenate(got['bme'])
+    other = np.concatenate(got[7])
+    d = reader.decoder
+    print('%d frames, %d dropped, %d bad' % (d.frames, d.dropped, d.bad))
+    assert d.dropped == len(lose), d.dropped
+    assert d.bad == 0
+    assert len(bme) + len(other) == 2 * count - len(lose)
+    assert np.allclose(bme['pressure'], 101325 - bme['ticks_us'] // 1000)
+    assert (other['v0'] == END | ESC << 8).all()
+    assert (other['v1'] == -(other['ticks_us'].astype(np.int64) // 1000)).all()
+    print('self test passed')
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        _self_test()
+        return
+    reader = TelemetryReader(open_serial(*argv[:1]))
+    while True:
+        for key, samples in reader.poll().items():
+            for row in samples:
+                print(key, *row)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+Host stand-in for MicroPython `uasyncio` on the simulated clock.
+
+The CPython asyncio API is re-exported, with an event loop whose time is
+sim.clock: waiting for the next timer advances the clock instead of
+blocking, so concurrent sleeps overlap in virtual time like they do on
+the board.
+"""
+import asyncio
+import selectors
+from asyncio import *
+
+import sim
+
+
+class _VirtualSelector(selectors.DefaultSelector):
+
+    def select(self, timeout=None):
+        if timeout:
+            sim.clock.advance(-(-timeout * 1000000 // 1))
+        return super().select(0 if timeout is not None else None)
+
+
+class VirtualEventLoop(asyncio.SelectorEventLoop):
+
+    def __init__(self):
+        super().__init__(_VirtualSelector())
+
+    def time(self):
+        return sim.clock.now_us / 1000000
+
+
+def sleep_ms(ms):
+    return asyncio.sleep(ms / 1000)
+
+
+def sleep_us(us):
+    return asyncio.sleep(us / 1000000)
+
+
+def new_event_loop():
+    return VirtualEventLoop()
+
+
+def run(coro):
+    loop = VirtualEventLoop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
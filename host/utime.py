@@ -0,0 +1,46 @@
+"""
+Host stand-in for the MicroPython `utime` module on the simulated clock.
+"""
+import sim
+
+
+def ticks_us():
+    sim.clock.advance(sim.CALL_COST_US)
+    return sim.clock.now_us & sim.TICKS_MAX
+
+
+def ticks_ms():
+    sim.clock.advance(sim.CALL_COST_US)
+    return (sim.clock.now_us // 1000) & sim.TICKS_MAX
+
+
+def ticks_cpu():
+    return ticks_us()
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & sim.TICKS_MAX
+
+
+def ticks_diff(ticks1, ticks2):
+    return ((ticks1 - ticks2 + sim.TICKS_HALF) & sim.TICKS_MAX) - sim.TICKS_HALF
+
+
+def sleep_us(us):
+    sim.clock.sleep_us(us)
+
+
+def sleep_ms(ms):
+    sim.clock.sleep_us(ms * 1000)
+
+
+def sleep(s):
+    sim.clock.sleep_us(s * 1000000)
+
+
+def time():
+    return sim.clock.now_us // 1000000
+
+
+def time_ns():
+    return sim.clock.now_us * 1000
@@ -0,0 +1,3 @@
+"""
+Shared infrastructure for the MiPy drivers.
+"""
@@ -0,0 +1,197 @@
+from array import array
+from micropython import const
+
+"""
+    Adaptive sampling.
+
+    Adaptive wraps a driver of the sensor protocol (mipy.sensor) and
+    changes its sampling period from how fast the readings move. Every
+    read_into converts the fields to integer steps of the given
+    resolution and keeps the change since the previous sample in a ring
+    of the last window samples, with a running sum and sum of squares per
+    field, so no floats or allocations are involved:
+
+      mean square change below quiet steps for a whole window: the period
+        is multiplied by backoff, up to max_ms
+      mean square change above busy steps: the period is divided by
+        rampup, down to min_ms
+      a single change of jump steps or more: straight to min_ms, so fast
+        transients are sampled at full rate from the next sample on
+
+    The mean square, not the variance, is used so that a steady ramp
+    keeps the rate up as well. changed is set when a field moved more
+    than deadband steps since the last sample that set it, for
+    suppressing telemetry of unchanged values.
+
+    The wrapper is a sensor itself. The scheduler, or a DutyCycle, picks
+    up the new period of the task attached with attach():
+
+        from mipy.adaptive import Adaptive
+        bme_a = Adaptive(bme, resolution=(0.01, 1, 0.1), min_ms=1000, max_ms=60000)
+        task = sched.add_sensor('bme', bme_a, 1)  # registered at min_ms
+        bme_a.attach(task)
+        def on_sample(name, values, ticks):
+            if bme_a.changed:
+                tel.send(0, values, ticks)
+        sched.on_sample = on_sample
+
+    Only read_into adapts, raw_into passes through to the driver.
+"""
+
+# Largest change kept in the ring, so that window squares fit an int32
+_MAX_STEP = const(4095)
+
+
+class Adaptive:
+    """
+    Sensor wrapper adapting the sampling period of sensor between min_ms
+    and max_ms. resolution gives the size of one step per field, in the
+    field's unit; window is the ring length, at most 64.
+    """
+
+    def __init__(self, sensor, resolution, min_ms, max_ms, window=8,
+                 deadband=1, quiet=1, busy=4, jump=16, backoff=2, rampup=2):
+        if not 1 < window <= 64:
+            raise ValueError("window must be 2 to 64")
+        self.sensor = sensor
+        self.fields = sensor.fields
+        self.units = sensor.units
+        self.raw_into = sensor.raw_into
+        # the rest of the protocol as far as the driver has it
+        for name in ('start_measurement', 'measurement_time_us', 'continuous',
+                     'sleep', 'wake', 'wake_time_us'):
+            if hasattr(sensor, name):
+                setattr(self, name, getattr(sensor, name))
+        n = len(sensor.fields)
+        if len(resolution) != n:
+            raise ValueError("one resolution per field needed")
+        self._scale = array('f', [1 / r for r in resolution])
+        self.min_us = min_ms * 1000
+        self.max_us = max_ms * 1000
+        self.period_us = self.min_us
+        self.window = window
+        self.deadband = deadband
+        # thresholds on the sum of squares over the window
+        self._quiet = quiet * quiet * window
+        self._busy = busy * busy * window
+        self.jump = jump
+        self.backoff = backoff
+        self.rampup = rampup
+        self._ring = array('i', [0] * (window * n))
+        self._sum = array('i', [0] * n)
+        self._sumsq = array('i', [0] * n)
+        self._last = array('i', [0] * n)
+        self._sent = array('i', [0] * n)
+        self._pos = 0
+        self._count = 0
+        self._primed = False
+        self._task = None
+        self.changed = False
+        self.samples = 0
+        self.sent = 0
+        self.backoffs = 0
+        self.rampups = 0
+
+    def attach(self, task):
+        """
+        Makes task (a Scheduler task or DutyCycle node, anything with a
+        period_us) follow the period
+        """
+        self._task = task
+        task.period_us = self.period_us
+
+    def _clear(self):
+        for i in range(len(self._ring)):
+            self._ring[i] = 0
+        for i in range(len(self._sum)):
+            self._sum[i] = 0
+            self._sumsq[i] = 0
+        self._count = 0
+
+    def read_into(self, buf, offset=0):
+        end = self.sensor.read_into(buf, offset)
+        self._update(buf, offset)
+        return end
+
+    def _update(self, buf, offset):
+        n = len(self._last)
+        self.samples += 1
+        if not self._primed:
+            for i in range(n):
+                q = int(buf[offset + i] * self._scale[i])
+                self._last[i] = q
+                self._sent[i] = q
+            self._primed = True
+            self.changed = True
+            self.sent += 1
+            return
+        ring = self._ring
+        base = self._pos * n
+        changed = False
+        jump = False
+        quiet = True
+        busy = False
+        for i in range(n):
+            q = int(buf[offset + i] * self._scale[i])
+            d = q - self._last[i]
+            self._last[i] = q
+            if d >= self.jump or d <= -self.jump:
+                jump = True
+            if d > _MAX_STEP:
+                d = _MAX_STEP
+            elif d < -_MAX_STEP:
+                d = -_MAX_STEP
+            old = ring[base + i]
+            ring[base + i] = d
+            self._sum[i] += d - old
+            sq = self._sumsq[i] + d * d - old * old
+            self._sumsq[i] = sq
+            if sq > self._busy:
+                busy = True
+            if sq >= self._quiet:
+                quiet = False
+            delta = q - self._sent[i]
+            if delta > self.deadband or delta < -self.deadband:
+                changed = True
+        if changed:
+            for i in range(n):
+                self._sent[i] = self._last[i]
+            self.sent += 1
+        self.changed = changed
+        self._pos = (self._pos + 1) % self.window
+        self._count += 1
+        period = self.period_us
+        if jump:
+            period = self.min_us
+            self._clear()
+        elif busy:
+            period = max(self.min_us, period // self.rampup)
+        elif quiet and self._count >= self.window:
+            period = min(self.max_us, period * self.backoff)
+        if period != self.period_us:
+            if period > self.period_us:
+                self.backoffs += 1
+            else:
+                self.rampups += 1
+            self.period_us = period
+            # judge the new period on a full window of its own samples
+            self._count = 0
+            if self._task is not None:
+                self._task.period_us = period
+
+    def variance(self, field=0):
+        """
+        Integer variance of the changes of a field over the window, in
+        squared steps
+        """
+        w = self.window
+        s = self._sum[field]
+        return (w * self._sumsq[field] - s * s) // (w * w)
+
+    def stats(self):
+        """
+        Returns (samples, samples with a change beyond the deadband,
+        period us, back-offs, ramp-ups)
+        """
+        return (self.samples, self.sent, self.period_us, self.backoffs,
+                self.rampups)
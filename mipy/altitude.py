@@ -0,0 +1,137 @@
+import utime as time
+from array import array
+from math import pow
+from micropython import const
+
+"""
+    Barometric altitude from one or more pressure sensors.
+
+    pressure_altitude() uses the international barometric formula
+    h = 44330 * (1 - (p / p0) ** 0.1903) through a 257 entry table of the
+    pressure ratio p / p0 with linear interpolation, instead of calling
+    pow() for every sample. Over 30 to 110 kPa at sea level pressure the
+    interpolation error stays below 0.1 m.
+
+    AltitudeFilter fuses pressure samples from several sensors, e.g. a
+    DPS368 and a BME280 on the same board, in a two state (altitude,
+    vertical speed) Kalman filter with a constant velocity model. Every
+    sample updates the estimate, so altitude and speed come out at the
+    combined sample rate. Sensors other than the first have their offset
+    to it (absolute pressure accuracy differs by a few meters between
+    parts) tracked slowly and removed:
+
+        from mipy.altitude import AltitudeFilter
+        alt = AltitudeFilter(noise_m=(0.05, 0.3))
+        alt.update(dps.measurePressureOnce(), 0)
+        alt.update(bme.read_compensated_data()[1], 1)
+        print(alt.altitude, alt.velocity)
+"""
+
+SEALEVEL_PA = 101325
+
+# Table range of p / p0 and number of intervals
+RATIO_MIN = 0.25
+RATIO_MAX = 1.15
+TABLE_STEPS = const(256)
+
+_table = None
+
+
+def _build_table():
+    global _table
+    _table = array('f', [0] * (TABLE_STEPS + 1))
+    step = (RATIO_MAX - RATIO_MIN) / TABLE_STEPS
+    for i in range(TABLE_STEPS + 1):
+        _table[i] = 44330 * (1.0 - pow(RATIO_MIN + i * step, 0.1903))
+
+
+def pressure_altitude(pressure, sealevel=SEALEVEL_PA):
+    """
+    Altitude in m of pressure in Pa above the level with pressure sealevel
+    """
+    if _table is None:
+        _build_table()
+    x = (pressure / sealevel - RATIO_MIN) * (TABLE_STEPS / (RATIO_MAX - RATIO_MIN))
+    i = int(x)
+    # extrapolate the end intervals outside the table
+    if i < 0:
+        i = 0
+    elif i >= TABLE_STEPS:
+        i = TABLE_STEPS - 1
+    return _table[i] + (x - i) * (_table[i + 1] - _table[i])
+
+
+class AltitudeFilter:
+    """
+    Kalman filter of altitude [m] and vertical speed [m/s] from pressure
+    samples of up to len(noise_m) sensors.
+
+    noise_m: altitude noise (standard deviation in m) of every sensor
+    accel_noise: standard deviation of the vertical acceleration [m/s2]
+        the model allows, larger follows faster and smooths less
+    offset_gain: gain with which the offsets of sensors 1 and up to
+        sensor 0 are tracked
+    """
+    
+    def __init__(self, sealevel=SEALEVEL_PA, noise_m=(0.05, 0.3),
+                 accel_noise=0.5, offset_gain=0.01):
+        self.sealevel = sealevel
+        self.r = array('f', [n * n for n in noise_m])
+        self.offset = array('f', [0] * len(noise_m))
+        self.q = accel_noise * accel_noise
+        self.offset_gain = offset_gain
+        self.reset()
+        
+    def reset(self):
+        self.altitude = 0.0
+        self.velocity = 0.0
+        self.p00 = 0.0
+        self.p01 = 0.0
+        self.p11 = 0.0
+        self.samples = 0
+        self._last = 0
+        
+    def update(self, pressure, sensor=0, ticks=None):
+        """
+        Adds the pressure sample [Pa] of sensor, taken at ticks_us ticks
+        (now if None), and returns the altitude estimate
+        """
+        if ticks is None:
+            ticks = time.ticks_us()
+        z = pressure_altitude(pressure, self.sealevel) - self.offset[sensor]
+        r = self.r[sensor]
+        if self.samples == 0:
+            self.altitude = z
+            self.velocity = 0.0
+            self.p00 = r
+            self.p01 = 0.0
+            self.p11 = 1.0
+            self._last = ticks
+            self.samples = 1
+            return z
+        dt = time.ticks_diff(ticks, self._last) * 1e-6
+        if dt > 0:
+            self._last = ticks
+            # predict, constant velocity with random acceleration
+            q = self.q
+            dt2 = dt * dt
+            self.altitude += self.velocity * dt
+            self.p00 += dt * (2 * self.p01 + dt * self.p11) + q * dt2 * dt2 * 0.25
+            self.p01 += dt * self.p11 + q * dt2 * dt * 0.5
+            self.p11 += q * dt2
+        y = z - self.altitude
+        if sensor:
+            # the offset takes the slow part of the disagreement
+            self.offset[sensor] += self.offset_gain * y
+            y -= self.offset_gain * y
+        s = self.p00 + r
+        k0 = self.p00 / s
+        k1 = self.p01 / s
+        self.altitude += k0 * y
+        self.velocity += k1 * y
+        p01 = self.p01
+        self.p00 -= k0 * self.p00
+        self.p01 -= k0 * p01
+        self.p11 -= k1 * p01
+        self.samples += 1
+        return self.altitude
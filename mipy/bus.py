@@ -0,0 +1,235 @@
+import machine
+from machine import I2C
+from micropython import const
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+"""
+    Shared I2C bus manager.
+
+    Several of the drivers sit on the same I2C pins. Constructing one
+    machine.I2C per driver reconfigures the peripheral under the others,
+    so get_bus() hands out a single I2CBus per pin pair instead and
+    I2CBus.device() a handle per device. A handle has the same methods as
+    machine.I2C and can be passed to the i2c argument of every driver:
+
+        from mipy.bus import get_bus
+        bus = get_bus('P6_0', 'P6_1')
+        lcd = LCD16x2(i2c=bus.device(0x27, max_freq=100000, name='lcd'))
+        dps = DPS(i2c=bus.device(0x77, name='dps'))
+        print(bus.stats())
+
+    The bus runs at the lowest max_freq of its devices. Maximum SCL
+    frequencies of the supported parts: PCF8574 LCD backpack 100kHz,
+    DPS368, BME280, TLV493D and VL53L0X 400kHz (fast mode).
+"""
+
+# Fast mode, the fastest rate all supported parts except the LCD accept
+I2C_FAST = const(400000)
+I2C_STANDARD = const(100000)
+
+_EBUSY = const(16)
+
+_buses = {}
+
+def get_bus(scl='P6_0', sda='P6_1', id=0, max_freq=I2C_FAST):
+    """
+    Returns the I2CBus on the given pins, creating it on first use. A
+    later call with a lower max_freq lowers the bus frequency to it; one
+    with another peripheral id raises ValueError.
+    """
+    key = (scl, sda)
+    bus = _buses.get(key)
+    if bus is None:
+        bus = I2CBus(id, scl, sda, max_freq)
+        _buses[key] = bus
+    elif bus.id != id:
+        raise ValueError("pins %s, %s are used by I2C %s" % (scl, sda, bus.id))
+    elif max_freq < bus.max_freq:
+        bus.max_freq = max_freq
+        bus._negotiate()
+    return bus
+
+
+class I2CBus:
+    """
+    One I2C peripheral shared by several devices.
+    
+    Transactions from different devices are serialized by an owner flag:
+    a device may nest transactions inside its own `with device:` block,
+    but a transaction started by another device while the bus is held
+    (e.g. from a timer callback) raises OSError(EBUSY) instead of
+    corrupting the transfer in progress. Coroutines that need the bus
+    across an await can hold `bus.lock`, a uasyncio.Lock.
+    """
+    
+    def __init__(self, id, scl, sda, max_freq=I2C_FAST):
+        self.id = id
+        self.scl = scl
+        self.sda = sda
+        self.max_freq = max_freq
+        self.freq = max_freq
+        self.i2c = I2C(id, scl=scl, sda=sda, freq=max_freq)
+        self.devices = []
+        self._holder = None
+        self._depth = 0
+        self._lock = None
+        
+    def device(self, addr, max_freq=I2C_FAST, name=None):
+        """
+        Registers a device and returns its handle. The bus frequency drops
+        to max_freq if that is lower than the current one.
+        """
+        dev = I2CDevice(self, addr, max_freq, name)
+        self.devices.append(dev)
+        self._negotiate()
+        return dev
+        
+    def _negotiate(self):
+        freq = self.max_freq
+        for dev in self.devices:
+            if dev.max_freq < freq:
+                freq = dev.max_freq
+        if freq != self.freq:
+            self.freq = freq
+            self.i2c = I2C(self.id, scl=self.scl, sda=self.sda, freq=freq)
+            
+    @property
+    def lock(self):
+        """
+        uasyncio.Lock for sequences that span an await
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+        
+    def acquire(self, dev):
+        """
+        Takes the bus for dev, raises OSError(EBUSY) if another device has it
+        """
+        state = machine.disable_irq()
+        holder = self._holder
+        if holder is None:
+            self._holder = dev
+            self._depth = 1
+        elif holder is dev:
+            self._depth += 1
+        machine.enable_irq(state)
+        if holder is not None and holder is not dev:
+            raise OSError(_EBUSY)
+            
+    def release(self):
+        self._depth -= 1
+        if self._depth <= 0:
+            self._depth = 0
+            self._holder = None
+            
+    def scan(self):
+        return self.i2c.scan()
+        
+    def stats(self):
+        """
+        Returns (name, transactions, bytes written, bytes read) per device
+        """
+        return [(dev.name, dev.transactions, dev.bytes_out, dev.bytes_in)
+                for dev in self.devices]
+        
+    def reset_stats(self):
+        for dev in self.devices:
+            dev.transactions = 0
+            dev.bytes_out = 0
+            dev.bytes_in = 0
+
+
+class I2CDevice:
+    """
+    Handle for one device on an I2CBus, with the transfer methods of
+    machine.I2C. Counts transactions and bytes moved.
+    """
+    
+    def __init__(self, bus, addr, max_freq=I2C_FAST, name=None):
+        self.bus = bus
+        self.addr = addr
+        self.max_freq = max_freq
+        self.name = name if name is not None else hex(addr)
+        self.transactions = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        
+    def __enter__(self):
+        self.bus.acquire(self)
+        return self
+        
+    def __exit__(self, *exc):
+        self.bus.release()
+        
+    def scan(self):
+        return self.bus.scan()
+        
+    def writeto(self, addr, buf, stop=True):
+        bus = self.bus
+        bus.acquire(self)
+        try:
+            n = bus.i2c.writeto(addr, buf, stop)
+        finally:
+            bus.release()
+        self.transactions += 1
+        self.bytes_out += len(buf)
+        return n
+        
+    def readfrom(self, addr, nbytes, stop=True):
+        bus = self.bus
+        bus.acquire(self)
+        try:
+            data = bus.i2c.readfrom(addr, nbytes, stop)
+        finally:
+            bus.release()
+        self.transactions += 1
+        self.bytes_in += nbytes
+        return data
+        
+    def readfrom_into(self, addr, buf, stop=True):
+        bus = self.bus
+        bus.acquire(self)
+        try:
+            bus.i2c.readfrom_into(addr, buf, stop)
+        finally:
+            bus.release()
+        self.transactions += 1
+        self.bytes_in += len(buf)
+        
+    def writeto_mem(self, addr, memaddr, buf, addrsize=8):
+        bus = self.bus
+        bus.acquire(self)
+        try:
+            bus.i2c.writeto_mem(addr, memaddr, buf, addrsize=addrsize)
+        finally:
+            bus.release()
+        self.transactions += 1
+        self.bytes_out += len(buf) + (addrsize >> 3)
+        
+    def readfrom_mem(self, addr, memaddr, nbytes, addrsize=8):
+        bus = self.bus
+        bus.acquire(self)
+        try:
+            data = bus.i2c.readfrom_mem(addr, memaddr, nbytes, addrsize=addrsize)
+        finally:
+            bus.release()
+        self.transactions += 1
+        self.bytes_out += addrsize >> 3
+        self.bytes_in += nbytes
+        return data
+        
+    def readfrom_mem_into(self, addr, memaddr, buf, addrsize=8):
+        bus = self.bus
+        bus.acquire(self)
+        try:
+            bus.i2c.readfrom_mem_into(addr, memaddr, buf, addrsize=addrsize)
+        finally:
+            bus.release()
+        self.transactions += 1
+        self.bytes_out += addrsize >> 3
+        self.bytes_in += len(buf)
@@ -0,0 +1,145 @@
+import utime as time
+from array import array
+from micropython import const
+
+from mipy.sensor import SampleRecord
+
+"""
+    Synchronized multi-sensor capture.
+
+    A capture triggers the conversions of all sensors so that they measure
+    at the same instant, reads every sensor when its result is ready and
+    timestamps each value with the ticks_us it represents:
+
+      triggered sensors (start_measurement and measurement_time_us, e.g.
+        BME280, VL53L0X, HCSR04): the middle of the conversion, trigger
+        ticks plus latency, by default half the conversion time. Longer
+        conversions are started earlier so that the middles coincide.
+      free running sensors (no start_measurement, or continuous = True
+        like DPS in background mode, TLV493D): readout ticks minus the
+        age of the latest result, by default half the measurement period.
+        They are read that long after the common instant.
+
+    Each record states its skew, the spread of the sample timestamps:
+
+        from mipy.capture import SyncCapture
+        cap = SyncCapture((('bme', bme), ('dps', dps), ('tlv', tlv), ('tof', tof)))
+        values = cap.capture()
+        print(cap.fields, values, cap.t_sample, cap.skew_us)
+        cap.report()
+"""
+
+# Wait with sleep_ms above this, sleep_us below
+_SLEEP_US_MAX = const(2000)
+
+_TRIGGER = const(0)
+_READ = const(1)
+
+
+class SyncCapture:
+    """
+    Captures aligned samples of (name, sensor) pairs implementing the
+    sensor protocol of mipy.sensor. latency maps sensor names to the delay
+    in us between trigger (or sample instant) and readout to use instead
+    of the defaults.
+    """
+    
+    def __init__(self, sensors, latency=None, raw=False):
+        sensors = list(sensors)
+        latency = latency or {}
+        self.record = SampleRecord(sensors, raw)
+        self.fields = self.record.fields
+        self.values = self.record.values
+        self.names = [name for name, _ in sensors]
+        n = len(sensors)
+        self.t_trigger = array('I', [0] * n)
+        self.t_read = array('I', [0] * n)
+        self.t_sample = array('I', [0] * n)
+        self.t_ref = 0
+        self.skew_us = 0
+        self.max_skew_us = 0
+        self.captures = 0
+        self._read = []
+        self._start = []
+        self._latency = array('i', [0] * n)
+        lead = 0
+        for i, (name, sensor) in enumerate(sensors):
+            self._read.append(self.record.sensors[i])
+            start = getattr(sensor, 'start_measurement', None)
+            if getattr(sensor, 'continuous', False):
+                start = None
+            mt = getattr(sensor, 'measurement_time_us', 0)
+            self._start.append(start)
+            self._latency[i] = latency.get(name, mt // 2)
+            if start is not None:
+                lead = max(lead, self._latency[i])
+        # events as (us after the first trigger, kind, sensor), in order
+        events = []
+        for i in range(n):
+            mt = getattr(sensors[i][1], 'measurement_time_us', 0)
+            if self._start[i] is not None:
+                at = lead - self._latency[i]
+                events.append((at, _TRIGGER, i))
+                events.append((at + max(mt, self._latency[i]), _READ, i))
+            else:
+                events.append((lead + self._latency[i], _READ, i))
+        events.sort()
+        self._events = events
+        self.lead_us = lead
+        
+    def _wait(self, until):
+        wait = time.ticks_diff(until, time.ticks_us())
+        if wait > _SLEEP_US_MAX:
+            time.sleep_ms(wait // 1000)
+            wait = time.ticks_diff(until, time.ticks_us())
+        if wait > 0:
+            time.sleep_us(wait)
+            
+    def capture(self):
+        """
+        Takes one aligned sample of every sensor into values and returns
+        values. t_trigger, t_read and t_sample hold the ticks_us of every
+        sensor, t_ref the common instant and skew_us the spread of t_sample.
+        """
+        t0 = time.ticks_us()
+        self.t_ref = time.ticks_add(t0, self.lead_us)
+        values = self.values
+        for at, kind, i in self._events:
+            self._wait(time.ticks_add(t0, at))
+            if kind == _TRIGGER:
+                self.t_trigger[i] = time.ticks_us()
+                self._start[i]()
+                self.t_sample[i] = time.ticks_add(self.t_trigger[i], self._latency[i])
+            else:
+                read, offset = self._read[i]
+                t = time.ticks_us()
+                read(values, offset)
+                self.t_read[i] = time.ticks_us()
+                if self._start[i] is None:
+                    self.t_trigger[i] = t
+                    self.t_sample[i] = time.ticks_add(t, -self._latency[i])
+        lo = hi = 0
+        for i in range(len(self.t_sample)):
+            d = time.ticks_diff(self.t_sample[i], self.t_ref)
+            if i == 0 or d < lo:
+                lo = d
+            if i == 0 or d > hi:
+                hi = d
+        self.skew_us = hi - lo
+        if self.skew_us > self.max_skew_us:
+            self.max_skew_us = self.skew_us
+        self.captures += 1
+        return values
+        
+    def report(self):
+        """
+        Prints the timing of the last capture relative to its common instant
+        """
+        print("sensor      trigger us  read us  sample us")
+        for i, name in enumerate(self.names):
+            print("%-10s %11d %8d %10d" % (
+                name, time.ticks_diff(self.t_trigger[i], self.t_ref),
+                time.ticks_diff(self.t_read[i], self.t_ref),
+                time.ticks_diff(self.t_sample[i], self.t_ref)))
+        print("skew %d us, max %d us over %d captures"
+              % (self.skew_us, self.max_skew_us, self.captures))
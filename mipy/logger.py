@@ -0,0 +1,200 @@
+import os
+import json
+import ustruct
+import utime as time
+from micropython import const
+
+"""
+    Binary sample logger.
+
+    Samples are packed as fixed size records (ticks_us and one value per
+    field) into a RAM block buffer. Full blocks go to the filesystem in one
+    write of BLOCK_SIZE bytes, which matches the flash erase block, so
+    logging costs a fraction of the flash wear and CPU time of printing
+    text. Files are rotated after blocks_per_file blocks and host/logreader.py
+    maps them into NumPy arrays:
+
+        from mipy.logger import Logger
+        rec = SampleRecord((('bme', bme), ('tlv', tlv)))
+        log = Logger.from_record('/flash/log', rec)
+        while True:
+            log.log(rec.read())
+        ...
+        log.close()
+
+    File format, little endian. The first block holds the file header
+    '<7sBHHHH' (MAGIC, VERSION, block size, record size, records per
+    block, schema length) followed by the schema, a JSON object with the
+    record struct 'format', the 'fields' and their 'units'. Every further
+    block starts with the block header '<HHI' (BLOCK_SYNC, number of valid
+    records, block sequence number counted across files and restarts)
+    followed by the records, the rest is zero padding.
+"""
+
+MAGIC = b'MIPYLOG'
+VERSION = const(1)
+HEADER = '<7sBHHHH'
+HEADER_SIZE = const(16)
+
+BLOCK_SIZE = const(4096)
+BLOCK_HEADER = '<HHI'
+BLOCK_HEADER_SIZE = const(8)
+BLOCK_SYNC = const(0xB10C)
+
+
+class Logger:
+    """
+    Logs samples of the given fields to numbered files prefix0000.log,
+    prefix0001.log, ...
+
+    fmt is the struct code of every field, one character for all or one
+    per field, e.g. 'f' for floats or 'i' for raw readings. With keep set,
+    only the newest keep files are kept.
+    """
+    
+    def __init__(self, prefix, fields, units=(), fmt='f', block_size=BLOCK_SIZE,
+                 blocks_per_file=256, keep=None):
+        if len(fmt) == 1:
+            fmt = fmt * len(fields)
+        if len(fmt) != len(fields):
+            raise ValueError('one struct code per field expected')
+        self.prefix = prefix
+        self.fields = tuple(fields)
+        self.units = tuple(units)
+        self.format = '<I' + fmt
+        self.record_size = ustruct.calcsize(self.format)
+        self.per_block = (block_size - BLOCK_HEADER_SIZE) // self.record_size
+        if self.per_block < 1:
+            raise ValueError('record larger than a block')
+        self.block_size = block_size
+        self.blocks_per_file = blocks_per_file
+        self.keep = keep
+        self._codes = ['<' + c for c in fmt]
+        self._sizes = [ustruct.calcsize(c) for c in self._codes]
+        self._buf = bytearray(block_size)
+        self._count = 0
+        self._pos = BLOCK_HEADER_SIZE
+        self._file = None
+        self._file_blocks = 0
+        self.index = self._first_free()
+        self.seq = self._next_seq()
+        self.records = 0
+        self.blocks = 0
+        
+    @classmethod
+    def from_record(cls, prefix, record, **kwargs):
+        """
+        Logger for the values of a mipy.sensor.SampleRecord
+        """
+        return cls(prefix, record.fields, record.units, record.typecode, **kwargs)
+        
+    def path(self, index):
+        return '%s%04d.log' % (self.prefix, index)
+        
+    def _first_free(self):
+        index = 0
+        while True:
+            try:
+                os.stat(self.path(index))
+            except OSError:
+                return index
+            index += 1
+            
+    def _next_seq(self):
+        # continues the numbering of the newest file, so that a restart is
+        # not taken for lost blocks
+        if self.index == 0:
+            return 0
+        path = self.path(self.index - 1)
+        try:
+            size = os.stat(path)[6]
+            with open(path, 'rb') as f:
+                head = ustruct.unpack(HEADER, f.read(HEADER_SIZE))
+                block_size = head[2]
+                if head[0] != MAGIC or not block_size:
+                    return 0
+                last = size // block_size - 1
+                if last < 1:
+                    return 0
+                f.seek(last * block_size)
+                sync, count, seq = ustruct.unpack(BLOCK_HEADER,
+                                                  f.read(BLOCK_HEADER_SIZE))
+        except (OSError, ValueError):
+            return 0
+        return seq + 1 if sync == BLOCK_SYNC else 0
+        
+    def _open(self):
+        schema = json.dumps({'format': self.format,
+                             'fields': ('ticks_us',) + self.fields,
+                             'units': ('us',) + self.units}).encode()
+        if HEADER_SIZE + len(schema) > self.block_size:
+            raise ValueError('schema larger than a block')
+        head = bytearray(self.block_size)
+        ustruct.pack_into(HEADER, head, 0, MAGIC, VERSION, self.block_size,
+                          self.record_size, self.per_block, len(schema))
+        head[HEADER_SIZE:HEADER_SIZE + len(schema)] = schema
+        self._file = open(self.path(self.index), 'wb')
+        self._file.write(head)
+        self._file_blocks = 0
+        if self.keep is not None and self.index >= self.keep:
+            try:
+                os.remove(self.path(self.index - self.keep))
+            except OSError:
+                pass
+        
+    def log(self, values, ticks=None):
+        """
+        Appends a record of values, timestamped with ticks (ticks_us now
+        if None). Writes the block when it is full.
+        """
+        if ticks is None:
+            ticks = time.ticks_us()
+        buf = self._buf
+        pos = self._pos
+        ustruct.pack_into('<I', buf, pos, ticks)
+        pos += 4
+        codes = self._codes
+        sizes = self._sizes
+        for i in range(len(codes)):
+            ustruct.pack_into(codes[i], buf, pos, values[i])
+            pos += sizes[i]
+        self._pos = pos
+        self._count += 1
+        self.records += 1
+        if self._count == self.per_block:
+            self._write_block()
+            
+    def _write_block(self):
+        if self._file is None:
+            self._open()
+        buf = self._buf
+        ustruct.pack_into(BLOCK_HEADER, buf, 0, BLOCK_SYNC, self._count, self.seq)
+        self._file.write(buf)
+        self.seq += 1
+        self.blocks += 1
+        self._file_blocks += 1
+        self._count = 0
+        self._pos = BLOCK_HEADER_SIZE
+        if self._file_blocks >= self.blocks_per_file:
+            self._file.close()
+            self._file = None
+            self.index += 1
+            
+    def flush(self):
+        """
+        Writes the current block even if it is not full, its unused records
+        are zero padding, and flushes the file
+        """
+        if self._count:
+            buf = self._buf
+            for i in range(self._pos, self.block_size):
+                buf[i] = 0
+            self._write_block()
+        if self._file is not None:
+            self._file.flush()
+            
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,253 @@
+import json
+import math
+import utime as time
+from array import array
+from micropython import const
+
+"""
+    TLV493D hard-iron, soft-iron and temperature calibration.
+
+    A magnet turning above the sensor, as on a rotary knob or encoder,
+    should trace a circle around zero in the X-Y plane. Steel nearby,
+    mounting tilt and the magnet itself turn it into a shifted ellipse,
+    which shows up as angle error in get_azimuth() and in angles computed
+    from read_into(). MagCalibration records a sweep of at least one full
+    turn into a preallocated buffer of raw readings, fits the ellipse and
+    computes integer coefficients for TLV493D.set_calibration():
+
+        from mipy.magcal import MagCalibration
+        cal = MagCalibration(tlv)
+        cal.collect()  # turn the knob a few times within 5 s
+        cal.fit()
+        cal.save('/flash/tlv_cal.json')
+        cal.apply()
+
+    and at the next boot MagCalibration.load('/flash/tlv_cal.json', tlv).apply().
+
+    The fit is a least squares conic A x^2 + B xy + C y^2 + D x + E y = 1.
+    Its center gives the hard-iron offsets and the inverse square root of
+    its shape the soft-iron matrix, scaled to keep the area of the
+    ellipse, so the corrected values lie on a circle of about the mean
+    field. Z keeps no offset, the axial field of the magnet cannot be
+    told apart from one in a planar sweep.
+
+    Temperature: the raw temperature t0 of the sweep is stored. A second
+    sweep at another temperature, fitted and passed to fit_tempco(), gives
+    the drift of the offsets and of the field magnitude (magnet and sensor
+    sensitivity) per temperature LSB, which read_into() then removes
+    using the temperature channel of the same reading.
+
+    Fitting is float work done once, read_into() only uses the integer
+    coefficients.
+"""
+
+# Fractional bits of the coefficients, as TLV.TLV_CAL_SHIFT
+_SHIFT = const(12)
+_ONE = const(4096)
+
+# Octants of the turn the sweep has to reach
+_OCTANTS = const(8)
+
+
+def _solve(a, b):
+    """
+    Solves a x = b for a list of n rows of n floats by Gaussian
+    elimination with partial pivoting, a and b are overwritten
+    """
+    n = len(b)
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(a[r][col]))
+        if abs(a[pivot][col]) < 1e-12:
+            raise ValueError("singular fit, the sweep does not cover a turn")
+        a[col], a[pivot] = a[pivot], a[col]
+        b[col], b[pivot] = b[pivot], b[col]
+        for r in range(col + 1, n):
+            f = a[r][col] / a[col][col]
+            for c in range(col, n):
+                a[r][c] -= f * a[col][c]
+            b[r] -= f * b[col]
+    x = [0.0] * n
+    for r in range(n - 1, -1, -1):
+        s = b[r]
+        for c in range(r + 1, n):
+            s -= a[r][c] * x[c]
+        x[r] = s / a[r][r]
+    return x
+
+
+class MagCalibration:
+    """
+    Calibration of a TLV493D driver, size is the number of readings the
+    sweep buffer holds
+    """
+
+    def __init__(self, sensor, size=256):
+        self.sensor = sensor
+        self.size = size
+        # x, y, z and the raw temperature per reading
+        self.buf = array('h', [0] * (4 * size))
+        self._raw = array('i', [0, 0, 0])
+        self.count = 0
+        self.t0 = 0
+        self.offset = [0, 0, 0]
+        self.matrix = [_ONE, 0, 0, 0, _ONE, 0, 0, 0, _ONE]
+        self.offset_tc = [0, 0, 0]
+        self.gain_tc = 0
+        # mean field of the sweep in LSB and largest fit residual
+        self.radius = 0.0
+        self.residual = 0.0
+
+    def add(self):
+        """
+        Reads the sensor once into the sweep, returns False when full
+        """
+        if self.count >= self.size:
+            return False
+        i = 4 * self.count
+        self.sensor.raw_into(self._raw)
+        self.buf[i] = self._raw[0]
+        self.buf[i + 1] = self._raw[1]
+        self.buf[i + 2] = self._raw[2]
+        self.buf[i + 3] = self.sensor.raw_temp()
+        self.count += 1
+        return True
+
+    def collect(self, duration_ms=5000):
+        """
+        Fills the sweep with readings evenly spread over duration_ms
+        """
+        self.count = 0
+        period_us = duration_ms * 1000 // self.size
+        due = time.ticks_us()
+        while self.add():
+            due = time.ticks_add(due, period_us)
+            wait = time.ticks_diff(due, time.ticks_us())
+            if wait > 0:
+                time.sleep_us(wait)
+
+    def coverage(self):
+        """
+        Number of octants of the turn around the mean the sweep reached
+        """
+        n = self.count
+        b = self.buf
+        mx = sum(b[4 * i] for i in range(n)) / n
+        my = sum(b[4 * i + 1] for i in range(n)) / n
+        seen = 0
+        for i in range(n):
+            a = math.atan2(b[4 * i + 1] - my, b[4 * i] - mx)
+            seen |= 1 << (int((a + math.pi) * _OCTANTS / (2 * math.pi)) % _OCTANTS)
+        return sum((seen >> k) & 1 for k in range(_OCTANTS))
+
+    def fit(self):
+        """
+        Fits offsets and the soft-iron matrix to the sweep, raises
+        ValueError if it does not cover a full turn
+        """
+        n = self.count
+        if n < 16 or self.coverage() < _OCTANTS:
+            raise ValueError("the sweep does not cover a full turn")
+        b = self.buf
+        # centered and scaled to about 1 for a well conditioned fit
+        mx = sum(b[4 * i] for i in range(n)) / n
+        my = sum(b[4 * i + 1] for i in range(n)) / n
+        s = max(max(abs(b[4 * i] - mx), abs(b[4 * i + 1] - my)) for i in range(n)) or 1
+        ata = [[0.0] * 5 for _ in range(5)]
+        atb = [0.0] * 5
+        for i in range(n):
+            x = (b[4 * i] - mx) / s
+            y = (b[4 * i + 1] - my) / s
+            row = (x * x, x * y, y * y, x, y)
+            for r in range(5):
+                atb[r] += row[r]
+                for c in range(r, 5):
+                    ata[r][c] += row[r] * row[c]
+        for r in range(5):
+            for c in range(r):
+                ata[r][c] = ata[c][r]
+        A, B, C, D, E = _solve(ata, atb)
+        det = 4 * A * C - B * B
+        if det <= 0:
+            raise ValueError("the sweep is not an ellipse")
+        # center: gradient of the conic is zero
+        xc = (B * E - 2 * C * D) / det
+        yc = (B * D - 2 * A * E) / det
+        k = 1 + A * xc * xc + B * xc * yc + C * yc * yc
+        # u' S u = 1 around the center, S in LSB^-2
+        s00 = A / k / (s * s)
+        s01 = B / 2 / k / (s * s)
+        s11 = C / k / (s * s)
+        d = s00 * s11 - s01 * s01
+        if d <= 0 or s00 <= 0:
+            raise ValueError("the sweep is not an ellipse")
+        # symmetric square root of S, scaled to the mean radius
+        rd = math.sqrt(d)
+        t = math.sqrt(s00 + s11 + 2 * rd)
+        radius = 1 / math.sqrt(rd)
+        w00 = (s00 + rd) / t * radius
+        w01 = s01 / t * radius
+        w11 = (s11 + rd) / t * radius
+        self.offset = [int(round(mx + xc * s)), int(round(my + yc * s)), 0]
+        self.matrix = [int(round(w00 * _ONE)), int(round(w01 * _ONE)), 0,
+                       int(round(w01 * _ONE)), int(round(w11 * _ONE)), 0,
+                       0, 0, _ONE]
+        self.t0 = int(round(sum(b[4 * i + 3] for i in range(n)) / n))
+        self.radius = radius
+        res = 0.0
+        for i in range(n):
+            x = b[4 * i] - self.offset[0]
+            y = b[4 * i + 1] - self.offset[1]
+            r = math.sqrt((w00 * x + w01 * y) ** 2 + (w01 * x + w11 * y) ** 2)
+            res = max(res, abs(r - radius))
+        self.residual = res
+        return self
+
+    def fit_tempco(self, other):
+        """
+        Derives the offset and gain drift per temperature LSB from another
+        fitted calibration of the same setup at a different temperature
+        """
+        dt = other.t0 - self.t0
+        if dt == 0:
+            raise ValueError("both sweeps at the same temperature")
+        self.offset_tc = [int(round((o - s) * _ONE / dt))
+                          for o, s in zip(other.offset, self.offset)]
+        # read_into multiplies by 1 - gain_tc * dt to keep the magnitude
+        self.gain_tc = int(round((other.radius / self.radius - 1) * 65536 / dt))
+        return self
+
+    def coeffs(self):
+        """
+        Returns the coefficients in the order of TLV493D.set_calibration()
+        """
+        return tuple([self.t0] + self.offset + self.matrix + self.offset_tc +
+                     [self.gain_tc])
+
+    def apply(self):
+        """
+        Makes the sensor correct its readings with this calibration
+        """
+        self.sensor.set_calibration(self.coeffs())
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'t0': self.t0, 'offset': self.offset, 'matrix': self.matrix,
+                       'offset_tc': self.offset_tc, 'gain_tc': self.gain_tc,
+                       'radius': self.radius, 'residual': self.residual}, f)
+
+    @classmethod
+    def load(cls, path, sensor):
+        """
+        Returns the calibration saved to path, without a sweep buffer
+        """
+        with open(path) as f:
+            d = json.load(f)
+        cal = cls(sensor, 0)
+        cal.t0 = d['t0']
+        cal.offset = d['offset']
+        cal.matrix = d['matrix']
+        cal.offset_tc = d['offset_tc']
+        cal.gain_tc = d['gain_tc']
+        cal.radius = d['radius']
+        cal.residual = d['residual']
+        return cal
@@ -0,0 +1,292 @@
+import machine
+import utime as time
+from micropython import const
+
+from mipy.sensor import SampleRecord
+
+"""
+    Duty-cycled sampling for battery powered nodes.
+
+    Between samples every sensor is put in its lowest power idle state
+    with sleep() (DPS standby, BME280 sleep mode, VL53L0X ranging stopped,
+    TLV493D power-down) and the MCU waits in machine.lightsleep. A cycle
+    wakes the sensors that are due, starts their conversions, reads them
+    into one SampleRecord and puts everything back to sleep:
+
+        from mipy.power import DutyCycle
+        dc = DutyCycle()
+        dc.add('bme', bme, period_ms=60000)
+        dc.add('dps', dps, period_ms=10000)
+        dc.add_device(lcd)  # backlight on only while awake
+        dc.on_sample = lambda name, values, ticks: print(name, values)
+        dc.run(cycles=100)
+        dc.report()
+
+    Sensors are drivers implementing the sensor protocol of mipy.sensor;
+    sleep(), wake(), wake_time_us, start_measurement and
+    measurement_time_us are used when present. Sensors measuring on
+    their own (continuous = True) are given wake_time_us after wake() for
+    their first result, triggered ones additionally measurement_time_us
+    after start_measurement().
+
+    The counters tell where the energy goes: awake_us is the time the
+    MCU spent between waking up and going back to lightsleep, active_us
+    the part of it spent in driver calls (bus transfers and the CPU work
+    around them), slept_us the time in lightsleep. ticks_us is assumed to
+    keep counting during lightsleep.
+"""
+
+# Waits longer than this go through lightsleep, shorter ones busy wait in
+# sleep_us since waking up costs more than it saves
+LIGHTSLEEP_MIN_US = const(5000)
+
+
+class _Node:
+
+    def __init__(self, name, sensor, period_us, read, offset):
+        self.name = name
+        self.sensor = sensor
+        self.period_us = period_us
+        self.read = read
+        self.offset = offset
+        self.sleep = getattr(sensor, 'sleep', None)
+        self.wake = getattr(sensor, 'wake', None)
+        self.start = getattr(sensor, 'start_measurement', None)
+        if getattr(sensor, 'continuous', False):
+            self.start = None
+        self.wake_time_us = getattr(sensor, 'wake_time_us', 0)
+        self.measurement_time_us = getattr(sensor, 'measurement_time_us', 0)
+        self.due = 0
+        self.samples = 0
+        self.active_us = 0
+
+
+class DutyCycle:
+    """
+    Samples (name, sensor) pairs at their own periods, with the sensors
+    asleep and the MCU in lightsleep in between. The values of all
+    sensors are kept in record, a SampleRecord; raw=True reads the
+    uncompensated values instead.
+    """
+
+    def __init__(self, raw=False):
+        self.raw = raw
+        self.nodes = []
+        self.devices = []
+        self.record = None
+        self.values = None
+        # called as on_sample(name, values, ticks_us) for every sensor read,
+        # while the devices are still awake
+        self.on_sample = None
+        self._running = False
+        self.reset_stats()
+
+    def add(self, name, sensor, period_ms):
+        """
+        Registers a sensor sampled every period_ms. Sensors can only be
+        added before run(). Returns the node, whose period_us can be
+        changed while running.
+        """
+        node = _Node(name, sensor, period_ms * 1000, None, 0)
+        self.nodes.append(node)
+        self.record = SampleRecord([(n.name, n.sensor) for n in self.nodes], self.raw)
+        self.values = self.record.values
+        for n, (read, offset) in zip(self.nodes, self.record.sensors):
+            n.read = read
+            n.offset = offset
+        return node
+
+    def add_device(self, device):
+        """
+        Registers a device with sleep() and wake(), e.g. LCD16x2, that is
+        awake only while a cycle runs
+        """
+        self.devices.append(device)
+
+    def reset_stats(self):
+        self.cycles = 0
+        self.awake_us = 0
+        self.active_us = 0
+        self.slept_us = 0
+        self.lightsleeps = 0
+        self.last_awake_us = 0
+        self.max_awake_us = 0
+        # cycles that started more than one period of a sensor late
+        self.overruns = 0
+        for node in self.nodes:
+            node.samples = 0
+            node.active_us = 0
+
+    def sleep_all(self):
+        """
+        Puts every sensor and device in its idle state
+        """
+        for node in self.nodes:
+            if node.sleep is not None:
+                node.sleep()
+        for device in self.devices:
+            device.sleep()
+
+    def _wait(self, us):
+        if us >= LIGHTSLEEP_MIN_US:
+            t0 = time.ticks_us()
+            machine.lightsleep(us // 1000)
+            self.lightsleeps += 1
+            self.slept_us += time.ticks_diff(time.ticks_us(), t0)
+            us -= us // 1000 * 1000
+        if us > 0:
+            time.sleep_us(us)
+
+    def _wait_until(self, ticks):
+        wait = time.ticks_diff(ticks, time.ticks_us())
+        if wait > 0:
+            self._wait(wait)
+
+    def _call(self, node, fn):
+        t0 = time.ticks_us()
+        fn()
+        t = time.ticks_diff(time.ticks_us(), t0)
+        node.active_us += t
+        self.active_us += t
+
+    def cycle(self):
+        """
+        Wakes, starts and reads every sensor that is due and puts them
+        back to sleep. Returns the number of sensors read.
+        """
+        t_wake = time.ticks_us()
+        due = []
+        for node in self.nodes:
+            if time.ticks_diff(t_wake, node.due) >= 0:
+                due.append(node)
+        if not due:
+            return 0
+        slept = self.slept_us
+        for device in self.devices:
+            device.wake()
+        for node in due:
+            if node.wake is not None:
+                self._call(node, node.wake)
+        t_woken = time.ticks_us()
+        # free running sensors measure from wake() on, triggered ones are
+        # started once they are awake
+        free_us = 0
+        start_us = 0
+        for node in due:
+            if node.start is None:
+                free_us = max(free_us, node.wake_time_us)
+            else:
+                start_us = max(start_us, node.wake_time_us)
+        self._wait_until(time.ticks_add(t_woken, start_us))
+        t_start = time.ticks_us()
+        convert_us = 0
+        for node in due:
+            if node.start is not None:
+                self._call(node, node.start)
+                convert_us = max(convert_us, node.measurement_time_us)
+        ready = time.ticks_add(t_woken, free_us)
+        if time.ticks_diff(time.ticks_add(t_start, convert_us), ready) > 0:
+            ready = time.ticks_add(t_start, convert_us)
+        self._wait_until(ready)
+        values = self.values
+        for node in due:
+            t0 = time.ticks_us()
+            node.read(values, node.offset)
+            t = time.ticks_diff(time.ticks_us(), t0)
+            node.active_us += t
+            self.active_us += t
+            node.samples += 1
+            if self.on_sample is not None:
+                self.on_sample(node.name, values, t0)
+        for node in due:
+            if node.sleep is not None:
+                self._call(node, node.sleep)
+            node.due = time.ticks_add(node.due, node.period_us)
+            if time.ticks_diff(t_wake, node.due) >= 0:
+                # skip the periods that passed instead of catching up
+                self.overruns += 1
+                node.due = time.ticks_add(t_wake, node.period_us)
+        for device in self.devices:
+            device.sleep()
+        self.cycles += 1
+        # lightsleep while conversions run does not count as awake
+        awake = time.ticks_diff(time.ticks_us(), t_wake) - (self.slept_us - slept)
+        self.last_awake_us = awake
+        self.awake_us += awake
+        if awake > self.max_awake_us:
+            self.max_awake_us = awake
+        return len(due)
+
+    def next_due(self):
+        """
+        Returns the ticks_us of the next sensor due
+        """
+        best = self.nodes[0].due
+        for node in self.nodes:
+            if time.ticks_diff(node.due, best) < 0:
+                best = node.due
+        return best
+
+    def stop(self):
+        """
+        Makes run() return after the current cycle
+        """
+        self._running = False
+
+    def run(self, cycles=None, duration_ms=None):
+        """
+        Runs cycles until stop() is called, the given number of cycles ran
+        or duration_ms elapsed. All sensors are sampled at once in the
+        first cycle.
+        """
+        if not self.nodes:
+            return
+        start = time.ticks_us()
+        for node in self.nodes:
+            node.due = start
+        self.sleep_all()
+        self._running = True
+        n = 0
+        # summed up, ticks_diff from start wraps after half the ticks period
+        elapsed = 0
+        last = start
+        while self._running:
+            if cycles is not None and n >= cycles:
+                break
+            now = time.ticks_us()
+            elapsed += time.ticks_diff(now, last)
+            last = now
+            if duration_ms is not None and elapsed >= duration_ms * 1000:
+                break
+            self._wait_until(self.next_due())
+            if self.cycle():
+                n += 1
+
+    def duty(self):
+        """
+        Fraction of the time the MCU was awake
+        """
+        total = self.awake_us + self.slept_us
+        return self.awake_us / total if total else 0
+
+    def stats(self):
+        """
+        Returns (name, samples, active us, mean active us per sample) per
+        sensor
+        """
+        return [(n.name, n.samples, n.active_us,
+                 n.active_us // n.samples if n.samples else 0)
+                for n in self.nodes]
+
+    def report(self):
+        """
+        Prints the counters of the cycles and of every sensor
+        """
+        print("cycles %d  awake %d us (last %d, max %d)  active %d us  "
+              "lightsleep %d us in %d  duty %.4f  overruns %d"
+              % (self.cycles, self.awake_us, self.last_awake_us,
+                 self.max_awake_us, self.active_us, self.slept_us,
+                 self.lightsleeps, self.duty(), self.overruns))
+        print("sensor      samples  active us  per sample")
+        for s in self.stats():
+            print("%-10s %8d %10d %11d" % s)
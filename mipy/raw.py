@@ -0,0 +1,138 @@
+import utime as time
+from array import array
+
+"""
+    Raw acquisition ring.
+
+    RawRing captures the raw result registers of a sensor into a
+    preallocated bytearray as fast as the bus allows, with no float math
+    on the sampling path. Compensation runs later in bulk when the
+    consumer drains the ring, or not at all when the raw bytes are sent
+    to a PC (see host/compensate.py). The sensor needs raw_block_size,
+    read_raw_block(buf) and compensate_block(raw, result, offset), which
+    DPS and BME280 have:
+
+        from mipy.raw import RawRing
+        ring = RawRing(dps, 256)
+        ring.run(200)                    # the next 200 results
+        out = array('f', [0] * 2 * 256)
+        n = ring.drain(out)              # n pressure, temperature pairs
+
+    Every result is captured once: when the sensor has measurement_ready(),
+    a block is only read after it reports a new result, so the capture
+    rate is the conversion rate of the sensor. Both have to convert on
+    their own, DPS in its background mode and BME280 after
+    bme.normal_mode(); a BME280 in forced mode runs and waits for one
+    conversion per block.
+"""
+
+
+class RawRing:
+    """
+    Ring of capacity raw blocks of sensor, each with its ticks_us. When the
+    ring is full the oldest block is overwritten and counted in overruns.
+    """
+    
+    def __init__(self, sensor, capacity):
+        self.sensor = sensor
+        self.size = sensor.raw_block_size
+        self.capacity = capacity
+        self.buf = bytearray(self.size * capacity)
+        self.ticks = array('I', [0] * capacity)
+        mv = memoryview(self.buf)
+        # one view per slot, so that capturing allocates nothing
+        self._mv = mv
+        self._slots = [mv[i * self.size:(i + 1) * self.size] for i in range(capacity)]
+        self._ready = getattr(sensor, 'measurement_ready', None)
+        self.head = 0
+        self.count = 0
+        self.overruns = 0
+        
+    def __len__(self):
+        return self.count
+        
+    def capture(self):
+        """
+        Reads one raw block into the ring if the sensor has a new result.
+        Returns whether it did.
+        """
+        if self._ready is not None and not self._ready():
+            return False
+        i = self.head
+        self.sensor.read_raw_block(self._slots[i])
+        self.ticks[i] = time.ticks_us()
+        i += 1
+        self.head = i if i < self.capacity else 0
+        if self.count < self.capacity:
+            self.count += 1
+        else:
+            self.overruns += 1
+        return True
+            
+    def run(self, n, period_us=0, poll_us=1000, timeout_us=2000000):
+        """
+        Captures n blocks, each as soon as the sensor has a new result, or
+        the first new one at least period_us after the previous capture
+        started. The sensor is polled every poll_us; RuntimeError is
+        raised if no new result comes within timeout_us.
+        """
+        due = time.ticks_us()
+        for _ in range(n):
+            if period_us:
+                wait = time.ticks_diff(due, time.ticks_us())
+                if wait > 0:
+                    time.sleep_us(wait)
+                due = time.ticks_add(due, period_us)
+            t0 = time.ticks_us()
+            while not self.capture():
+                if time.ticks_diff(time.ticks_us(), t0) > timeout_us:
+                    raise RuntimeError("no new result from the sensor")
+                time.sleep_us(poll_us)
+            
+    def _segments(self):
+        # the captured blocks oldest first, as at most two contiguous runs
+        tail = self.head - self.count
+        if tail >= 0:
+            return ((tail, self.head),)
+        tail += self.capacity
+        return ((tail, self.capacity), (0, self.head))
+        
+    def drain(self, result, ticks=None):
+        """
+        Compensates all captured blocks into result, len(sensor.fields)
+        values per block, oldest first, and empties the ring. ticks, if
+        given, receives the ticks_us of every block. Returns the number
+        of blocks.
+        """
+        offset = 0
+        n = 0
+        size = self.size
+        for a, b in self._segments():
+            offset = self.sensor.compensate_block(self._mv[a * size:b * size],
+                                                  result, offset)
+            if ticks is not None:
+                for i in range(a, b):
+                    ticks[n] = self.ticks[i]
+                    n += 1
+        n = self.count
+        self.count = 0
+        return n
+        
+    def drain_raw(self, out, ticks=None):
+        """
+        Copies the raw bytes of all captured blocks into out, oldest first,
+        and empties the ring. Returns the number of blocks.
+        """
+        pos = 0
+        n = 0
+        size = self.size
+        for a, b in self._segments():
+            out[pos:pos + (b - a) * size] = self._mv[a * size:b * size]
+            pos += (b - a) * size
+            if ticks is not None:
+                for i in range(a, b):
+                    ticks[n] = self.ticks[i]
+                    n += 1
+        n = self.count
+        self.count = 0
+        return n
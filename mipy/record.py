@@ -0,0 +1,183 @@
+import ustruct
+from micropython import const
+
+"""
+    Bus traffic recorder.
+
+    RecordingI2C and RecordingSPI wrap the bus object handed to a driver
+    and append every transfer, with the bytes written and the bytes the
+    device answered, to a binary stream. host/replay.py plays a recording
+    back to the drivers on a PC, which checks that a changed driver still
+    issues the same traffic or, in register image mode, still reads and
+    writes the same register contents with fewer transfers:
+
+        from mipy.record import Recorder
+        rec = Recorder(open('boot.rec', 'wb'))
+        i2c = rec.i2c(I2C(0, scl='P6_0', sda='P6_1', freq=400000))
+        rec.mark('BME280.__init__')
+        bme = BME280(i2c)
+        rec.mark('VL53L0X.init')
+        tof = VL53L0X(i2c=i2c)
+        rec.close()
+
+    File format, little endian: the 8 byte header b'MIPYREC' + VERSION,
+    then one record per transfer or mark, each an 8 byte record header
+    (op, addr, reg, nout, nin as '<BBHHH') followed by nout bytes written
+    and nin bytes read. The low nibble of op is the operation, the high
+    nibble the source: the n-th bus wrapped by the recorder. reg is the
+    memory address of *_mem transfers, the fill byte of SPI reads and
+    NO_REG otherwise. A mark has the mark name as its written bytes.
+"""
+
+MAGIC = b'MIPYREC'
+VERSION = const(1)
+
+RECORD = '<BBHHH'
+RECORD_SIZE = const(8)
+
+OP_WRITE = const(0)           # writeto
+OP_READ = const(1)            # readfrom, readfrom_into
+OP_WRITE_MEM = const(2)       # writeto_mem
+OP_READ_MEM = const(3)        # readfrom_mem, readfrom_mem_into
+OP_SPI_WRITE = const(4)       # write
+OP_SPI_READ = const(5)        # read, readinto
+OP_SPI_TRANSFER = const(6)    # write_readinto
+OP_MARK = const(15)
+OP_NAMES = ('writeto', 'readfrom', 'writeto_mem', 'readfrom_mem', 'spi.write',
+            'spi.read', 'spi.write_readinto')
+
+NO_REG = const(0xFFFF)
+
+_MAX_SOURCES = const(16)
+
+
+class Recorder:
+    """
+    Appends the transfers of the bus objects it wraps to stream
+    """
+    
+    def __init__(self, stream):
+        self.stream = stream
+        self.sources = 0
+        self.records = 0
+        self._head = bytearray(RECORD_SIZE)
+        stream.write(MAGIC + bytes((VERSION,)))
+        
+    def i2c(self, i2c):
+        return RecordingI2C(i2c, self, self._source())
+        
+    def spi(self, spi):
+        return RecordingSPI(spi, self, self._source())
+        
+    def _source(self):
+        if self.sources >= _MAX_SOURCES:
+            raise ValueError('too many recorded buses')
+        self.sources += 1
+        return self.sources - 1
+        
+    def mark(self, name):
+        """
+        Starts a named section, e.g. the driver call about to be recorded
+        """
+        self.write(OP_MARK, 0, NO_REG, name.encode(), b'')
+        
+    def write(self, op, addr, reg, out, data):
+        head = self._head
+        ustruct.pack_into(RECORD, head, 0, op, addr, reg, len(out), len(data))
+        stream = self.stream
+        stream.write(head)
+        if out:
+            stream.write(out)
+        if data:
+            stream.write(data)
+        self.records += 1
+        
+    def flush(self):
+        self.stream.flush()
+        
+    def close(self):
+        self.stream.close()
+
+
+class RecordingI2C:
+    """
+    I2C object (machine.I2C or mipy.bus.I2CDevice) whose transfers are
+    appended to a Recorder
+    """
+    
+    def __init__(self, i2c, recorder, source=0):
+        self.i2c = i2c
+        self.recorder = recorder
+        self.source = source << 4
+        
+    def __enter__(self):
+        self.i2c.__enter__()
+        return self
+        
+    def __exit__(self, *exc):
+        self.i2c.__exit__(*exc)
+        
+    def scan(self):
+        return self.i2c.scan()
+        
+    def writeto(self, addr, buf, stop=True):
+        n = self.i2c.writeto(addr, buf, stop)
+        self.recorder.write(self.source | OP_WRITE, addr, NO_REG, buf, b'')
+        return n
+        
+    def readfrom(self, addr, nbytes, stop=True):
+        data = self.i2c.readfrom(addr, nbytes, stop)
+        self.recorder.write(self.source | OP_READ, addr, NO_REG, b'', data)
+        return data
+        
+    def readfrom_into(self, addr, buf, stop=True):
+        self.i2c.readfrom_into(addr, buf, stop)
+        self.recorder.write(self.source | OP_READ, addr, NO_REG, b'', buf)
+        
+    def writeto_mem(self, addr, memaddr, buf, addrsize=8):
+        self.i2c.writeto_mem(addr, memaddr, buf, addrsize=addrsize)
+        self.recorder.write(self.source | OP_WRITE_MEM, addr, memaddr, buf, b'')
+        
+    def readfrom_mem(self, addr, memaddr, nbytes, addrsize=8):
+        data = self.i2c.readfrom_mem(addr, memaddr, nbytes, addrsize=addrsize)
+        self.recorder.write(self.source | OP_READ_MEM, addr, memaddr, b'', data)
+        return data
+        
+    def readfrom_mem_into(self, addr, memaddr, buf, addrsize=8):
+        self.i2c.readfrom_mem_into(addr, memaddr, buf, addrsize=addrsize)
+        self.recorder.write(self.source | OP_READ_MEM, addr, memaddr, b'', buf)
+
+
+class RecordingSPI:
+    """
+    SPI object whose transfers are appended to a Recorder
+    """
+    
+    def __init__(self, spi, recorder, source=0):
+        self.spi = spi
+        self.recorder = recorder
+        self.source = source << 4
+        
+    def init(self, *args, **kwargs):
+        self.spi.init(*args, **kwargs)
+        
+    def deinit(self):
+        self.spi.deinit()
+        
+    def write(self, buf):
+        self.spi.write(buf)
+        self.recorder.write(self.source | OP_SPI_WRITE, 0, NO_REG, buf, b'')
+        
+    def read(self, nbytes, write=0x00):
+        data = self.spi.read(nbytes, write)
+        self.recorder.write(self.source | OP_SPI_READ, 0, write, b'', data)
+        return data
+        
+    def readinto(self, buf, write=0x00):
+        self.spi.readinto(buf, write)
+        self.recorder.write(self.source | OP_SPI_READ, 0, write, b'', buf)
+        
+    def write_readinto(self, write_buf, read_buf):
+        self.spi.write_readinto(write_buf, read_buf)
+        self.recorder.write(self.source | OP_SPI_TRANSFER, 0, NO_REG,
+                            write_buf, read_buf)
@@ -0,0 +1,226 @@
+import utime as time
+from machine import I2C, Pin
+from micropython import const
+
+"""
+    I2C fault recovery.
+
+    A NACK or a glitch makes machine.I2C raise OSError out of whatever
+    driver call was running. RecoveringI2C has the same methods and
+    retries a failed transaction with exponential backoff. Before each
+    retry it frees the bus: SCL is clocked until a device holding SDA low
+    lets go, a STOP is sent and the peripheral is set up again. Devices
+    registered with protect() are then brought back with their restore()
+    method, which rewrites the configuration the driver keeps instead of
+    running the whole initialization again:
+
+        from mipy.recovery import RecoveringI2C
+        i2c = RecoveringI2C(0, scl='P6_0', sda='P6_1')
+        bme = BME280(i2c)
+        dps = DPS(i2c=i2c)
+        lcd = LCD16x2(i2c=i2c)
+        i2c.protect(0x76, bme)
+        i2c.protect(0x77, dps)
+        i2c.protect(0x27, lcd)
+
+    restore() of the drivers:
+      BME280: ctrl_hum and ctrl_meas, the calibration stays cached
+      DPS: temperature fix and configuration, 6 writes
+      LCD16x2: LCD_resync, nibble sync and display modes in about 2 ms
+      VL53L0X: nothing if the sensor kept its configuration, else init
+        without reading the SPAD information again
+      HBridgeKit2Go (SPI, call it yourself): the kept Control Register
+
+    Only the device whose transaction failed is restored, or every
+    protected device when SDA was stuck. A transaction that still fails
+    after the retries raises its OSError.
+
+    Retried transactions are repeated on their own. A register read has to
+    be one readfrom_mem, not a writeto of the register followed by a
+    readfrom: restore() or a reset of the device moves its register
+    pointer, and the retried readfrom would read the wrong register.
+    python host/faults.py checks the drivers for this in the simulator.
+"""
+
+# SCL half period while clocking out a stuck SDA, 100 kHz
+_HALF_PERIOD_US = const(5)
+
+_ETIMEDOUT = const(110)
+
+
+def clock_out(scl, sda):
+    """
+    Frees SDA held low by a device that lost track of a transfer. SCL is
+    clocked until the device lets go, at most 9 times (the rest of a byte
+    and its acknowledge), then a STOP is sent. The pins are left as GPIO,
+    the I2C peripheral has to be set up again afterwards.
+
+    Returns True if SDA was held low, raises OSError(ETIMEDOUT) if it
+    still is.
+    """
+    scl = Pin(scl, Pin.OPEN_DRAIN, value=1)
+    sda = Pin(sda, Pin.OPEN_DRAIN, value=1)
+    time.sleep_us(_HALF_PERIOD_US)
+    stuck = not sda.value()
+    for _ in range(9):
+        if sda.value():
+            break
+        scl.off()
+        time.sleep_us(_HALF_PERIOD_US)
+        scl.on()
+        time.sleep_us(_HALF_PERIOD_US)
+    # STOP, SDA rising while SCL is high
+    scl.off()
+    sda.off()
+    time.sleep_us(_HALF_PERIOD_US)
+    scl.on()
+    time.sleep_us(_HALF_PERIOD_US)
+    sda.on()
+    time.sleep_us(_HALF_PERIOD_US)
+    if not sda.value():
+        raise OSError(_ETIMEDOUT)
+    return stuck
+
+
+class RecoveringI2C:
+    """
+    machine.I2C on the given pins that retries failed transactions up to
+    retries times, waiting backoff_us before the first retry and twice as
+    long before each next one, at most max_backoff_us.
+    """
+
+    def __init__(self, id=0, scl='P6_0', sda='P6_1', freq=400000, retries=3,
+                 backoff_us=100, max_backoff_us=5000):
+        self.id = id
+        self.scl = scl
+        self.sda = sda
+        self.freq = freq
+        self.retries = retries
+        self.backoff_us = backoff_us
+        self.max_backoff_us = max_backoff_us
+        self.i2c = I2C(id, scl=scl, sda=sda, freq=freq)
+        self.devices = {}
+        self._restoring = False
+        self.reset_stats()
+
+    def reset_stats(self):
+        # failed transactions, including the failed retries
+        self.errors = 0
+        self.recoveries = 0
+        # recoveries that found SDA held low
+        self.unsticks = 0
+        self.restores = 0
+        # transactions given up on
+        self.failures = 0
+        # time spent in backoff and recovery
+        self.recovery_us = 0
+
+    def protect(self, addr, device):
+        """
+        Registers the driver of the device at addr, its restore() is
+        called after a recovery
+        """
+        self.devices[addr] = device
+
+    def recover(self, addr=None):
+        """
+        Frees the bus, sets up the peripheral again and restores the
+        device at addr, or every protected device if SDA was held low or
+        addr is None
+        """
+        stuck = clock_out(self.scl, self.sda)
+        self.i2c = I2C(self.id, scl=self.scl, sda=self.sda, freq=self.freq)
+        self.recoveries += 1
+        if stuck:
+            self.unsticks += 1
+        if stuck or addr is None:
+            devices = list(self.devices.values())
+        elif addr in self.devices:
+            devices = [self.devices[addr]]
+        else:
+            return
+        # transactions of restore() are retried, but recover no further
+        self._restoring = True
+        try:
+            for device in devices:
+                device.restore()
+                self.restores += 1
+        finally:
+            self._restoring = False
+
+    def _retry(self, addr, name, args, kw=None):
+        t0 = time.ticks_us()
+        self.errors += 1
+        delay = self.backoff_us
+        try:
+            for attempt in range(self.retries):
+                time.sleep_us(delay)
+                delay = min(delay * 2, self.max_backoff_us)
+                if not self._restoring:
+                    try:
+                        self.recover(addr)
+                    except OSError:
+                        self.errors += 1
+                        continue
+                try:
+                    return getattr(self.i2c, name)(*args, **(kw or {}))
+                except OSError:
+                    self.errors += 1
+                    if attempt == self.retries - 1:
+                        self.failures += 1
+                        raise
+            self.failures += 1
+            raise OSError(_ETIMEDOUT)
+        finally:
+            self.recovery_us += time.ticks_diff(time.ticks_us(), t0)
+
+    def scan(self):
+        return self.i2c.scan()
+
+    def writeto(self, addr, buf, stop=True):
+        try:
+            return self.i2c.writeto(addr, buf, stop)
+        except OSError:
+            # restore() may reuse the driver's transmit buffer
+            return self._retry(addr, 'writeto', (addr, bytes(buf), stop))
+
+    def readfrom(self, addr, nbytes, stop=True):
+        try:
+            return self.i2c.readfrom(addr, nbytes, stop)
+        except OSError:
+            return self._retry(addr, 'readfrom', (addr, nbytes, stop))
+
+    def readfrom_into(self, addr, buf, stop=True):
+        try:
+            return self.i2c.readfrom_into(addr, buf, stop)
+        except OSError:
+            return self._retry(addr, 'readfrom_into', (addr, buf, stop))
+
+    def writeto_mem(self, addr, memaddr, buf, addrsize=8):
+        try:
+            return self.i2c.writeto_mem(addr, memaddr, buf, addrsize=addrsize)
+        except OSError:
+            return self._retry(addr, 'writeto_mem', (addr, memaddr, bytes(buf)),
+                               {'addrsize': addrsize})
+
+    def readfrom_mem(self, addr, memaddr, nbytes, addrsize=8):
+        try:
+            return self.i2c.readfrom_mem(addr, memaddr, nbytes, addrsize=addrsize)
+        except OSError:
+            return self._retry(addr, 'readfrom_mem', (addr, memaddr, nbytes),
+                               {'addrsize': addrsize})
+
+    def readfrom_mem_into(self, addr, memaddr, buf, addrsize=8):
+        try:
+            return self.i2c.readfrom_mem_into(addr, memaddr, buf, addrsize=addrsize)
+        except OSError:
+            return self._retry(addr, 'readfrom_mem_into', (addr, memaddr, buf),
+                               {'addrsize': addrsize})
+
+    def stats(self):
+        """
+        Returns the counters as a dict
+        """
+        return {'errors': self.errors, 'recoveries': self.recoveries,
+                'unsticks': self.unsticks, 'restores': self.restores,
+                'failures': self.failures, 'recovery_us': self.recovery_us}
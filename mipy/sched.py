@@ -0,0 +1,290 @@
+import utime as time
+from array import array
+from micropython import const
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+"""
+    Multi-rate sensor scheduler.
+
+    Sensors are registered with a target rate. Triggered sensors are
+    started measurement_time_us ahead of their due time so the result is
+    ready when it is read. Of the reads that are due, the one with the
+    earliest deadline (due time plus deadline_us) is taken first.
+    Lateness of every read (jitter) and missed samples are recorded per
+    sensor:
+
+        sched = Scheduler()
+        sched.add('tlv', tlv.update_data, 200, bus_time_us=400)
+        sched.add('tof', tof.read, 30, start=tof.start_measurement,
+                  measurement_time_us=tof.measurement_time_us)
+        sched.add('bme', bme.read_compensated_data, 1,
+                  start=bme.start_measurement,
+                  measurement_time_us=bme.measurement_time_us)
+        sched.run(duration_ms=10000)
+        sched.report()
+
+    Drivers implementing the sensor protocol of mipy.sensor can be added
+    with add_sensor, which reads them into caller-owned storage such as
+    the values of a SampleRecord, so sampling allocates no containers.
+"""
+
+# Time reserved between starting a conversion early and its due time, on
+# top of the conversion time
+LEAD_MARGIN_US = const(500)
+
+# Sleeps longer than this go through sleep_ms, shorter ones through sleep_us
+_SLEEP_US_MAX = const(2000)
+
+
+class _Task:
+    
+    def __init__(self, name, read, period_us, start, measurement_time_us,
+                 bus_time_us, deadline_us):
+        self.name = name
+        self.read = read
+        self.start = start
+        self.period_us = period_us
+        self.lead_us = measurement_time_us + LEAD_MARGIN_US if start else 0
+        self.bus_time_us = bus_time_us
+        self.deadline_us = deadline_us
+        self.due = 0
+        self.started = False
+        self.value = None
+        self.samples = 0
+        self.misses = 0
+        self.max_jitter_us = 0
+        self.sum_jitter_us = 0
+        self.busy_us = 0
+
+
+class Scheduler:
+    """
+    Time triggered scheduler for sensor reads, earliest deadline first
+    among the reads that are due.
+    """
+    
+    def __init__(self):
+        self.tasks = []
+        # called as on_sample(name, value, ticks_us) after every read
+        self.on_sample = None
+        self._running = False
+        
+    def add(self, name, read, rate_hz, start=None, measurement_time_us=0,
+            bus_time_us=1000, deadline_us=None):
+        """
+        Registers a sensor read.
+        
+        name: Label used in the statistics
+        read: Callable returning the sample
+        rate_hz: Target sample rate
+        start: Optional callable starting a conversion, it is called
+            measurement_time_us ahead of the read
+        bus_time_us: Bus time of one start and read, used to check that
+            all rates fit on the bus
+        deadline_us: Lateness after which a sample counts as missed,
+            by default one period
+        
+        Raises ValueError if the sensor cannot convert at the given rate or
+        the bus would be more than fully occupied.
+        """
+        period_us = int(1000000 // rate_hz)
+        if start is not None and measurement_time_us > period_us:
+            raise ValueError("%s converts slower than %s Hz" % (name, rate_hz))
+        if self.utilization() + bus_time_us / period_us > 1:
+            raise ValueError("bus time of %s does not fit the schedule" % name)
+        task = _Task(name, read, period_us, start, measurement_time_us,
+                     bus_time_us, period_us if deadline_us is None else deadline_us)
+        self.tasks.append(task)
+        return task
+        
+    def add_sensor(self, name, sensor, rate_hz, buf=None, offset=0, raw=False,
+                   bus_time_us=1000, deadline_us=None):
+        """
+        Registers a driver implementing the sensor protocol (see
+        mipy.sensor). Every sample is read with read_into, or raw_into if
+        raw is set, into buf[offset:], by default a new array sized for
+        the sensor fields. Triggered sensors are started ahead using their
+        start_measurement and measurement_time_us, continuous ones are only
+        read. on_sample receives buf.
+        """
+        if buf is None:
+            buf = array('i' if raw else 'f', [0] * len(sensor.fields))
+        into = sensor.raw_into if raw else sensor.read_into
+        def read():
+            into(buf, offset)
+            return buf
+        start = getattr(sensor, 'start_measurement', None)
+        mt = getattr(sensor, 'measurement_time_us', 0)
+        # free running sensors have a result ready at every read
+        if getattr(sensor, 'continuous', False):
+            start = None
+            mt = 0
+        return self.add(name, read, rate_hz, start=start,
+                        measurement_time_us=mt,
+                        bus_time_us=bus_time_us, deadline_us=deadline_us)
+        
+    def utilization(self):
+        """
+        Fraction of the bus time taken by all registered sensors
+        """
+        u = 0
+        for task in self.tasks:
+            u += task.bus_time_us / task.period_us
+        return u
+        
+    def _reset(self, now):
+        for task in self.tasks:
+            # first samples are due once every conversion had time to run
+            task.due = time.ticks_add(now, task.lead_us)
+            task.started = False
+            
+    def _next(self, now):
+        """
+        Returns the next task to serve and the ticks_us it is released at.
+        Of the tasks released by now, conversions to start come first (a
+        start is due as soon as it is released), then the read with the
+        earliest deadline. If none is released, the next one to be.
+        """
+        best = None
+        best_at = 0
+        best_deadline = 0
+        for task in self.tasks:
+            if task.start is not None and not task.started:
+                at = time.ticks_add(task.due, -task.lead_us)
+                deadline = at
+            else:
+                at = task.due
+                deadline = time.ticks_add(task.due, task.deadline_us)
+            if time.ticks_diff(at, now) > 0:
+                # not released yet, the earliest release if nothing is
+                if best is None or (time.ticks_diff(best_at, now) > 0 and
+                                    time.ticks_diff(at, best_at) < 0):
+                    best = task
+                    best_at = at
+                    best_deadline = deadline
+            elif best is None or time.ticks_diff(best_at, now) > 0 or \
+                    time.ticks_diff(deadline, best_deadline) < 0:
+                best = task
+                best_at = at
+                best_deadline = deadline
+        return best, best_at
+        
+    def _serve(self, task):
+        if task.start is not None and not task.started:
+            task.start()
+            task.started = True
+            return
+        t0 = time.ticks_us()
+        value = task.read()
+        t1 = time.ticks_us()
+        task.started = False
+        task.value = value
+        task.samples += 1
+        task.busy_us += time.ticks_diff(t1, t0)
+        late = time.ticks_diff(t0, task.due)
+        if late > task.max_jitter_us:
+            task.max_jitter_us = late
+        if late > 0:
+            task.sum_jitter_us += late
+        if time.ticks_diff(t1, task.due) > task.deadline_us:
+            task.misses += 1
+        # skip the releases that already passed instead of bursting
+        task.due = time.ticks_add(task.due, task.period_us)
+        while time.ticks_diff(t1, task.due) > task.period_us:
+            task.due = time.ticks_add(task.due, task.period_us)
+            task.misses += 1
+        if self.on_sample is not None:
+            self.on_sample(task.name, value, t0)
+            
+    def stop(self):
+        """
+        Makes run() or run_async() return after the current read
+        """
+        self._running = False
+        
+    def run(self, duration_ms=None):
+        """
+        Serves the sensors until stop() is called or duration_ms elapsed
+        """
+        if not self.tasks:
+            return
+        start = time.ticks_us()
+        self._reset(start)
+        self._running = True
+        # summed up, ticks_diff from start wraps after half the ticks period
+        elapsed = 0
+        last = start
+        while self._running:
+            now = time.ticks_us()
+            task, at = self._next(now)
+            elapsed += time.ticks_diff(now, last)
+            last = now
+            if duration_ms is not None and elapsed >= duration_ms * 1000:
+                break
+            wait = time.ticks_diff(at, now)
+            if wait > 0:
+                if wait > _SLEEP_US_MAX:
+                    time.sleep_ms(wait // 1000)
+                else:
+                    time.sleep_us(wait)
+                # others may be released by now, choose again
+                continue
+            self._serve(task)
+            
+    async def run_async(self, duration_ms=None):
+        """
+        Same as run(), but waits for the next sensor on the uasyncio loop
+        """
+        if not self.tasks:
+            return
+        start = time.ticks_us()
+        self._reset(start)
+        self._running = True
+        # summed up, ticks_diff from start wraps after half the ticks period
+        elapsed = 0
+        last = start
+        while self._running:
+            now = time.ticks_us()
+            task, at = self._next(now)
+            elapsed += time.ticks_diff(now, last)
+            last = now
+            if duration_ms is not None and elapsed >= duration_ms * 1000:
+                break
+            wait = time.ticks_diff(at, now)
+            if wait > 0:
+                if wait > _SLEEP_US_MAX:
+                    await asyncio.sleep_ms(wait // 1000)
+                else:
+                    time.sleep_us(wait)
+                # others may be released by now, choose again
+                continue
+            self._serve(task)
+            
+    def stats(self):
+        """
+        Returns (name, samples, misses, max jitter us, mean jitter us,
+        bus busy us) per sensor
+        """
+        return [(t.name, t.samples, t.misses, t.max_jitter_us,
+                 t.sum_jitter_us // t.samples if t.samples else 0, t.busy_us)
+                for t in self.tasks]
+        
+    def reset_stats(self):
+        for t in self.tasks:
+            t.samples = 0
+            t.misses = 0
+            t.max_jitter_us = 0
+            t.sum_jitter_us = 0
+            t.busy_us = 0
+            
+    def report(self):
+        """
+        Prints the statistics of every sensor
+        """
+        print("sensor      samples  misses  max jitter us  mean jitter us  busy us")
+        for s in self.stats():
+            print("%-10s %8d %7d %14d %15d %8d" % s)
@@ -0,0 +1,78 @@
+from array import array
+
+"""
+    Common sensor protocol.
+
+    Every sensor driver has
+        fields: names of the values it measures, in order
+        units: unit of each field
+        read_into(buf, offset=0): measures and stores the compensated
+            values of all fields in buf[offset:], returns the index after
+            the last value written
+        raw_into(buf, offset=0): same with the uncompensated readings
+            (integer ADC or register values) in the same order
+
+    and, where the device has them, the optional members used by the
+    scheduler and the other mipy helpers
+        start_measurement(), measurement_time_us: triggers a conversion
+            and the time until its result can be read
+        continuous: True if the device measures on its own
+        measurement_ready(): True once a new result can be read
+        sleep(), wake(), wake_time_us: low power mode and the time until
+            the first result after waking
+        restore(): writes the configuration again after a bus or device
+            reset
+
+    buf is storage owned by the caller, normally an array('f') for
+    read_into and an array('i') or array('f') for raw_into, so the
+    sampling loop does not allocate containers for the results. The
+    drivers implement the protocol by duck typing, without importing this
+    module, so that each stays a single file to copy to the board.
+
+    SampleRecord keeps the fields of several sensors in one array:
+
+        from mipy.sensor import SampleRecord
+        rec = SampleRecord((('bme', bme), ('dps', dps), ('tof', tof)))
+        rec.read()
+        print(rec.fields, rec.values)
+"""
+
+
+class SampleRecord:
+    """
+    One preallocated array holding the fields of several sensors, given
+    as (name, sensor) pairs. Field names are prefixed with the sensor
+    name, e.g. 'bme.temperature'. With raw=True the record holds the
+    uncompensated readings in an array('i').
+    """
+    
+    def __init__(self, sensors, raw=False):
+        self.sensors = []
+        self.offsets = {}
+        fields = []
+        units = []
+        offset = 0
+        for name, sensor in sensors:
+            read = sensor.raw_into if raw else sensor.read_into
+            self.sensors.append((read, offset))
+            self.offsets[name] = offset
+            for field in sensor.fields:
+                fields.append(name + '.' + field)
+            units.extend(sensor.units)
+            offset += len(sensor.fields)
+        self.fields = tuple(fields)
+        self.units = tuple(units)
+        self.typecode = 'i' if raw else 'f'
+        self.values = array(self.typecode, [0] * offset)
+        
+    def __len__(self):
+        return len(self.values)
+        
+    def read(self):
+        """
+        Reads every sensor into values and returns values
+        """
+        values = self.values
+        for read, offset in self.sensors:
+            read(values, offset)
+        return values
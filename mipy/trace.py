@@ -0,0 +1,370 @@
+import utime as time
+from array import array
+from micropython import const
+
+"""
+    Bus transaction tracing.
+
+    TracedI2C and TracedSPI wrap the bus object handed to a driver and
+    log every transfer into a Trace: a ring of preallocated arrays holding
+    start ticks_us, duration, source, tag, operation, address, register and
+    length. Nothing is allocated per transaction. While the trace is
+    disabled the wrapper's transfer methods are the bus object's own bound
+    methods, so an untraced transfer costs one extra attribute lookup.
+
+    Driver methods can be instrumented so that the transfers they issue
+    are attributed to them, and per source and per tag statistics with a
+    histogram of transfer durations are kept alongside the ring:
+
+        from mipy.trace import Trace
+        trace = Trace(256)
+        dps = DPS(i2c=trace.i2c(bus.device(0x77), 'dps'))
+        hb = HBridgeKit2Go(spi=trace.spi(SPI(0, ...), 'hbridge'))
+        trace.instrument(dps, 'getRawPressure', 'getRawTemperature')
+        trace.instrument(hb, 'readWriteCMD')
+        trace.enable()
+        ...
+        trace.report()
+"""
+
+OP_WRITE = const(0)
+OP_READ = const(1)
+OP_WRITE_MEM = const(2)
+OP_READ_MEM = const(3)
+OP_SPI = const(4)
+OP_NAMES = ('writeto', 'readfrom', 'writeto_mem', 'readfrom_mem', 'spi')
+
+# Duration histogram: bucket 0 counts transfers under 16us, bucket i those
+# from 2**(i+3) to 2**(i+4)us, the last bucket everything from 16ms up
+HIST_BUCKETS = const(12)
+
+# Layout of a statistics row: count, bytes, total us, max us, histogram
+_COUNT = const(0)
+_BYTES = const(1)
+_TOTAL = const(2)
+_MAX = const(3)
+_HIST = const(4)
+
+# Sources and tags are stored in bytearrays
+_MAX_NAMES = const(255)
+
+# Register of transfers that have none (plain reads)
+NO_REG = const(-1)
+
+
+def _row():
+    return array('I', [0] * (_HIST + HIST_BUCKETS))
+
+
+class Trace:
+    """
+    Fixed size ring of bus transactions with per source and per tag
+    statistics. Tag 0 is the untagged tag ''.
+    """
+    
+    def __init__(self, size=256):
+        self.size = size
+        self.start = array('I', [0] * size)
+        self.duration = array('I', [0] * size)
+        self.addr = array('H', [0] * size)
+        self.reg = array('i', [0] * size)
+        self.length = array('H', [0] * size)
+        self.op = bytearray(size)
+        self.src = bytearray(size)
+        self.tag = bytearray(size)
+        self.head = 0
+        self.count = 0
+        self.enabled = False
+        self.sources = []
+        self.tags = ['']
+        self._wrappers = []
+        self._src_rows = []
+        self._tag_rows = [_row()]
+        self._tag = 0
+        
+    def i2c(self, i2c, name):
+        """
+        Returns a TracedI2C around i2c, logged under source name
+        """
+        return TracedI2C(i2c, self, name)
+        
+    def spi(self, spi, name):
+        """
+        Returns a TracedSPI around spi, logged under source name
+        """
+        return TracedSPI(spi, self, name)
+        
+    def _source(self, name, wrapper):
+        if len(self.sources) >= _MAX_NAMES:
+            raise ValueError('too many trace sources')
+        self.sources.append(name)
+        self._src_rows.append(_row())
+        self._wrappers.append(wrapper)
+        return len(self.sources) - 1
+        
+    def _tag_index(self, name):
+        if name in self.tags:
+            return self.tags.index(name)
+        if len(self.tags) >= _MAX_NAMES:
+            raise ValueError('too many trace tags')
+        self.tags.append(name)
+        self._tag_rows.append(_row())
+        return len(self.tags) - 1
+        
+    def instrument(self, obj, *methods):
+        """
+        Replaces the given methods on the instance obj so that transfers
+        issued while they run are tagged 'Class.method'. Calls nest, the
+        innermost instrumented method gets the transfer.
+        """
+        cls = type(obj).__name__
+        for name in methods:
+            tag = self._tag_index(cls + '.' + name)
+            setattr(obj, name, self._tagged(getattr(obj, name), tag))
+            
+    def _tagged(self, fn, tag):
+        def call(*args, **kwargs):
+            outer = self._tag
+            self._tag = tag
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._tag = outer
+        return call
+        
+    def enable(self):
+        self.enabled = True
+        for wrapper in self._wrappers:
+            wrapper._bind(True)
+            
+    def disable(self):
+        self.enabled = False
+        for wrapper in self._wrappers:
+            wrapper._bind(False)
+            
+    def clear(self):
+        self.head = 0
+        self.count = 0
+        for row in self._src_rows + self._tag_rows:
+            for i in range(len(row)):
+                row[i] = 0
+                
+    def record(self, src, op, addr, reg, length, t0):
+        """
+        Logs a transfer that started at ticks_us t0 and ends now
+        """
+        dt = time.ticks_diff(time.ticks_us(), t0)
+        i = self.head
+        self.start[i] = t0
+        self.duration[i] = dt
+        self.addr[i] = addr
+        self.reg[i] = reg
+        self.length[i] = length
+        self.op[i] = op
+        self.src[i] = src
+        tag = self._tag
+        self.tag[i] = tag
+        i += 1
+        self.head = i if i < self.size else 0
+        self.count += 1
+        _account(self._src_rows[src], length, dt)
+        _account(self._tag_rows[tag], length, dt)
+        
+    def entries(self):
+        """
+        Yields the logged transfers oldest first as tuples
+        (start, duration_us, source, tag, op, addr, reg, length)
+        """
+        n = min(self.count, self.size)
+        i = (self.head - n) % self.size
+        for _ in range(n):
+            yield (self.start[i], self.duration[i], self.sources[self.src[i]],
+                   self.tags[self.tag[i]], OP_NAMES[self.op[i]],
+                   self.addr[i], self.reg[i], self.length[i])
+            i = i + 1 if i + 1 < self.size else 0
+            
+    def stats(self, name):
+        """
+        Returns (count, bytes, total_us, max_us, histogram) of a source or
+        tag. Sources are looked up first.
+        """
+        if name in self.sources:
+            row = self._src_rows[self.sources.index(name)]
+        else:
+            row = self._tag_rows[self.tags.index(name)]
+        return (row[_COUNT], row[_BYTES], row[_TOTAL], row[_MAX],
+                list(row[_HIST:]))
+        
+    def histograms(self):
+        """
+        Returns a dict of duration histograms per source and per tag
+        """
+        out = {}
+        for name, row in zip(self.sources, self._src_rows):
+            out[name] = list(row[_HIST:])
+        for name, row in zip(self.tags, self._tag_rows):
+            if name and row[_COUNT]:
+                out[name] = list(row[_HIST:])
+        return out
+        
+    def report(self):
+        print('%-28s %7s %8s %9s %7s  histogram (<16us, <32us, ...)'
+              % ('source/tag', 'xfers', 'bytes', 'total us', 'max us'))
+        for names, rows in ((self.sources, self._src_rows),
+                            (self.tags, self._tag_rows)):
+            for name, row in zip(names, rows):
+                if not row[_COUNT]:
+                    continue
+                print('%-28s %7d %8d %9d %7d  %s'
+                      % (name or '(untagged)', row[_COUNT], row[_BYTES],
+                         row[_TOTAL], row[_MAX], ' '.join(str(n) for n in row[_HIST:])))
+        if self.count > self.size:
+            print('ring holds the last', self.size, 'of', self.count, 'transfers')
+
+
+def _account(row, length, dt):
+    row[_COUNT] += 1
+    row[_BYTES] += length
+    row[_TOTAL] += dt
+    if dt > row[_MAX]:
+        row[_MAX] = dt
+    b = _HIST
+    last = _HIST + HIST_BUCKETS - 1
+    dt >>= 4
+    while dt and b < last:
+        dt >>= 1
+        b += 1
+    row[b] += 1
+
+
+class TracedI2C:
+    """
+    I2C object (machine.I2C or mipy.bus.I2CDevice) whose transfers are
+    logged to a Trace while it is enabled
+    """
+    
+    def __init__(self, i2c, trace, name):
+        self.i2c = i2c
+        self.trace = trace
+        self.name = name
+        self.source = trace._source(name, self)
+        self._bind(trace.enabled)
+        
+    def _bind(self, enabled):
+        if enabled:
+            self.writeto = self._writeto
+            self.readfrom = self._readfrom
+            self.readfrom_into = self._readfrom_into
+            self.writeto_mem = self._writeto_mem
+            self.readfrom_mem = self._readfrom_mem
+            self.readfrom_mem_into = self._readfrom_mem_into
+        else:
+            i2c = self.i2c
+            self.writeto = i2c.writeto
+            self.readfrom = i2c.readfrom
+            self.readfrom_into = i2c.readfrom_into
+            self.writeto_mem = i2c.writeto_mem
+            self.readfrom_mem = i2c.readfrom_mem
+            self.readfrom_mem_into = i2c.readfrom_mem_into
+            
+    def __enter__(self):
+        self.i2c.__enter__()
+        return self
+        
+    def __exit__(self, *exc):
+        self.i2c.__exit__(*exc)
+        
+    def scan(self):
+        return self.i2c.scan()
+        
+    def _writeto(self, addr, buf, stop=True):
+        t0 = time.ticks_us()
+        n = self.i2c.writeto(addr, buf, stop)
+        self.trace.record(self.source, OP_WRITE, addr,
+                          buf[0] if len(buf) else NO_REG, len(buf), t0)
+        return n
+        
+    def _readfrom(self, addr, nbytes, stop=True):
+        t0 = time.ticks_us()
+        data = self.i2c.readfrom(addr, nbytes, stop)
+        self.trace.record(self.source, OP_READ, addr, NO_REG, nbytes, t0)
+        return data
+        
+    def _readfrom_into(self, addr, buf, stop=True):
+        t0 = time.ticks_us()
+        self.i2c.readfrom_into(addr, buf, stop)
+        self.trace.record(self.source, OP_READ, addr, NO_REG, len(buf), t0)
+        
+    def _writeto_mem(self, addr, memaddr, buf, addrsize=8):
+        t0 = time.ticks_us()
+        self.i2c.writeto_mem(addr, memaddr, buf, addrsize=addrsize)
+        self.trace.record(self.source, OP_WRITE_MEM, addr, memaddr, len(buf), t0)
+        
+    def _readfrom_mem(self, addr, memaddr, nbytes, addrsize=8):
+        t0 = time.ticks_us()
+        data = self.i2c.readfrom_mem(addr, memaddr, nbytes, addrsize=addrsize)
+        self.trace.record(self.source, OP_READ_MEM, addr, memaddr, nbytes, t0)
+        return data
+        
+    def _readfrom_mem_into(self, addr, memaddr, buf, addrsize=8):
+        t0 = time.ticks_us()
+        self.i2c.readfrom_mem_into(addr, memaddr, buf, addrsize=addrsize)
+        self.trace.record(self.source, OP_READ_MEM, addr, memaddr, len(buf), t0)
+
+
+class TracedSPI:
+    """
+    SPI object whose transfers are logged to a Trace while it is enabled.
+    SPI has no addressing, the first byte written is logged as the
+    register and the address is 0.
+    """
+    
+    def __init__(self, spi, trace, name):
+        self.spi = spi
+        self.trace = trace
+        self.name = name
+        self.source = trace._source(name, self)
+        self._bind(trace.enabled)
+        
+    def _bind(self, enabled):
+        if enabled:
+            self.write = self._write
+            self.read = self._read
+            self.readinto = self._readinto
+            self.write_readinto = self._write_readinto
+        else:
+            spi = self.spi
+            self.write = spi.write
+            self.read = spi.read
+            self.readinto = spi.readinto
+            self.write_readinto = spi.write_readinto
+            
+    def init(self, *args, **kwargs):
+        self.spi.init(*args, **kwargs)
+        
+    def deinit(self):
+        self.spi.deinit()
+        
+    def _write(self, buf):
+        t0 = time.ticks_us()
+        self.spi.write(buf)
+        self.trace.record(self.source, OP_SPI, 0,
+                          buf[0] if len(buf) else NO_REG, len(buf), t0)
+        
+    def _read(self, nbytes, write=0x00):
+        t0 = time.ticks_us()
+        data = self.spi.read(nbytes, write)
+        self.trace.record(self.source, OP_SPI, 0, NO_REG, nbytes, t0)
+        return data
+        
+    def _readinto(self, buf, write=0x00):
+        t0 = time.ticks_us()
+        self.spi.readinto(buf, write)
+        self.trace.record(self.source, OP_SPI, 0, NO_REG, len(buf), t0)
+        
+    def _write_readinto(self, write_buf, read_buf):
+        t0 = time.ticks_us()
+        self.spi.write_readinto(write_buf, read_buf)
+        self.trace.record(self.source, OP_SPI, 0,
+                          write_buf[0] if len(write_buf) else NO_REG,
+                          len(write_buf), t0)